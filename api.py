@@ -0,0 +1,311 @@
+"""Lightweight JSON API over the Shalom Blessing SHG data for mobile and field clients.
+
+A plain ASGI application with no web framework dependency. Serve it with any ASGI server
+(e.g. `uvicorn api:app`) or call it in-process with `asgi_get` for tests and scripts.
+
+Every GET response carries an ETag derived from the write versions of the tables it reads,
+so clients can revalidate with If-None-Match and get a 304 without the query being run.
+List endpoints take `page` and `page_size`; responses are gzip-compressed when accepted.
+The change feed `/api/changes` is paged by sequence number instead: pass the `last_seq` of one
+response as `after` in the next.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import re
+from datetime import date, datetime
+from urllib.parse import parse_qs
+
+from sqlalchemy import text
+
+from database import engine, get_table_versions
+from repository import get_loans_with_balances, get_member_stats, get_changes
+from search import search_member_ids
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+GZIP_MIN_BYTES = 500
+
+class APIError(Exception):
+    """An error returned to the client as a JSON body with the given HTTP status."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+# --- Routing ---
+ROUTES = []
+
+def route(pattern, tables):
+    """Registers a GET handler for a path pattern ('{name}' segments match integer ids).
+
+    `tables` lists the tables the handler reads; their write versions make up the ETag.
+    """
+    regex = re.compile("^" + re.sub(r"\{(\w+)\}", r"(?P<\1>\\d+)", pattern) + "$")
+
+    def decorator(handler):
+        ROUTES.append((regex, handler, tables))
+        return handler
+    return decorator
+
+def match_route(path):
+    """Finds the handler for a path, returning (handler, path arguments, tables)."""
+    for regex, handler, tables in ROUTES:
+        match = regex.match(path.rstrip("/") or "/")
+        if match:
+            return handler, {key: int(value) for key, value in match.groupdict().items()}, tables
+    raise APIError(404, f"No endpoint at {path}")
+
+# --- Query Helpers ---
+def get_page(query):
+    """Reads page/page_size query parameters, returning (page, page_size)."""
+    try:
+        page = max(1, int(query.get('page', 1)))
+        page_size = min(MAX_PAGE_SIZE, max(1, int(query.get('page_size', DEFAULT_PAGE_SIZE))))
+    except ValueError:
+        raise APIError(400, "page and page_size must be integers")
+    return page, page_size
+
+def get_date_param(query, name):
+    """Reads an optional YYYY-MM-DD query parameter."""
+    if not query.get(name):
+        return None
+    try:
+        return date.fromisoformat(query[name])
+    except ValueError:
+        raise APIError(400, f"{name} must be a date in YYYY-MM-DD format")
+
+def fetch_all(sql, params=None):
+    """Runs a query and returns its rows as dicts."""
+    with engine.connect() as conn:
+        return [dict(row) for row in conn.execute(text(sql), params or {}).mappings()]
+
+def paginate(sql, params, query):
+    """Runs a list query one page at a time, with the total row count."""
+    page, page_size = get_page(query)
+    with engine.connect() as conn:
+        total = conn.execute(text(f"SELECT COUNT(*) FROM ({sql})"), params).scalar()
+        rows = conn.execute(text(f"{sql} LIMIT :limit OFFSET :offset"),
+                            {**params, 'limit': page_size, 'offset': (page - 1) * page_size}).mappings()
+        items = [dict(row) for row in rows]
+    return {'items': items, 'page': page, 'page_size': page_size, 'total': total,
+            'pages': (total + page_size - 1) // page_size}
+
+def frame_to_records(df):
+    """Converts a DataFrame to JSON-ready dicts, with missing values as null."""
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+# --- Endpoints ---
+@route("/api/health", tables=[])
+def health(query):
+    return {'status': 'ok'}
+
+@route("/api/members", tables=['members'])
+def list_members(query):
+    sql = "SELECT id, name, phone, status, join_date FROM members WHERE 1=1"
+    params = {}
+    if query.get('status'):
+        sql += " AND status = :status"
+        params['status'] = query['status'].lower()
+    if query.get('q'):
+        # Fuzzy name/phone matches from the search index, returned best match first
+        sql += " AND id IN (SELECT value FROM json_each(:ids))"
+        params['ids'] = json.dumps(search_member_ids(query['q']))
+        return paginate(sql + " ORDER BY (SELECT key FROM json_each(:ids) WHERE value = members.id)", params, query)
+    return paginate(sql + " ORDER BY name", params, query)
+
+@route("/api/members/{member_id}", tables=['members', 'contributions', 'loans', 'repayments', 'attendance'])
+def get_member(query, member_id):
+    members = fetch_all("SELECT id, name, phone, status, join_date FROM members WHERE id = :mid", {'mid': member_id})
+    if not members:
+        raise APIError(404, f"Member {member_id} not found")
+    totals = frame_to_records(get_member_stats([member_id]).round(2))[0]
+    return {**members[0], 'totals': totals}
+
+@route("/api/members/{member_id}/statement",
+       tables=['members', 'contributions', 'loans', 'repayments', 'penalties', 'dividends', 'attendance', 'meetings'])
+def get_member_statement(query, member_id):
+    if not fetch_all("SELECT id FROM members WHERE id = :mid", {'mid': member_id}):
+        raise APIError(404, f"Member {member_id} not found")
+    params = {'mid': member_id, 'start': get_date_param(query, 'from') or date.min,
+              'end': get_date_param(query, 'to') or date.max}
+    loans = get_loans_with_balances(member_ids=[member_id], status=None)
+    return {
+        'member_id': member_id,
+        'contributions': fetch_all("""
+            SELECT date, votehead, amount, meeting_id FROM contributions
+            WHERE member_id = :mid AND date BETWEEN :start AND :end ORDER BY date DESC
+        """, params),
+        'loans': frame_to_records(loans.drop(columns=['member_id', 'member_name'])) if not loans.empty else [],
+        'penalties': fetch_all("""
+            SELECT date, amount, reason FROM penalties
+            WHERE member_id = :mid AND date BETWEEN :start AND :end ORDER BY date DESC
+        """, params),
+        'dividends': fetch_all("""
+            SELECT cycle_year, shares, rate_per_share, amount FROM dividends
+            WHERE member_id = :mid ORDER BY cycle_year DESC
+        """, params),
+        'attendance': fetch_all("""
+            SELECT mt.date, a.present FROM attendance a
+            JOIN meetings mt ON a.meeting_id = mt.id
+            WHERE a.member_id = :mid AND mt.date BETWEEN :start AND :end ORDER BY mt.date DESC
+        """, params),
+    }
+
+@route("/api/loans", tables=['loans', 'repayments', 'members'])
+def list_loans(query):
+    status = query.get('status', 'active')
+    member_ids = [int(query['member_id'])] if query.get('member_id') else None
+    loans = get_loans_with_balances(member_ids=member_ids, status=None if status == 'all' else status)
+    page, page_size = get_page(query)
+    page_rows = loans.iloc[(page - 1) * page_size: page * page_size]
+    return {'items': frame_to_records(page_rows), 'page': page, 'page_size': page_size, 'total': len(loans),
+            'pages': (len(loans) + page_size - 1) // page_size,
+            'total_balance': round(float(loans['balance'].sum()), 2) if not loans.empty else 0.0}
+
+@route("/api/contributions", tables=['contributions', 'members'])
+def list_contributions(query):
+    sql = """
+        SELECT c.id, c.date, c.member_id, m.name as member_name, c.votehead, c.amount, c.meeting_id
+        FROM contributions c
+        JOIN members m ON c.member_id = m.id
+        WHERE 1=1
+    """
+    params = {}
+    if query.get('member_id'):
+        sql += " AND c.member_id = :mid"
+        params['mid'] = int(query['member_id'])
+    if query.get('votehead'):
+        sql += " AND c.votehead = :votehead"
+        params['votehead'] = query['votehead'].lower()
+    if get_date_param(query, 'from'):
+        sql += " AND c.date >= :start"
+        params['start'] = get_date_param(query, 'from')
+    if get_date_param(query, 'to'):
+        sql += " AND c.date <= :end"
+        params['end'] = get_date_param(query, 'to')
+    return paginate(sql + " ORDER BY c.date DESC, c.id DESC", params, query)
+
+@route("/api/meetings", tables=['meetings', 'attendance'])
+def list_meetings(query):
+    return paginate("""
+        SELECT mt.id, mt.date, mt.notes, mt.financial_year,
+               COUNT(a.id) as members_marked,
+               COALESCE(SUM(CASE WHEN a.present THEN 1 ELSE 0 END), 0) as present_count
+        FROM meetings mt
+        LEFT JOIN attendance a ON a.meeting_id = mt.id
+        GROUP BY mt.id
+        ORDER BY mt.date DESC
+    """, {}, query)
+
+@route("/api/meetings/{meeting_id}/attendance", tables=['meetings', 'attendance', 'members'])
+def get_meeting_attendance(query, meeting_id):
+    meetings = fetch_all("SELECT id, date, notes FROM meetings WHERE id = :mid", {'mid': meeting_id})
+    if not meetings:
+        raise APIError(404, f"Meeting {meeting_id} not found")
+    attendance = fetch_all("""
+        SELECT m.id as member_id, m.name, a.present
+        FROM attendance a
+        JOIN members m ON a.member_id = m.id
+        WHERE a.meeting_id = :mid
+        ORDER BY m.name
+    """, {'mid': meeting_id})
+    return {**meetings[0], 'attendance': attendance}
+
+@route("/api/changes", tables=['change_log'])
+def list_changes(query):
+    try:
+        after_seq = int(query.get('after', 0))
+        limit = min(MAX_PAGE_SIZE, max(1, int(query.get('limit', DEFAULT_PAGE_SIZE))))
+    except ValueError:
+        raise APIError(400, "after and limit must be integers")
+    tables = [table for table in query.get('tables', '').split(',') if table] or None
+    changes = get_changes(after_seq, tables, limit + 1)
+    items = frame_to_records(changes.head(limit))
+    return {'items': items, 'last_seq': items[-1]['seq'] if items else after_seq, 'has_more': len(changes) > limit}
+
+# --- ASGI Application ---
+def json_default(value):
+    """Serializes dates and NumPy scalars for json.dumps."""
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def make_etag(path, query, versions):
+    """Builds a weak ETag from the request and the write versions of the tables it reads."""
+    key = json.dumps([path, sorted(query.items()), sorted(versions.items())])
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:24]}"'
+
+async def send_response(send, status, body=b"", headers=None):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.encode(), v.encode()) for k, v in (headers or {}).items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def app(scope, receive, send):
+    """ASGI entry point."""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    request_headers = {k.decode().lower(): v.decode() for k, v in scope.get('headers', [])}
+    headers = {'content-type': 'application/json', 'vary': 'Accept-Encoding'}
+    try:
+        if scope['method'] not in ('GET', 'HEAD'):
+            raise APIError(405, "Only GET is supported")
+        handler, path_args, tables = match_route(scope['path'])
+        query = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+
+        versions = await asyncio.to_thread(get_table_versions, tables) if tables else {}
+        etag = make_etag(scope['path'], query, versions)
+        headers.update({'etag': etag, 'cache-control': 'no-cache'})
+        if etag in [tag.strip() for tag in request_headers.get('if-none-match', '').split(',')]:
+            await send_response(send, 304, headers={k: v for k, v in headers.items() if k != 'content-type'})
+            return
+
+        status, data = 200, await asyncio.to_thread(handler, query, **path_args)
+    except APIError as e:
+        status, data = e.status, {'error': e.message}
+    except ValueError as e:
+        status, data = 400, {'error': str(e)}
+    if status != 200:
+        headers.pop('etag', None)
+        headers['cache-control'] = 'no-store'
+
+    body = json.dumps(data, default=json_default).encode()
+    if len(body) >= GZIP_MIN_BYTES and 'gzip' in request_headers.get('accept-encoding', ''):
+        body = gzip.compress(body, compresslevel=6)
+        headers['content-encoding'] = 'gzip'
+    headers['content-length'] = str(len(body))
+    await send_response(send, status, b"" if scope['method'] == 'HEAD' else body, headers)
+
+async def asgi_request(path, headers=None, method="GET"):
+    """Calls the app in-process without a server, returning (status, headers, body bytes)."""
+    route_path, _, query_string = path.partition("?")
+    scope = {'type': 'http', 'method': method, 'path': route_path, 'query_string': query_string.encode(),
+             'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    response_headers = {k.decode(): v.decode() for k, v in messages[0]['headers']}
+    return messages[0]['status'], response_headers, messages[1]['body']
+
+def asgi_get(path, headers=None):
+    """Synchronous wrapper around asgi_request for tests and scripts."""
+    return asyncio.run(asgi_request(path, headers))
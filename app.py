@@ -1,20 +1,48 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta, date
-from sqlalchemy import create_engine, text, Column, Integer, String, Float, Boolean, Date
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship, backref
-from sqlalchemy import ForeignKey
+from sqlalchemy import text, bindparam
 import os
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
 import io
 import json
+import logging
 import calendar
+import threading
+import time
+import asyncio
+import random
+import csv
+import zipfile
+from database import (
+    engine, Session, Member, Meeting, Contribution, Loan, SMSReminder, LoanInstalment, JobRun,
+    SHARE_VALUE, EMERGENCY_MONTHLY_INTEREST_RATE, DEVELOPMENT_LOAN_TERM_MONTHS, DEVELOPMENT_INTEREST_RATE,
+    get_setting, save_setting, get_setting_amount, get_table_versions,
+    calculate_loan_balances, add_months, rebuild_monthly_rollup, attached_archive,
+    acting_as, record_repayment, LoanConflictError, is_period_locked_error
+)
+from repository import (
+    get_members, get_recent_meetings, get_loans_with_balances,
+    get_member_stats, get_member_statement, get_loan_book, get_monthly_rollup, get_member_performance,
+    get_changes, get_statement_data
+)
+from search import normalize_phone_series, search_members, search_member_ids, get_member_name
+from attendance import (
+    ATTENDANCE_BITMAP_TABLES, RECENT_MEETINGS, save_meeting_attendance, get_attendance_bitmaps, attendance_summary
+)
+from simulator import CURRENT_TERMS, scenario_grid, simulate_loan_book, summarize_scenarios
+from pdfs import generate_pdf, report_story, split_statement_data, render_statement_pack
+from export import (
+    PYARROW_AVAILABLE, DEFAULT_EXPORT_DIR, export_all, get_export_manifest,
+    get_exported_loan_book, get_exported_member_performance
+)
+from backup import (
+    get_backups, create_backup, verify_backup, restore_backup, scheduled_backup, benchmark_backup
+)
+
+logger = logging.getLogger(__name__)
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -251,130 +279,7 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- Database Configuration (SQLite) ---
-DATABASE_URL = "sqlite:///shalom_blessing_v2.db"
-
-@st.cache_resource
-def get_database_engine():
-    """Initializes and returns the SQLAlchemy engine."""
-    return create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-
-engine = get_database_engine()
-Base = declarative_base()
-
-# --- Database Models ---
-class Member(Base):
-    __tablename__ = 'members'
-    id = Column(Integer, primary_key=True)
-    name = Column(String(100), nullable=False, unique=True)
-    phone = Column(String(20))
-    status = Column(String(20), default='active')
-    join_date = Column(Date, default=date.today)
-    
-class Meeting(Base):
-    __tablename__ = 'meetings'
-    id = Column(Integer, primary_key=True)
-    date = Column(Date, nullable=False, unique=True)
-    notes = Column(String(500))
-    financial_year = Column(String(10))
-
-class Attendance(Base):
-    __tablename__ = 'attendance'
-    id = Column(Integer, primary_key=True)
-    meeting_id = Column(Integer, ForeignKey('meetings.id', ondelete="CASCADE"))
-    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
-    present = Column(Boolean, default=False)
-
-class Contribution(Base):
-    __tablename__ = 'contributions'
-    id = Column(Integer, primary_key=True)
-    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
-    meeting_id = Column(Integer, ForeignKey('meetings.id', ondelete="CASCADE"), nullable=True)
-    votehead = Column(String(20)) # e.g., 'shares', 'welfare'
-    amount = Column(Float)
-    date = Column(Date, default=date.today)
-
-class Loan(Base):
-    __tablename__ = 'loans'
-    id = Column(Integer, primary_key=True)
-    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
-    type = Column(String(20)) # e.g., 'development', 'emergency'
-    amount = Column(Float)
-    interest_rate = Column(Float)
-    start_date = Column(Date)
-    due_date = Column(Date)
-    status = Column(String(20), default='active') # 'active', 'completed', 'defaulted'
-
-class Repayment(Base):
-    __tablename__ = 'repayments'
-    id = Column(Integer, primary_key=True)
-    loan_id = Column(Integer, ForeignKey('loans.id', ondelete="CASCADE"))
-    amount = Column(Float)
-    date = Column(Date, default=date.today)
-
-class Penalty(Base):
-    __tablename__ = 'penalties'
-    id = Column(Integer, primary_key=True)
-    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
-    amount = Column(Float)
-    reason = Column(String(200))
-    date = Column(Date, default=date.today)
-
-class Expense(Base):
-    __tablename__ = 'expenses'
-    id = Column(Integer, primary_key=True)
-    category = Column(String(50))
-    description = Column(String(200))
-    amount = Column(Float)
-    date = Column(Date, default=date.today)
-
-class Dividend(Base):
-    __tablename__ = 'dividends'
-    id = Column(Integer, primary_key=True)
-    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
-    amount = Column(Float)
-    cycle_year = Column(String(10))
-    shares = Column(Integer)
-    rate_per_share = Column(Float)
-    
-class Setting(Base):
-    __tablename__ = 'settings'
-    key = Column(String(50), primary_key=True)
-    value = Column(String(200))
-
-# SMS Reminder class (for future SMS integration)
-class SMSReminder(Base):
-    __tablename__ = 'sms_reminders'
-    id = Column(Integer, primary_key=True)
-    meeting_id = Column(Integer, ForeignKey('meetings.id', ondelete="CASCADE"))
-    sent_date = Column(Date)
-    status = Column(String(20), default='pending')  # pending, sent, failed
-
-Base.metadata.create_all(engine) # Create tables if they don't exist
-Session = sessionmaker(bind=engine)
-
 # --- Helper & Utility Functions ---
-SHARE_VALUE = 1000 # KSh 1000 per share
-
-def get_setting(key, default=None):
-    """Retrieves a setting from the database."""
-    session = Session()
-    setting = session.query(Setting).filter(Setting.key == key).first()
-    session.close()
-    return setting.value if setting else default
-
-def save_setting(key, value):
-    """Saves a setting to the database."""
-    session = Session()
-    setting = session.query(Setting).filter(Setting.key == key).first()
-    if setting:
-        setting.value = value
-    else:
-        setting = Setting(key=key, value=value)
-        session.add(setting)
-    session.commit()
-    session.close()
-
 def get_financial_year(date_obj=None):
     """Determines the financial year based on a given date."""
     if date_obj is None:
@@ -427,43 +332,981 @@ def get_meeting_reminder_date(meeting_date):
     """Calculates the date for sending meeting reminders (one week before)."""
     return meeting_date - timedelta(days=7)
 
-def calculate_loan_balance(loan_id):
-    """Calculates the current balance for a loan, including interest.
+def generate_loan_schedule(loan_type, amount, interest_rate, start_date, due_date=None):
+    """Builds the expected instalments for a loan.
+    
+    Development loans: equal monthly instalments over the term (12 months by default),
+    each carrying an equal share of the annual simple interest.
+    Emergency loans: a single instalment on the due date (30 days by default)
+    including one month of interest.
+    """
+    if loan_type == 'emergency':
+        instalment_due = due_date or start_date + timedelta(days=30)
+        interest = round(amount * EMERGENCY_MONTHLY_INTEREST_RATE, 2)
+        return [{
+            'instalment_no': 1,
+            'due_date': instalment_due,
+            'principal_due': round(amount, 2),
+            'interest_due': interest,
+            'amount_due': round(amount + interest, 2)
+        }]
+    
+    term_months = DEVELOPMENT_LOAN_TERM_MONTHS
+    if due_date:
+        term_months = max(1, (due_date.year - start_date.year) * 12 + (due_date.month - start_date.month))
+    total_interest = amount * ((interest_rate or 0) / 100) * term_months / 12
+    principal_each = round(amount / term_months, 2)
+    interest_each = round(total_interest / term_months, 2)
+    
+    schedule = []
+    for n in range(1, term_months + 1):
+        principal_due, interest_due = principal_each, interest_each
+        if n == term_months:
+            # Last instalment absorbs rounding so totals match exactly
+            principal_due = round(amount - principal_each * (term_months - 1), 2)
+            interest_due = round(total_interest - interest_each * (term_months - 1), 2)
+        schedule.append({
+            'instalment_no': n,
+            'due_date': add_months(start_date, n),
+            'principal_due': principal_due,
+            'interest_due': interest_due,
+            'amount_due': round(principal_due + interest_due, 2)
+        })
+    return schedule
+
+def save_loan_schedule(session, loan):
+    """Adds the instalment rows for a loan to the session (the loan must already have an id)."""
+    schedule = generate_loan_schedule(loan.type, loan.amount, loan.interest_rate, loan.start_date, loan.due_date)
+    session.add_all([LoanInstalment(loan_id=loan.id, **row) for row in schedule])
+    return schedule
+
+def create_missing_loan_schedules():
+    """Creates instalment schedules for loans recorded before schedules existed."""
+    session = Session()
+    try:
+        loans = session.query(Loan).filter(
+            ~session.query(LoanInstalment).filter(LoanInstalment.loan_id == Loan.id).exists()
+        ).all()
+        for loan in loans:
+            if loan.start_date and loan.amount:
+                save_loan_schedule(session, loan)
+        session.commit()
+        return len(loans)
+    finally:
+        session.close()
+
+@st.cache_resource
+def backfill_loan_schedules():
+    """Backfills missing loan schedules once per server process."""
+    return create_missing_loan_schedules()
+
+def allocate_repayments(instalments_df, repaid_by_loan):
+    """Allocates each loan's total repayments against its instalments, oldest first.
+    
+    Runs over the whole portfolio at once: instalments are ordered per loan and each
+    is covered by whatever remains of the loan's repayments after the earlier ones.
+    `repaid_by_loan` maps loan_id -> total repaid. Adds 'paid' and 'outstanding' columns.
+    """
+    allocated = instalments_df.sort_values(['loan_id', 'due_date', 'instalment_no']).copy()
+    cumulative_due = allocated.groupby('loan_id')['amount_due'].cumsum()
+    repaid = allocated['loan_id'].map(repaid_by_loan).fillna(0)
+    available = (repaid - (cumulative_due - allocated['amount_due'])).clip(lower=0)
+    allocated['paid'] = np.minimum(available, allocated['amount_due'])
+    allocated['outstanding'] = (allocated['amount_due'] - allocated['paid']).round(2)
+    return allocated
+
+def summarize_loan_arrears(allocated_df, as_of=None):
+    """Rolls allocated instalments up to one row per loan: expected to date, arrears and next due date."""
+    as_of = pd.Timestamp(as_of or date.today())
+    is_due = allocated_df['due_date'] <= as_of
+    in_arrears = is_due & (allocated_df['outstanding'] > 0.005)
+    per_instalment = pd.DataFrame({
+        'loan_id': allocated_df['loan_id'],
+        'scheduled_total': allocated_df['amount_due'],
+        'expected_to_date': allocated_df['amount_due'].where(is_due, 0),
+        'paid_to_date': allocated_df['paid'],
+        'arrears': allocated_df['outstanding'].where(is_due, 0),
+        'instalments_in_arrears': in_arrears.astype(int),
+        'oldest_arrears_date': allocated_df['due_date'].where(in_arrears),
+        'next_due_date': allocated_df['due_date'].where(~is_due & (allocated_df['outstanding'] > 0.005)),
+    })
+    summary = per_instalment.groupby('loan_id').agg(
+        scheduled_total=('scheduled_total', 'sum'),
+        expected_to_date=('expected_to_date', 'sum'),
+        paid_to_date=('paid_to_date', 'sum'),
+        arrears=('arrears', 'sum'),
+        instalments_in_arrears=('instalments_in_arrears', 'sum'),
+        oldest_arrears_date=('oldest_arrears_date', 'min'),
+        next_due_date=('next_due_date', 'min'),
+    ).reset_index()
+    summary['days_in_arrears'] = (as_of - pd.to_datetime(summary['oldest_arrears_date'])).dt.days.fillna(0).astype(int)
+    return summary
+
+def get_active_loan_instalments():
+    """Loads the instalment schedules of all active loans, allocated against repayments to date."""
+    instalments = pd.read_sql("""
+        SELECT i.loan_id, i.instalment_no, i.due_date, i.principal_due, i.interest_due, i.amount_due
+        FROM loan_instalments i
+        JOIN loans l ON i.loan_id = l.id
+        WHERE l.status = 'active'
+    """, engine, parse_dates=['due_date'])
+    repaid = pd.read_sql("""
+        SELECT r.loan_id, SUM(r.amount) as repaid
+        FROM repayments r
+        JOIN loans l ON r.loan_id = l.id
+        WHERE l.status = 'active'
+        GROUP BY r.loan_id
+    """, engine)
+    return allocate_repayments(instalments, repaid.set_index('loan_id')['repaid'])
+
+PAR_BUCKET_EDGES = [-np.inf, 0, 30, 60, 90, np.inf]
+PAR_BUCKET_LABELS = ['Current', '1-30 days', '31-60 days', '61-90 days', '90+ days']
+
+def get_recent_month_ends(count, today=None):
+    """Returns the last `count` completed month-end dates, oldest first."""
+    first_of_month = (today or date.today()).replace(day=1)
+    return [add_months(first_of_month, -n) - timedelta(days=1) for n in range(count - 1, -1, -1)]
+
+def compute_portfolio_at_risk(loan_book, as_of_dates):
+    """Ages outstanding loan balances at each of `as_of_dates` in one vectorized pass.
+    
+    Returns one row per loan per date on which it had a positive balance, with the balance,
+    days overdue and PAR bucket. Loans that are no longer active only count at dates before
+    their final repayment.
+    """
+    loans = loan_book.drop_duplicates('id').drop(columns=['month', 'repaid_to_month'])
+    dates = pd.DataFrame({'as_of': pd.to_datetime(list(as_of_dates)).astype('datetime64[ns]')})
+    snapshots = loans.merge(dates, how='cross')
+    snapshots = snapshots[snapshots['start_date'] <= snapshots['as_of']].sort_values('as_of')
+    
+    # Repaid as at each date = running total of the latest repayment month not after it
+    history = loan_book.dropna(subset=['month'])[['id', 'month', 'repaid_to_month']].sort_values('month')
+    history['month'] = history['month'].astype('datetime64[ns]')
+    snapshots = pd.merge_asof(snapshots, history, left_on='as_of', right_on='month', by='id')
+    snapshots['repaid_to_date'] = snapshots['repaid_to_month'].fillna(0)
+    
+    snapshots['balance'] = calculate_loan_balances(
+        snapshots.assign(total_repaid=snapshots['repaid_to_date']), snapshots['as_of']
+    )
+    still_open = (snapshots['status'] == 'active') | (snapshots['repaid_to_date'] < snapshots['total_repaid'])
+    snapshots = snapshots[still_open & (snapshots['balance'] > 0.005)].copy()
+    snapshots['days_overdue'] = (snapshots['as_of'] - snapshots['due_date']).dt.days
+    snapshots['par_bucket'] = pd.cut(snapshots['days_overdue'], bins=PAR_BUCKET_EDGES, labels=PAR_BUCKET_LABELS)
+    return snapshots.drop(columns=['month', 'repaid_to_month'])
+
+ABSENCE_PENALTY_SETTING = 'absence_penalty_amount'
+LATE_REPAYMENT_PENALTY_SETTING = 'late_repayment_penalty_amount'
+
+def apply_absence_penalties(meeting_id):
+    """Penalizes every member marked absent at a meeting, using the configured absence amount.
+    
+    Set-based and idempotent: re-running for the same meeting never duplicates a penalty,
+    and members since marked present have their generated absence penalty removed.
+    Returns the number of penalties inserted.
+    """
+    amount = get_setting_amount(ABSENCE_PENALTY_SETTING)
+    session = Session()
+    try:
+        session.execute(text("""
+            DELETE FROM penalties
+            WHERE category = 'absence' AND meeting_id = :mid
+            AND member_id IN (SELECT member_id FROM attendance WHERE meeting_id = :mid AND present)
+        """), {'mid': meeting_id})
+        inserted = 0
+        if amount > 0:
+            inserted = session.execute(text("""
+                INSERT OR IGNORE INTO penalties (member_id, amount, reason, date, category, meeting_id)
+                SELECT a.member_id, :amount, 'Absent from meeting on ' || mt.date, mt.date, 'absence', a.meeting_id
+                FROM attendance a
+                JOIN meetings mt ON a.meeting_id = mt.id
+                WHERE a.meeting_id = :mid AND NOT a.present
+            """), {'mid': meeting_id, 'amount': amount}).rowcount
+        session.commit()
+        return inserted
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def apply_late_repayment_penalties(as_of=None):
+    """Penalizes each active loan past its due date once, using the configured late repayment amount.
+    
+    Returns the number of penalties inserted (0 if no amount is configured).
+    """
+    amount = get_setting_amount(LATE_REPAYMENT_PENALTY_SETTING)
+    if amount <= 0:
+        return 0
+    session = Session()
+    try:
+        inserted = session.execute(text("""
+            INSERT OR IGNORE INTO penalties (member_id, amount, reason, date, category, loan_id)
+            SELECT l.member_id, :amount, 'Late repayment: ' || l.type || ' loan due ' || l.due_date,
+                   :as_of, 'late_repayment', l.id
+            FROM loans l
+            WHERE l.status = 'active' AND l.due_date < :as_of
+        """), {'amount': amount, 'as_of': as_of or date.today()}).rowcount
+        session.commit()
+        return inserted
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+# --- Loan Eligibility ---
+LOAN_SHARE_MULTIPLE_SETTING = 'loan_share_multiple'
+LOAN_MIN_ATTENDANCE_SETTING = 'loan_min_attendance_rate'
+DEFAULT_LOAN_SHARE_MULTIPLE = 3.0 # credit limit = 3x shares held
+DEFAULT_LOAN_MIN_ATTENDANCE = 50.0 # % of the member's last RECENT_MEETINGS marked meetings
+
+def get_loan_eligibility_rules():
+    """The configured (share multiple, minimum recent attendance %) for loan eligibility."""
+    return (get_setting_amount(LOAN_SHARE_MULTIPLE_SETTING, DEFAULT_LOAN_SHARE_MULTIPLE),
+            get_setting_amount(LOAN_MIN_ATTENDANCE_SETTING, DEFAULT_LOAN_MIN_ATTENDANCE))
+
+def compute_loan_eligibility(members, shares, active_loans, attendance, share_multiple, min_attendance_rate):
+    """Works out every member's loan eligibility at once, indexed by member id.
+    
+    The credit limit is `share_multiple` times the member's shares, and the maximum new loan is
+    what is left of it after their outstanding balances. A member is blocked while any active
+    loan is in arrears against its schedule or past its due date, or while their attendance over
+    their last RECENT_MEETINGS marked meetings is below `min_attendance_rate` (members not yet
+    marked at any meeting are not blocked for attendance).
+    `active_loans` is shaped like load_active_loans output and `attendance` like attendance_summary.
+    """
+    member_ids = pd.Index(members['id'], name='member_id')
+    by_member = active_loans.groupby('member_id')
+    past_due = (active_loans['days_to_due'] < 0) & (active_loans['balance'] > 0.005)
+    eligibility = pd.DataFrame({
+        'name': members['name'].to_numpy(),
+        'shares': shares.reindex(member_ids).fillna(0).to_numpy(),
+        'outstanding': by_member['balance'].sum().reindex(member_ids).fillna(0).to_numpy(),
+        'arrears': by_member['arrears'].sum().reindex(member_ids).fillna(0).to_numpy(),
+        'loans_past_due': past_due.groupby(active_loans['member_id']).sum().reindex(member_ids).fillna(0).astype(int).to_numpy(),
+        'attendance_rate': attendance['last_n_rate'].reindex(member_ids).to_numpy(),
+    }, index=member_ids)
+    eligibility['credit_limit'] = (eligibility['shares'] * share_multiple).round(2)
+    eligibility['max_loan'] = (eligibility['credit_limit'] - eligibility['outstanding']).clip(lower=0).round(2)
+    
+    in_arrears = (eligibility['arrears'] > 0.005) | (eligibility['loans_past_due'] > 0)
+    low_attendance = eligibility['attendance_rate'] < min_attendance_rate
+    no_headroom = eligibility['max_loan'] <= 0
+    reasons = (pd.Series(np.where(in_arrears, "In arrears on a loan; ", ""), index=member_ids)
+               + np.where(low_attendance, f"Attendance below {min_attendance_rate:g}%; ", "")
+               + np.where(no_headroom, "No credit left against shares; ", ""))
+    eligibility['eligible'] = ~(in_arrears | low_attendance | no_headroom)
+    eligibility['block_reason'] = reasons.str.rstrip('; ')
+    return eligibility
+
+# --- SMS Reminders ---
+SMS_OUTBOX_PATH = "sms_outbox.jsonl"
+SMS_BATCH_SIZE = 200
+SMS_CONCURRENCY = 10
+SMS_MAX_ATTEMPTS = 3
+SMS_RETRY_BASE_DELAY = 1.0 # seconds, doubled after each failed attempt
+
+class SMSDeliveryError(Exception):
+    """Raised by a gateway when a message could not be delivered."""
+
+class SMSGateway:
+    """Interface for SMS providers: implement `send` to deliver one message or raise SMSDeliveryError."""
+    
+    async def send(self, phone, message):
+        raise NotImplementedError
+
+class LoopbackSMSGateway(SMSGateway):
+    """Local gateway that records messages instead of sending them, for testing and benchmarks.
+    
+    Messages are kept in `sent` and, if `outbox_path` is given, appended to that file as JSON lines.
+    `latency` and `failure_rate` simulate a slow or unreliable provider.
+    """
+    
+    def __init__(self, outbox_path=None, latency=0.0, failure_rate=0.0):
+        self.outbox_path = outbox_path
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+    
+    async def send(self, phone, message):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise SMSDeliveryError("Simulated gateway failure")
+        record = {'phone': phone, 'message': message, 'sent_at': datetime.now().isoformat()}
+        self.sent.append(record)
+        if self.outbox_path:
+            with open(self.outbox_path, 'a', encoding='utf-8') as outbox:
+                outbox.write(json.dumps(record) + "\n")
+
+SMS_GATEWAYS = {
+    'loopback': lambda: LoopbackSMSGateway(outbox_path=SMS_OUTBOX_PATH),
+}
+
+def get_sms_gateway():
+    """Returns the gateway configured in settings (defaults to the local loopback outbox)."""
+    return SMS_GATEWAYS.get(get_setting('sms_gateway', 'loopback'), SMS_GATEWAYS['loopback'])()
+
+def queue_meeting_reminders(meeting_date):
+    """Enqueues one reminder message per active member with a phone number for a scheduled meeting.
     
-    Emergency loans: 2% simple interest monthly on the original amount.
-    Development loans: Annual simple interest on the original amount.
+    Idempotent: the meeting gets a single SMSReminder and each member at most one message.
+    Returns the number of messages newly queued.
     """
     session = Session()
     try:
-        loan = session.query(Loan).get(loan_id)
-        if not loan: return 0
-        total_repaid = session.execute(text("SELECT COALESCE(SUM(amount), 0) FROM repayments WHERE loan_id = :lid"), {'lid': loan_id}).scalar()
+        meeting = session.query(Meeting).filter(Meeting.date == meeting_date).first()
+        if not meeting:
+            raise ValueError(f"No meeting scheduled for {meeting_date}")
+        reminder = session.query(SMSReminder).filter(SMSReminder.meeting_id == meeting.id).first()
+        if not reminder:
+            reminder = SMSReminder(meeting_id=meeting.id, status='pending')
+            session.add(reminder)
+            session.flush()
         
-        interest = 0
-        if loan.type == 'emergency':
-            # Calculate full months elapsed since loan start
-            # If current month is before start month in the same year, or if year is before start year, months_elapsed is 0.
-            if date.today() < loan.start_date:
-                months_elapsed = 0
-            else:
-                months_elapsed = (date.today().year - loan.start_date.year) * 12 + (date.today().month - loan.start_date.month)
-            
-            # Ensure months elapsed is non-negative
-            months_elapsed = max(0, months_elapsed)
-            
-            monthly_interest_rate = 0.02 # 2% as decimal
-            interest = loan.amount * monthly_interest_rate * months_elapsed
-        else: # For development loans (or any other type)
-            # Annual simple interest
-            days_elapsed = (date.today() - loan.start_date).days
-            interest = loan.amount * (loan.interest_rate / 100) * (days_elapsed / 365)
-           
-        total_owed = loan.amount + interest
+        body = f"Shalom Blessing SHG: our next meeting is on {meeting_date.strftime('%A, %B %d, %Y')}. Please attend."
+        queued = session.execute(text("""
+            INSERT INTO sms_messages (reminder_id, member_id, phone, body, status, attempts)
+            SELECT :rid, m.id, TRIM(m.phone), 'Dear ' || m.name || ', ' || :body, 'pending', 0
+            FROM members m
+            WHERE m.status = 'active' AND TRIM(COALESCE(m.phone, '')) != ''
+            AND NOT EXISTS (SELECT 1 FROM sms_messages s WHERE s.reminder_id = :rid AND s.member_id = m.id)
+        """), {'rid': reminder.id, 'body': body}).rowcount
+        if queued:
+            reminder.status = 'pending'
+        session.commit()
+        return queued
+    finally:
+        session.close()
+
+def prepare_meeting_reminders(today=None):
+    """Queues the SMS reminders for the next meeting once its reminder date is reached."""
+    today = today or date.today()
+    next_meeting_date = get_next_meeting_date()
+    if today < get_meeting_reminder_date(next_meeting_date):
+        return f"Reminders for {next_meeting_date} open on {get_meeting_reminder_date(next_meeting_date)}"
+    try:
+        queued = queue_meeting_reminders(next_meeting_date)
+    except ValueError as e:
+        return str(e)
+    return f"{queued} reminder(s) queued for {next_meeting_date}"
+
+async def send_sms_with_retry(gateway, message, semaphore, max_attempts, base_delay):
+    """Sends one queued message, retrying with exponential backoff. Returns its status update."""
+    attempts = message['attempts']
+    error = None
+    async with semaphore:
+        for attempt in range(max_attempts):
+            attempts += 1
+            try:
+                await gateway.send(message['phone'], message['body'])
+                return {'id': message['id'], 'status': 'sent', 'attempts': attempts,
+                        'last_error': None, 'sent_at': datetime.now()}
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"[:200]
+                if attempt < max_attempts - 1:
+                    await asyncio.sleep(base_delay * 2 ** attempt)
+    return {'id': message['id'], 'status': 'failed', 'attempts': attempts, 'last_error': error, 'sent_at': None}
+
+async def send_sms_batch(gateway, messages, concurrency=SMS_CONCURRENCY,
+                         max_attempts=SMS_MAX_ATTEMPTS, base_delay=SMS_RETRY_BASE_DELAY):
+    """Sends a batch of messages with at most `concurrency` in flight at once."""
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(
+        send_sms_with_retry(gateway, message, semaphore, max_attempts, base_delay) for message in messages
+    ))
+
+def dispatch_pending_sms(gateway=None, batch_size=SMS_BATCH_SIZE, concurrency=SMS_CONCURRENCY):
+    """Sends all pending messages in batches and records the status of each.
+    
+    Returns a dict with the number of messages sent and failed.
+    """
+    gateway = gateway or get_sms_gateway()
+    totals = {'sent': 0, 'failed': 0}
+    while True:
+        with engine.connect() as conn:
+            messages = [dict(row._mapping) for row in conn.execute(text("""
+                SELECT id, phone, body, attempts FROM sms_messages
+                WHERE status = 'pending' ORDER BY id LIMIT :limit
+            """), {'limit': batch_size})]
+        if not messages:
+            break
         
-        return max(0, total_owed - total_repaid) # Recalculate based on total_owed, which includes interest
+        results = asyncio.run(send_sms_batch(gateway, messages, concurrency))
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE sms_messages
+                SET status = :status, attempts = :attempts, last_error = :last_error, sent_at = :sent_at
+                WHERE id = :id
+            """), results)
+        for result in results:
+            totals[result['status']] += 1
+    
+    # Reminders with nothing left pending are done: 'sent' only if every message went out
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE sms_reminders
+            SET status = CASE WHEN EXISTS (
+                    SELECT 1 FROM sms_messages s WHERE s.reminder_id = sms_reminders.id AND s.status = 'failed'
+                ) THEN 'failed' ELSE 'sent' END,
+                sent_date = :today
+            WHERE status = 'pending'
+            AND EXISTS (SELECT 1 FROM sms_messages s WHERE s.reminder_id = sms_reminders.id)
+            AND NOT EXISTS (
+                SELECT 1 FROM sms_messages s WHERE s.reminder_id = sms_reminders.id AND s.status = 'pending'
+            )
+        """), {'today': date.today()})
+    return totals
+
+def benchmark_sms_dispatch(message_count=1000, concurrency=SMS_CONCURRENCY, latency=0.05, failure_rate=0.0):
+    """Measures dispatcher throughput against an in-memory loopback gateway (no database writes)."""
+    gateway = LoopbackSMSGateway(latency=latency, failure_rate=failure_rate)
+    messages = [{'id': n, 'phone': f"07{n:08d}", 'body': "Benchmark message", 'attempts': 0}
+                for n in range(message_count)]
+    timer = time.perf_counter()
+    results = asyncio.run(send_sms_batch(gateway, messages, concurrency, base_delay=latency))
+    elapsed = time.perf_counter() - timer
+    return {
+        'messages': message_count,
+        'sent': sum(1 for result in results if result['status'] == 'sent'),
+        'seconds': elapsed,
+        'messages_per_second': message_count / elapsed if elapsed > 0 else float('inf')
+    }
+
+# --- Background Job Scheduler ---
+SCHEDULED_JOBS = {}
+JOB_SCHEDULER_POLL_SECONDS = 30
+
+def register_job(name, cron, func, description=""):
+    """Registers a maintenance job to run on a 5-field cron schedule (minute hour day month weekday)."""
+    parse_cron(cron) # Fail fast on a bad expression
+    SCHEDULED_JOBS[name] = {'cron': cron, 'func': func, 'description': description}
+
+def parse_cron_field(field, low, high):
+    """Expands one cron field ('*', '5', '1-5', '*/15', '1,15') into a set of values."""
+    values = set()
+    for part in field.split(','):
+        value_range, _, step = part.partition('/')
+        if value_range == '*':
+            start, end = low, high
+        elif '-' in value_range:
+            start, end = (int(v) for v in value_range.split('-'))
+        else:
+            start = end = int(value_range)
+        if start < low or end > high or start > end:
+            raise ValueError(f"Cron field '{field}' is outside {low}-{high}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+def parse_cron(expression):
+    """Parses a cron expression into (minutes, hours, days, months, weekdays, day_restricted, weekday_restricted)."""
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"Cron expression '{expression}' must have 5 fields")
+    return (
+        parse_cron_field(fields[0], 0, 59),
+        parse_cron_field(fields[1], 0, 23),
+        parse_cron_field(fields[2], 1, 31),
+        parse_cron_field(fields[3], 1, 12),
+        {d % 7 for d in parse_cron_field(fields[4], 0, 7)}, # 0 and 7 are both Sunday
+        fields[2] != '*',
+        fields[4] != '*',
+    )
+
+def cron_next_run(expression, after):
+    """Returns the first minute strictly after `after` that matches a cron expression."""
+    minutes, hours, days, months, weekdays, day_restricted, weekday_restricted = parse_cron(expression)
+    candidate = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = candidate + timedelta(days=366 * 5)
+    while candidate < limit:
+        if candidate.month not in months:
+            candidate = datetime.combine(add_months(candidate.date().replace(day=1), 1), datetime.min.time())
+            continue
+        day_match = candidate.day in days
+        weekday_match = (candidate.weekday() + 1) % 7 in weekdays # cron counts from Sunday
+        # As in cron, a restricted day-of-month and day-of-week match if either does
+        if day_restricted and weekday_restricted:
+            date_match = day_match or weekday_match
+        else:
+            date_match = day_match and weekday_match
+        if not date_match:
+            candidate = datetime.combine(candidate.date() + timedelta(days=1), datetime.min.time())
+            continue
+        if candidate.hour not in hours:
+            candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            continue
+        if candidate.minute not in minutes:
+            candidate += timedelta(minutes=1)
+            continue
+        return candidate
+    raise ValueError(f"Cron expression '{expression}' never matches")
+
+def get_job_runs():
+    """Returns the persisted last run of every job, keyed by job name."""
+    session = Session()
+    try:
+        return {run.name: run for run in session.query(JobRun).all()}
+    finally:
+        session.close()
+
+def record_job_run(name, **fields):
+    """Creates or updates a job's last-run record."""
+    session = Session()
+    try:
+        run = session.query(JobRun).get(name) or JobRun(name=name)
+        for key, value in fields.items():
+            setattr(run, key, value)
+        session.add(run)
+        session.commit()
     finally:
         session.close()
 
+_job_lock = threading.Lock()
+
+def run_job(name):
+    """Runs one registered job now, recording its runtime and outcome."""
+    job = SCHEDULED_JOBS[name]
+    with _job_lock: # Jobs run one at a time so they never contend for the database file
+        started = datetime.now()
+        record_job_run(name, last_started=started, last_status='running', last_message=None)
+        timer = time.perf_counter()
+        try:
+            with acting_as(f"job:{name}"):
+                result = job['func']()
+            status, message = 'success', '' if result is None else str(result)
+        except Exception as e:
+            status, message = 'failed', f"{type(e).__name__}: {e}"
+        record_job_run(
+            name,
+            last_finished=datetime.now(),
+            last_status=status,
+            last_message=message[:500],
+            last_duration=time.perf_counter() - timer
+        )
+        return status
+
+def get_due_jobs(now=None):
+    """Lists jobs whose next scheduled time since their last start has passed.
+    
+    Jobs that have never run are treated as last run a day ago, so a missed nightly
+    run is caught up once rather than repeatedly.
+    """
+    now = now or datetime.now()
+    runs = get_job_runs()
+    due = []
+    for name, job in SCHEDULED_JOBS.items():
+        run = runs.get(name)
+        last_started = run.last_started if run and run.last_started else now - timedelta(days=1)
+        if cron_next_run(job['cron'], last_started) <= now:
+            due.append(name)
+    return due
+
+def run_due_jobs(now=None):
+    """Runs every job that is due and returns their names."""
+    due = get_due_jobs(now)
+    for name in due:
+        run_job(name)
+    return due
+
+def job_scheduler_loop(poll_seconds):
+    """Polls for due jobs forever; exceptions are recorded per job and never stop the loop."""
+    while True:
+        try:
+            run_due_jobs()
+        except Exception: # e.g. the job_runs table could not be read; job failures are recorded by run_job
+            logger.exception("Job scheduler poll failed")
+        time.sleep(poll_seconds)
+
+@st.cache_resource
+def start_job_scheduler(poll_seconds=JOB_SCHEDULER_POLL_SECONDS):
+    """Starts the background scheduler thread once per server process, off the request path."""
+    thread = threading.Thread(target=job_scheduler_loop, args=(poll_seconds,), daemon=True, name="job-scheduler")
+    thread.start()
+    return thread
+
+def run_job_in_background(name):
+    """Runs a job on a worker thread so a page never waits for it."""
+    threading.Thread(target=run_job, args=(name,), daemon=True, name=f"job-{name}").start()
+
+register_job('late_repayment_penalties', '0 2 * * *', apply_late_repayment_penalties,
+             "Scans active loans past their due date and records late repayment penalties.")
+register_job('loan_schedule_backfill', '30 2 * * *', create_missing_loan_schedules,
+             "Creates instalment schedules for any loans that are missing one.")
+register_job('meeting_reminders', '0 7 * * *', prepare_meeting_reminders,
+             "Queues SMS reminders for the next meeting once the reminder date is reached.")
+register_job('sms_dispatch', '*/15 * * * *', dispatch_pending_sms,
+             "Sends queued SMS messages in batches through the configured gateway.")
+register_job('monthly_rollup_rebuild', '0 3 * * 0', rebuild_monthly_rollup,
+             "Recomputes the monthly totals table from the transaction history.")
+register_job('database_backup', '30 1 * * *', scheduled_backup,
+             "Takes an online, compressed snapshot of the database and rotates old snapshots.")
+if PYARROW_AVAILABLE:
+    register_job('analytics_export', '0 4 * * 0', export_all,
+                 "Writes the Parquet analytical export, partitioned by financial year.")
+
+# --- Bulk Import ---
+IMPORT_VOTEHEADS = {'shares', 'welfare', 'repayment'}
+IMPORT_DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y']
+IMPORT_PRESENT_VALUES = {'1', 'yes', 'y', 'true', 'present', 'p', 'x'}
+IMPORT_ABSENT_VALUES = {'0', 'no', 'n', 'false', 'absent', 'a'}
+
+def normalize_member_name(name):
+    """Normalizes a member name for matching: case-insensitive, single-spaced."""
+    return " ".join(str(name or "").split()).casefold()
+
+def get_member_name_index():
+    """Builds an in-memory normalized name -> member id index of all members."""
+    with engine.connect() as conn:
+        return {normalize_member_name(name): member_id
+                for member_id, name in conn.execute(text("SELECT id, name FROM members"))}
+
+def read_import_rows(uploaded_file, filename):
+    """Yields sheet rows as dicts with lower-cased headers.
+    
+    CSV files are parsed as a stream; XLSX sheets are read with pandas (requires openpyxl).
+    """
+    if filename.lower().endswith(('.xlsx', '.xls')):
+        sheet = pd.read_excel(uploaded_file, dtype=str).fillna('')
+        sheet.columns = [str(column).strip().lower() for column in sheet.columns]
+        yield from sheet.to_dict('records')
+        return
+    reader = csv.DictReader(io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        yield {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+
+def parse_import_date(value):
+    """Parses a sheet date in any of the accepted formats, or raises ValueError."""
+    for date_format in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip()[:10], date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised date '{value}'")
+
+def plan_bulk_import(rows):
+    """Validates sheet rows in batch and plans the inserts without writing anything.
+    
+    Expected columns: member, date, and optionally votehead (shares/welfare/repayment), amount,
+    loan_id (for repayments; defaults to the member's oldest active loan) and present (attendance).
+    A row that already knows its member (a statement line matched by phone) carries member_id,
+    which is used instead of looking the name up. Returns (plan, report): plan holds the rows to write per table, report is the dry-run diff.
+    """
+    name_index = get_member_name_index()
+    with engine.connect() as conn:
+        member_ids = {member_id for (member_id,) in conn.execute(text("SELECT id FROM members"))}
+        meetings = {date.fromisoformat(str(meeting_date)): meeting_id
+                    for meeting_id, meeting_date in conn.execute(text("SELECT id, date FROM meetings"))}
+        existing_attendance = {(meeting_id, member_id): (attendance_id, bool(present))
+                               for attendance_id, meeting_id, member_id, present in conn.execute(
+                                   text("SELECT id, meeting_id, member_id, present FROM attendance"))}
+    active_loans = pd.read_sql("""
+        SELECT l.id, l.member_id, l.type, l.amount, l.interest_rate, l.start_date,
+               COALESCE(SUM(r.amount), 0) as total_repaid
+        FROM loans l
+        LEFT JOIN repayments r ON r.loan_id = l.id
+        WHERE l.status = 'active'
+        GROUP BY l.id
+        ORDER BY l.start_date, l.id
+    """, engine)
+    active_loans['balance'] = calculate_loan_balances(active_loans).round(2) if not active_loans.empty else []
+    remaining_balance = dict(zip(active_loans['id'], active_loans['balance']))
+    loan_owner = dict(zip(active_loans['id'], active_loans['member_id']))
+    oldest_loan_by_member = active_loans.drop_duplicates('member_id').set_index('member_id')['id'].to_dict()
+    
+    plan = {'contributions': [], 'repayments': [], 'attendance_new': [], 'attendance_update': []}
+    report = []
+    seen_attendance = set()
+    
+    for row_number, row in enumerate(rows, start=2): # Row 1 is the header
+        member_name = row.get('member') or row.get('member name') or row.get('name') or ''
+        entry = {'Row': row_number, 'Member': member_name, 'Action': '', 'Amount (KSh)': None,
+                 'Date': None, 'Status': 'ok', 'Detail': ''}
+        errors, actions = [], []
+        row_plan = {'contributions': [], 'repayments': [], 'attendance_new': [], 'attendance_update': []}
+        repaid_loan = None
+        
+        if row.get('member_id') is not None:
+            member_id = int(row['member_id']) if int(row['member_id']) in member_ids else None
+        else:
+            member_id = name_index.get(normalize_member_name(member_name))
+        if member_id is None:
+            errors.append(f"Unknown member '{member_name}'")
+        try:
+            entry_date = parse_import_date(row.get('date', ''))
+            entry['Date'] = entry_date
+        except ValueError as e:
+            entry_date = None
+            errors.append(str(e))
+        
+        votehead = str(row.get('votehead', '')).strip().lower()
+        amount_text = str(row.get('amount', '')).replace(',', '').strip()
+        loan_text = str(row.get('loan_id', '') or row.get('repayment loan', '')).strip()
+        present_text = str(row.get('present', '')).strip().lower()
+        
+        if votehead or amount_text:
+            try:
+                amount = round(float(amount_text), 2)
+            except ValueError:
+                amount = 0
+            entry['Amount (KSh)'] = amount
+            if votehead not in IMPORT_VOTEHEADS:
+                errors.append(f"Unknown votehead '{votehead}'")
+            elif amount <= 0:
+                errors.append("Amount must be greater than zero")
+            elif votehead == 'shares' and amount < SHARE_VALUE:
+                errors.append(f"Share contributions must be at least KSh {SHARE_VALUE:,.2f}")
+            elif votehead == 'repayment':
+                try:
+                    loan_id = int(float(loan_text)) if loan_text else oldest_loan_by_member.get(member_id)
+                except ValueError:
+                    loan_id = None
+                if loan_id not in remaining_balance or loan_owner[loan_id] != member_id:
+                    errors.append(f"No matching active loan for this member{f' (loan {loan_text})' if loan_text else ''}")
+                elif amount > remaining_balance[loan_id] + 0.005:
+                    errors.append(f"Exceeds loan {loan_id} balance of KSh {remaining_balance[loan_id]:,.2f}")
+                else:
+                    repaid_loan = loan_id
+                    row_plan['repayments'].append({'loan_id': loan_id, 'amount': amount, 'date': entry_date})
+                    actions.append(f"Repayment on loan {loan_id}")
+            else:
+                row_plan['contributions'].append({'member_id': member_id, 'meeting_id': meetings.get(entry_date),
+                                                  'votehead': votehead, 'amount': amount, 'date': entry_date})
+                actions.append(f"{votehead.title()} contribution")
+        
+        if present_text:
+            meeting_id = meetings.get(entry_date)
+            is_present = present_text in IMPORT_PRESENT_VALUES
+            existing = existing_attendance.get((meeting_id, member_id))
+            if not is_present and present_text not in IMPORT_ABSENT_VALUES:
+                errors.append(f"Unrecognised attendance value '{present_text}'")
+            elif entry_date and meeting_id is None:
+                errors.append(f"No meeting on {entry_date} for attendance")
+            elif (meeting_id, member_id) in seen_attendance:
+                errors.append("Attendance for this member and meeting appears more than once")
+            elif existing is None:
+                row_plan['attendance_new'].append({'meeting_id': meeting_id, 'member_id': member_id, 'present': is_present})
+                actions.append(f"Attendance: {'present' if is_present else 'absent'}")
+            elif existing[1] != is_present:
+                row_plan['attendance_update'].append({'id': existing[0], 'meeting_id': meeting_id, 'present': is_present})
+                actions.append(f"Attendance: {'present → absent' if existing[1] else 'absent → present'}")
+            else:
+                actions.append("Attendance unchanged")
+        
+        if errors:
+            # A rejected row contributes nothing to the plan
+            entry['Status'] = 'error'
+            entry['Detail'] = "; ".join(errors)
+        elif not actions:
+            entry['Status'] = 'skipped'
+            entry['Detail'] = "Nothing to import"
+        else:
+            for table, planned_rows in row_plan.items():
+                plan[table].extend(planned_rows)
+            if present_text:
+                seen_attendance.add((meetings.get(entry_date), member_id))
+            if repaid_loan is not None:
+                remaining_balance[repaid_loan] = round(remaining_balance[repaid_loan] - entry['Amount (KSh)'], 2)
+            entry['Action'] = ", ".join(actions)
+        report.append(entry)
+    
+    return plan, pd.DataFrame(report, columns=['Row', 'Member', 'Action', 'Amount (KSh)', 'Date', 'Status', 'Detail'])
+
+def recheck_import_repayments(conn, repayments):
+    """Re-reads the balances of the loans a plan repays; returns the loans the plan pays off.
+    
+    Run under the write lock, so repayments recorded since the plan was made are seen.
+    Raises LoanConflictError if a loan is no longer active or would now be overpaid.
+    """
+    planned = pd.DataFrame(repayments).groupby('loan_id')['amount'].sum()
+    loans = pd.read_sql(text("""
+        SELECT l.id, l.type, l.amount, l.interest_rate, l.start_date, l.status,
+               COALESCE((SELECT SUM(r.amount) FROM repayments r WHERE r.loan_id = l.id), 0) as total_repaid
+        FROM loans l
+        WHERE l.id IN :loan_ids
+    """).bindparams(bindparam('loan_ids', expanding=True)), conn,
+        params={'loan_ids': [int(loan_id) for loan_id in planned.index]}).set_index('id')
+    balances = calculate_loan_balances(loans).round(2).reindex(planned.index)
+    status = loans['status'].reindex(planned.index)
+    for loan_id in planned.index[status != 'active']:
+        raise LoanConflictError(f"Loan {loan_id} is no longer active - upload the sheet again")
+    for loan_id in planned.index[planned > balances + 0.005]:
+        raise LoanConflictError(f"Loan {loan_id} now has a balance of KSh {balances[loan_id]:,.2f}, less than the "
+                                f"KSh {planned[loan_id]:,.2f} this sheet repays - upload the sheet again")
+    return set(planned.index[planned >= balances - 0.005])
+
+def apply_bulk_import(plan):
+    """Writes a validated import plan in one transaction, one executemany per table.
+    
+    The write lock is taken first (BEGIN IMMEDIATE) and the repaid loans' balances are checked
+    again inside it, as record_repayment does, so a repayment recorded after the dry run cannot
+    be overpaid. Absence penalties are then applied for every meeting whose attendance changed.
+    Returns the number of rows written per table.
+    """
+    with engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        completed_loans = recheck_import_repayments(conn, plan['repayments']) if plan['repayments'] else set()
+        if plan['contributions']:
+            conn.execute(text("""
+                INSERT INTO contributions (member_id, meeting_id, votehead, amount, date)
+                VALUES (:member_id, :meeting_id, :votehead, :amount, :date)
+            """), plan['contributions'])
+        if plan['repayments']:
+            conn.execute(text("INSERT INTO repayments (loan_id, amount, date) VALUES (:loan_id, :amount, :date)"),
+                         plan['repayments'])
+            # Bump the version so repayment forms opened before the import are rejected as stale
+            conn.execute(text("UPDATE loans SET version = version + 1 WHERE id = :id"),
+                         [{'id': loan_id} for loan_id in {row['loan_id'] for row in plan['repayments']}])
+        if completed_loans:
+            conn.execute(text("UPDATE loans SET status = 'completed' WHERE id = :id"),
+                         [{'id': int(loan_id)} for loan_id in completed_loans])
+        if plan['attendance_new']:
+            conn.execute(text("INSERT INTO attendance (meeting_id, member_id, present) VALUES (:meeting_id, :member_id, :present)"),
+                         plan['attendance_new'])
+        if plan['attendance_update']:
+            conn.execute(text("UPDATE attendance SET present = :present WHERE id = :id"), plan['attendance_update'])
+        if plan.get('statement_receipts'):
+            conn.execute(text("""
+                INSERT INTO statement_receipts (receipt, member_id, amount, date, votehead, posted_at)
+                VALUES (:receipt, :member_id, :amount, :date, :votehead, :posted_at)
+            """), plan['statement_receipts'])
+        conn.commit()
+    
+    for meeting_id in {row['meeting_id'] for row in plan['attendance_new'] + plan['attendance_update']}:
+        apply_absence_penalties(meeting_id)
+    
+    return {
+        'contributions': len(plan['contributions']),
+        'repayments': len(plan['repayments']),
+        'attendance': len(plan['attendance_new']) + len(plan['attendance_update'])
+    }
+
+# --- Mobile-Money Statement Reconciliation ---
+STATEMENT_COLUMNS = {
+    'receipt': ['receipt no.', 'receipt no', 'receipt', 'transaction id', 'trans id'],
+    'date': ['completion time', 'transaction date', 'trans time', 'date'],
+    'amount': ['paid in', 'credit', 'amount'],
+    'phone': ['phone', 'msisdn', 'sender phone', 'phone number'],
+    'details': ['details', 'description', 'narration', 'other party info'],
+    'reference': ['a/c no.', 'account no.', 'bill ref number', 'reference', 'account'],
+    'transaction_status': ['transaction status', 'status'],
+}
+STATEMENT_PHONE_PATTERN = r'(?:\+?254|\b0)([17]\d{8})\b'
+RECONCILE_DATE_WINDOW_DAYS = 3
+
+def load_mobile_money_statement(source):
+    """Loads a mobile-money (M-Pesa) statement CSV from a path or file object into standard columns.
+    
+    Recognises the usual statement headings (see STATEMENT_COLUMNS). If there is no phone column,
+    the sender's number is taken from the transaction details.
+    """
+    raw = pd.read_csv(source, dtype=str, skipinitialspace=True).fillna('')
+    headings = {str(column).strip().lower(): column for column in raw.columns}
+    statement = pd.DataFrame(index=raw.index)
+    for field, candidates in STATEMENT_COLUMNS.items():
+        column = next((headings[c] for c in candidates if c in headings), None)
+        statement[field] = raw[column].str.strip() if column is not None else ''
+    
+    missing = [field for field in ['receipt', 'date', 'amount'] if (statement[field] == '').all()]
+    if missing:
+        raise ValueError(f"Statement is missing required column(s): {', '.join(missing)}")
+    
+    statement['date'] = pd.to_datetime(statement['date'], errors='coerce', dayfirst=False).dt.normalize()
+    statement['amount'] = pd.to_numeric(statement['amount'].str.replace(',', ''), errors='coerce').fillna(0)
+    from_details = statement['details'].str.extract(STATEMENT_PHONE_PATTERN, expand=False)
+    statement['phone_key'] = normalize_phone_series(statement['phone'].where(statement['phone'] != '', from_details))
+    return statement
+
+def infer_statement_votehead(statement, default_votehead):
+    """Chooses what each line pays for from its account reference or details, else the default."""
+    text_to_search = (statement['reference'] + ' ' + statement['details']).str.lower()
+    votehead = pd.Series(default_votehead, index=statement.index)
+    votehead = votehead.mask(text_to_search.str.contains('share'), 'shares')
+    votehead = votehead.mask(text_to_search.str.contains('welfare'), 'welfare')
+    return votehead.mask(text_to_search.str.contains('loan'), 'repayment')
+
+def reconcile_statement(statement, window_days=RECONCILE_DATE_WINDOW_DAYS):
+    """Matches statement lines to members and to already-recorded contributions and repayments.
+    
+    Members are found through a phone-number hash index and existing records through a hash
+    join on (member, amount), filtered to the date window; each record matches at most one line.
+    Adds member_id, member_name, status and note columns. Statuses: 'ignored' (not money in),
+    'duplicate' (repeated or already posted receipt), 'unmatched' (no member with that phone),
+    'reconciled' (already recorded) and 'matched' (member found, ready to post).
+    """
+    result = statement.copy()
+    members = pd.read_sql("SELECT id as member_id, name as member_name, phone FROM members", engine)
+    members['phone_key'] = normalize_phone_series(members['phone'])
+    members = members[members['phone_key'] != ''].drop_duplicates('phone_key')
+    phone_index = members.set_index('phone_key')
+    result['member_id'] = result['phone_key'].map(phone_index['member_id'])
+    result['member_name'] = result['phone_key'].map(phone_index['member_name'])
+    
+    posted_receipts = set(pd.read_sql("SELECT receipt FROM statement_receipts", engine)['receipt'])
+    incoming = (result['amount'] > 0) & result['date'].notna() & ~result['transaction_status'].str.lower().isin(
+        ['failed', 'cancelled', 'reversed'])
+    duplicate = result['receipt'].duplicated(keep='first') | result['receipt'].isin(posted_receipts)
+    
+    result['status'] = 'matched'
+    result['note'] = ''
+    result.loc[result['member_id'].isna(), ['status', 'note']] = ['unmatched', 'No member with this phone number']
+    result.loc[duplicate, ['status', 'note']] = ['duplicate', 'Receipt repeated or already posted']
+    result.loc[~incoming, ['status', 'note']] = ['ignored', 'Not an incoming payment']
+    
+    candidates = result[result['status'] == 'matched']
+    if not candidates.empty:
+        start = candidates['date'].min() - pd.Timedelta(days=window_days)
+        end = candidates['date'].max() + pd.Timedelta(days=window_days)
+        records = pd.read_sql("""
+            SELECT 'contribution' as record_type, c.id as record_id, c.member_id, c.amount, c.date
+            FROM contributions c
+            WHERE c.date BETWEEN :start AND :end
+            UNION ALL
+            SELECT 'repayment' as record_type, r.id as record_id, l.member_id, r.amount, r.date
+            FROM repayments r
+            JOIN loans l ON r.loan_id = l.id
+            WHERE r.date BETWEEN :start AND :end
+        """, engine, params={'start': start.date(), 'end': end.date()}, parse_dates=['date'])
+        
+        lines = candidates[['member_id', 'amount', 'date']].reset_index(names='line')
+        lines['member_id'] = lines['member_id'].astype(int)
+        lines['amount_cents'] = (lines['amount'] * 100).round().astype(int)
+        records['amount_cents'] = (records['amount'] * 100).round().astype(int)
+        pairs = lines.merge(records.drop(columns='amount'), on=['member_id', 'amount_cents'], suffixes=('', '_record'))
+        pairs['days_apart'] = (pairs['date'] - pairs['date_record']).dt.days.abs()
+        pairs = pairs[pairs['days_apart'] <= window_days].sort_values(['days_apart', 'line'])
+        # Closest pairs first; each record and each line is used once
+        pairs = pairs.drop_duplicates(['record_type', 'record_id']).drop_duplicates('line')
+        result.loc[pairs['line'], 'status'] = 'reconciled'
+        result.loc[pairs['line'], 'note'] = [f"Recorded as {record_type} #{record_id}"
+                                             for record_type, record_id in zip(pairs['record_type'], pairs['record_id'])]
+    
+    return result
+
+def post_statement_lines(reconciled, default_votehead='shares'):
+    """Posts the 'matched' statement lines as contributions or repayments in one transaction.
+    
+    Lines go through the same validation as the bulk import; their receipts are recorded so
+    they are flagged as duplicates next time. Returns (written counts, validation report).
+    """
+    lines = reconciled[reconciled['status'] == 'matched'].copy()
+    lines['votehead'] = infer_statement_votehead(lines, default_votehead)
+    # Planned by the member matched by phone; the name is only shown in the report
+    rows = [{'member_id': member_id, 'member': name, 'date': line_date.strftime('%Y-%m-%d'), 'votehead': votehead,
+             'amount': str(amount)}
+            for member_id, name, line_date, votehead, amount in zip(
+                lines['member_id'], lines['member_name'], lines['date'], lines['votehead'], lines['amount'])]
+    plan, report = plan_bulk_import(rows)
+    accepted = lines[(report['Status'] == 'ok').values]
+    posted_at = datetime.now()
+    plan['statement_receipts'] = [
+        {'receipt': receipt, 'member_id': int(member_id), 'amount': amount, 'date': line_date.date(),
+         'votehead': votehead, 'posted_at': posted_at}
+        for receipt, member_id, amount, line_date, votehead in zip(
+            accepted['receipt'], accepted['member_id'], accepted['amount'], accepted['date'], accepted['votehead'])
+    ]
+    report.insert(1, 'Receipt', lines['receipt'].values)
+    return apply_bulk_import(plan), report
+
 def get_member_complete_details(member_id):
     """Retrieves comprehensive member details including all financial records."""
     session = Session()
@@ -473,49 +1316,12 @@ def get_member_complete_details(member_id):
         if not member:
             return None
         
-        # Contributions summary
-        contributions = pd.read_sql("""
-            SELECT c.date, c.votehead, c.amount, m.date as meeting_date
-            FROM contributions c 
-            LEFT JOIN meetings m ON c.meeting_id = m.id
-            WHERE c.member_id = :mid
-            ORDER BY c.date DESC
-        """, engine, params={'mid': member_id})
-        
-        # Loans summary
-        loans = pd.read_sql("""
-            SELECT l.id, l.type, l.amount, l.interest_rate, l.start_date, l.due_date, l.status,
-                   COALESCE(SUM(r.amount), 0) as total_repaid
-            FROM loans l
-            LEFT JOIN repayments r ON l.id = r.loan_id
-            WHERE l.member_id = :mid
-            GROUP BY l.id
-            ORDER BY l.start_date DESC
-        """, engine, params={'mid': member_id})
-        
-        # Calculate loan balances
-        if not loans.empty:
-            loans['balance'] = loans.apply(lambda row: calculate_loan_balance(row['id']), axis=1)
-        
-        # Penalties
-        penalties = pd.read_sql("""
-            SELECT date, amount, reason FROM penalties 
-            WHERE member_id = :mid ORDER BY date DESC
-        """, engine, params={'mid': member_id})
-        
-        # Dividends
-        dividends = pd.read_sql("""
-            SELECT cycle_year, shares, rate_per_share, amount FROM dividends 
-            WHERE member_id = :mid ORDER BY cycle_year DESC
-        """, engine, params={'mid': member_id})
-        
-        # Attendance summary
-        attendance = pd.read_sql("""
-            SELECT m.date, a.present FROM attendance a
-            JOIN meetings m ON a.meeting_id = m.id
-            WHERE a.member_id = :mid
-            ORDER BY m.date DESC
-        """, engine, params={'mid': member_id})
+        statement = get_member_statement(member_id)
+        contributions = statement['contributions']
+        loans = statement['loans']
+        penalties = statement['penalties']
+        dividends = statement['dividends']
+        attendance = statement['attendance']
         
         # Calculate totals
         shares_total = contributions[contributions['votehead'] == 'shares']['amount'].sum() if not contributions.empty else 0
@@ -546,146 +1352,916 @@ def get_member_complete_details(member_id):
     finally:
         session.close()
 
-def generate_pdf(story_elements, title="Report"):
-    """Generates a PDF report from ReportLab elements."""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    doc.build(story_elements)
-    buffer.seek(0)
-    return buffer
+# --- Financial Year Close ---
+# Tables whose raw rows move to the archive file, with the column that dates a row.
+# Meetings and attendance stay in the live database: they are small and every page lists them.
+ARCHIVED_TABLES = {
+    'contributions': 'date',
+    'penalties': 'date',
+    'expenses': 'date',
+    'loans': 'start_date',
+    'repayments': 'date',
+    'loan_instalments': 'due_date',
+}
 
-# --- Enhanced UI Component Functions ---
-def show_dashboard():
-    """Displays the main dashboard with key financial metrics and recent activities."""
-    st.title("📊 Dashboard Overview")
-    st.markdown("Welcome to Shalom Blessing SHG - Your complete group management solution")
+def get_financial_year_period(financial_year):
+    """Returns the first and last day of a 'YYYY-YYYY' financial year (March to February)."""
+    start_year = int(financial_year.split('-')[0])
+    return date(start_year, 3, 1), date(start_year + 1, 3, 1) - timedelta(days=1)
+
+def get_year_closes():
+    """Closed financial years, oldest first."""
+    return pd.read_sql("SELECT * FROM financial_year_closes ORDER BY period_end", engine)
+
+def get_closable_financial_years(today=None):
+    """Financial years that have ended since the last close, oldest first."""
+    today = today or date.today()
+    with engine.connect() as conn:
+        closed_through = conn.execute(text("SELECT MAX(period_end) FROM financial_year_closes")).scalar()
+        first_record = conn.execute(text("""
+            SELECT MIN(first_date) FROM (
+                SELECT MIN(date) as first_date FROM contributions
+                UNION ALL SELECT MIN(start_date) FROM loans
+                UNION ALL SELECT MIN(date) FROM meetings
+                UNION ALL SELECT MIN(date) FROM expenses
+            )
+        """)).scalar()
+    if closed_through:
+        next_day = date.fromisoformat(str(closed_through)[:10]) + timedelta(days=1)
+    elif first_record:
+        next_day = date.fromisoformat(str(first_record)[:10])
+    else:
+        return []
     
-    session = Session()
-    try:
-        # --- Key Metrics ---
-        st.subheader("📈 Financial Health Summary")
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            shares_total = session.execute(text('SELECT COALESCE(SUM(amount), 0) FROM contributions WHERE votehead = :vh'), {'vh': 'shares'}).scalar()
-            st.metric("Total Shares", f"KSh {shares_total:,.2f}", delta="↗️ Growing")
-            
-        with col2:
-            welfare_total = session.execute(text('SELECT COALESCE(SUM(amount), 0) FROM contributions WHERE votehead = :vh'), {'vh': 'welfare'}).scalar()
-            st.metric("Total Welfare", f"KSh {welfare_total:,.2f}", delta="💚 Strong")
-            
-        with col3:
-            active_loans_amount = session.execute(text('SELECT COALESCE(SUM(amount), 0) FROM loans WHERE status = :st'), {'st': 'active'}).scalar()
-            st.metric("Active Loans", f"KSh {active_loans_amount:,.2f}", delta="🏦 Lending")
-            
-        with col4:
-            dividends_paid = session.execute(text('SELECT COALESCE(SUM(amount), 0) FROM dividends')).scalar()
-            st.metric("Dividends Paid", f"KSh {dividends_paid:,.2f}", delta="💎 Returns")
+    years = []
+    financial_year = get_financial_year(next_day)
+    while get_financial_year_period(financial_year)[1] < today:
+        years.append(financial_year)
+        financial_year = get_financial_year(get_financial_year_period(financial_year)[1] + timedelta(days=1))
+    return years
 
-        st.markdown("---")
+def compute_year_end_snapshots(conn, financial_year):
+    """Closing balances at the end of a financial year: one row per member and one per loan."""
+    period_start, period_end = get_financial_year_period(financial_year)
+    params = {'start': period_start, 'end': period_end}
+    member_balances = pd.read_sql(text("""
+        SELECT m.id as member_id,
+               COALESCE(c.shares_in_year, 0) as shares_in_year,
+               COALESCE(c.welfare_in_year, 0) as welfare_in_year,
+               COALESCE(p.penalties_in_year, 0) as penalties_in_year,
+               COALESCE(c.shares_closing, 0) as shares_closing,
+               COALESCE(c.welfare_closing, 0) as welfare_closing,
+               COALESCE(a.meetings_marked, 0) as meetings_marked,
+               COALESCE(a.meetings_attended, 0) as meetings_attended
+        FROM members m
+        LEFT JOIN (
+            SELECT member_id,
+                   SUM(CASE WHEN votehead = 'shares' AND date >= :start THEN amount ELSE 0 END) as shares_in_year,
+                   SUM(CASE WHEN votehead = 'welfare' AND date >= :start THEN amount ELSE 0 END) as welfare_in_year,
+                   SUM(CASE WHEN votehead = 'shares' THEN amount ELSE 0 END) as shares_closing,
+                   SUM(CASE WHEN votehead = 'welfare' THEN amount ELSE 0 END) as welfare_closing
+            FROM contributions
+            WHERE date <= :end
+            GROUP BY member_id
+        ) c ON c.member_id = m.id
+        LEFT JOIN (
+            SELECT member_id, SUM(amount) as penalties_in_year
+            FROM penalties
+            WHERE date BETWEEN :start AND :end
+            GROUP BY member_id
+        ) p ON p.member_id = m.id
+        LEFT JOIN (
+            SELECT a.member_id, COUNT(*) as meetings_marked,
+                   SUM(CASE WHEN a.present THEN 1 ELSE 0 END) as meetings_attended
+            FROM attendance a
+            JOIN meetings mt ON a.meeting_id = mt.id
+            WHERE mt.date BETWEEN :start AND :end
+            GROUP BY a.member_id
+        ) a ON a.member_id = m.id
+        WHERE m.join_date IS NULL OR m.join_date <= :end
+    """), conn, params=params)
+    
+    loan_balances = pd.read_sql(text("""
+        SELECT l.id as loan_id, l.member_id, l.type, l.amount, l.interest_rate, l.start_date, l.status,
+               COALESCE(r.repaid_to_date, 0) as repaid_to_date,
+               COALESCE(r.repaid_in_year, 0) as repaid_in_year,
+               (SELECT MAX(date) FROM repayments WHERE loan_id = l.id) as final_repayment
+        FROM loans l
+        LEFT JOIN (
+            SELECT loan_id, SUM(amount) as repaid_to_date,
+                   SUM(CASE WHEN date >= :start THEN amount ELSE 0 END) as repaid_in_year
+            FROM repayments
+            WHERE date <= :end
+            GROUP BY loan_id
+        ) r ON r.loan_id = l.id
+        WHERE l.start_date <= :end
+    """), conn, params=params)
+    if loan_balances.empty:
+        loan_balances['closing_balance'] = pd.Series(dtype=float)
+    else:
+        # Loans completed with no repayment after the year end were settled by then
+        settled = (loan_balances['status'] != 'active') & (
+            loan_balances['final_repayment'].isna() | (loan_balances['final_repayment'] <= period_end.isoformat())
+        )
+        balances = calculate_loan_balances(loan_balances.rename(columns={'repaid_to_date': 'total_repaid'}), period_end)
+        loan_balances['closing_balance'] = balances.where(~settled, 0.0).round(2)
+        # Keep loans that were open during the year or still owed at its end
+        loan_balances = loan_balances[
+            (loan_balances['closing_balance'] > 0) | (loan_balances['repaid_in_year'] > 0)
+            | (loan_balances['start_date'] >= period_start.isoformat())
+        ]
+    
+    member_balances['loan_balance'] = member_balances['member_id'].map(
+        loan_balances.groupby('member_id')['closing_balance'].sum()).fillna(0.0)
+    loan_balances = loan_balances.drop(columns=['interest_rate', 'status', 'final_repayment'])
+    return member_balances, loan_balances
 
-        # --- Quick Stats Row ---
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            total_members = session.execute(text("SELECT COUNT(*) FROM members WHERE status='active'")).scalar()
-            st.info(f"👥 **{total_members}** Active Members")
-        with col2:
-            total_meetings = session.execute(text("SELECT COUNT(*) FROM meetings")).scalar()
-            st.info(f"📅 **{total_meetings}** Total Meetings")
-        with col3:
-            pending_penalties = session.execute(text("SELECT COUNT(*) FROM penalties")).scalar()
-            st.info(f"⚖️ **{pending_penalties}** Total Penalties")
-        with col4:
-            total_expenses = session.execute(text('SELECT COALESCE(SUM(amount), 0) FROM expenses')).scalar()
-            st.info(f"💸 **KSh {total_expenses:,.2f}** Total Expenses")
+def close_financial_year(financial_year, today=None):
+    """Freezes a financial year: saves closing balance snapshots and locks its records against edits.
+    
+    Years close in order; closing one also locks everything dated before it. Returns the number
+    of member and loan snapshot rows written.
+    """
+    if financial_year not in get_closable_financial_years(today):
+        raise ValueError(f"{financial_year} cannot be closed - it has not ended or is already closed")
+    period_start, period_end = get_financial_year_period(financial_year)
+    
+    with engine.begin() as conn:
+        member_balances, loan_balances = compute_year_end_snapshots(conn, financial_year)
+        member_balances.assign(financial_year=financial_year).to_sql(
+            'member_year_balances', conn, if_exists='append', index=False)
+        loan_balances.assign(financial_year=financial_year).to_sql(
+            'loan_year_balances', conn, if_exists='append', index=False)
+        conn.execute(text("""
+            INSERT INTO financial_year_closes (financial_year, period_start, period_end, closed_at, locked, archived_rows)
+            VALUES (:financial_year, :start, :end, :closed_at, 1, 0)
+        """), {'financial_year': financial_year, 'start': period_start, 'end': period_end, 'closed_at': datetime.now()})
+    return len(member_balances), len(loan_balances)
 
-        st.markdown("---")
+def get_year_end_snapshot(financial_year):
+    """Saved member and loan closing balances of a closed year, with member names."""
+    params = {'financial_year': financial_year}
+    member_balances = pd.read_sql(text("""
+        SELECT b.*, m.name as member_name FROM member_year_balances b
+        LEFT JOIN members m ON b.member_id = m.id
+        WHERE b.financial_year = :financial_year
+        ORDER BY m.name
+    """), engine, params=params)
+    loan_balances = pd.read_sql(text("""
+        SELECT b.*, m.name as member_name FROM loan_year_balances b
+        LEFT JOIN members m ON b.member_id = m.id
+        WHERE b.financial_year = :financial_year
+        ORDER BY b.start_date
+    """), engine, params=params)
+    return member_balances, loan_balances
 
-        # --- Alerts & Notifications ---
-        st.subheader("🔔 Important Alerts")
-        
-        # Overdue loans alert
-        overdue_loans = pd.read_sql("""
-            SELECT m.name, l.amount, l.due_date 
-            FROM loans l 
-            JOIN members m ON l.member_id = m.id 
-            WHERE l.status = 'active' AND l.due_date < ?
-        """, engine, params=(date.today(),)) 
-        
-        if not overdue_loans.empty:
-            with st.container():
-                st.error("🚨 **Overdue Loans Alert!**")
-                for _, row in overdue_loans.iterrows():
-                    days_overdue = (date.today() - row['due_date']).days
-                    st.write(f"• **{row['name']}**: KSh {row['amount']:,.2f} - **{days_overdue} days overdue**")
-        else:
-            st.success("✅ **No overdue loans!** All members are up to date.")
+def ensure_archive_tables(conn):
+    """Creates or widens the archive copies of ARCHIVED_TABLES to match the live columns."""
+    for table in ARCHIVED_TABLES:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0"))
+        archive_columns = {row[1] for row in conn.execute(text(f"PRAGMA archive.table_info({table})"))}
+        for row in conn.execute(text(f"PRAGMA main.table_info({table})")).fetchall():
+            if row[1] not in archive_columns:
+                conn.execute(text(f"ALTER TABLE archive.{table} ADD COLUMN {row[1]} {row[2]}"))
 
-        # Next meeting info
-        next_meeting_date = get_next_meeting_date()
-        reminder_date = get_meeting_reminder_date(next_meeting_date)
-        days_until_meeting = (next_meeting_date - date.today()).days
+def archive_financial_year(financial_year):
+    """Moves a closed year's raw rows into the archive database file.
+    
+    Contributions, penalties and expenses are replaced by one brought-forward row per member and
+    votehead (or category) dated on the last day of the year, so every total stays the same.
+    Loans move with their repayments and schedules once settled within the archived period.
+    Years are archived oldest first. Returns the number of rows moved.
+    """
+    closes = get_year_closes().set_index('financial_year')
+    if financial_year not in closes.index:
+        raise ValueError(f"{financial_year} must be closed before it is archived")
+    unarchived = closes[closes['archived_at'].isna()]
+    if financial_year not in unarchived.index:
+        raise ValueError(f"{financial_year} is already archived")
+    if unarchived.index[0] != financial_year:
+        raise ValueError(f"Archive {unarchived.index[0]} first - years are archived oldest first")
+    archived = closes[closes['archived_at'].notna()]
+    params = {
+        'after': archived['period_end'].max() if not archived.empty else '',
+        'end': closes.loc[financial_year, 'period_end'],
+        'note': f"Brought forward from {financial_year}",
+    }
+    
+    with attached_archive() as conn:
+        ensure_archive_tables(conn)
+        # Unlock for this transaction only; the rollup already ignores closed periods
+        conn.execute(text("UPDATE financial_year_closes SET locked = 0"))
+        conn.execute(text("""
+            CREATE TEMP TABLE archived_loans AS
+            SELECT l.id FROM loans l
+            WHERE l.status != 'active' AND l.start_date > :after AND l.start_date <= :end
+              AND NOT EXISTS (SELECT 1 FROM repayments r WHERE r.loan_id = l.id AND r.date > :end)
+        """), params)
+        moves = {
+            'contributions': "date > :after AND date <= :end",
+            'penalties': "date > :after AND date <= :end",
+            'expenses': "date > :after AND date <= :end",
+            'loans': "id IN (SELECT id FROM temp.archived_loans)",
+            'repayments': "loan_id IN (SELECT id FROM temp.archived_loans)",
+            'loan_instalments': "loan_id IN (SELECT id FROM temp.archived_loans)",
+        }
+        moved = 0
+        for table, condition in moves.items():
+            columns = ", ".join(row[1] for row in conn.execute(text(f"PRAGMA main.table_info({table})")))
+            conn.execute(text(f"INSERT INTO archive.{table} ({columns}) SELECT {columns} FROM main.{table} WHERE {condition}"), params)
+            if table == 'contributions':
+                conn.execute(text("""
+                    CREATE TEMP TABLE brought_forward AS
+                    SELECT member_id, votehead, SUM(amount) as amount FROM contributions
+                    WHERE date > :after AND date <= :end GROUP BY member_id, votehead
+                """), params)
+            moved += conn.execute(text(f"DELETE FROM main.{table} WHERE {condition}"), params).rowcount
         
-        if days_until_meeting <= 7:
-            st.warning(f"🗓️ **Upcoming Meeting:** {next_meeting_date.strftime('%A, %B %d, %Y')} - **{days_until_meeting} days away**")
-            st.info(f"📱 **Reminder Date:** {reminder_date.strftime('%A, %B %d, %Y')} - Send SMS reminders!")
-        else:
-            st.info(f"🗓️ **Next Meeting:** {next_meeting_date.strftime('%A, %B %d, %Y')} (Third Sunday)")
+        conn.execute(text("""
+            INSERT INTO contributions (member_id, meeting_id, votehead, amount, date)
+            SELECT member_id, NULL, votehead, amount, :end FROM temp.brought_forward
+        """), params)
+        conn.execute(text("""
+            INSERT INTO penalties (member_id, amount, reason, date, category)
+            SELECT member_id, SUM(amount), :note, :end, 'brought_forward' FROM archive.penalties
+            WHERE date > :after AND date <= :end GROUP BY member_id
+        """), params)
+        conn.execute(text("""
+            INSERT INTO expenses (category, description, amount, date)
+            SELECT category, :note, SUM(amount), :end FROM archive.expenses
+            WHERE date > :after AND date <= :end GROUP BY category
+        """), params)
+        conn.execute(text("DROP TABLE temp.archived_loans"))
+        conn.execute(text("DROP TABLE temp.brought_forward"))
+        conn.execute(text("""
+            UPDATE financial_year_closes SET locked = 1,
+                archived_at = CASE WHEN financial_year = :financial_year THEN :now ELSE archived_at END,
+                archived_rows = CASE WHEN financial_year = :financial_year THEN :moved ELSE archived_rows END
+        """), {'financial_year': financial_year, 'now': datetime.now(), 'moved': moved})
+        conn.commit()
+    return moved
 
-        st.markdown("---")
+def load_archived_rows(table, financial_year):
+    """Reads one archived year's raw rows of a table back from the archive file."""
+    date_column = ARCHIVED_TABLES[table]
+    period_start, period_end = get_financial_year_period(financial_year)
+    with attached_archive() as conn:
+        ensure_archive_tables(conn)
+        return pd.read_sql(text(f"""
+            SELECT * FROM archive.{table} WHERE {date_column} BETWEEN :start AND :end ORDER BY {date_column}
+        """), conn, params={'start': period_start, 'end': period_end})
 
-        # --- Enhanced Visualizations ---
-        st.subheader("📊 Financial Analytics")
+# --- Cached Page Data ---
+# Page data is cached per write version of the tables it reads (see get_table_versions), so a
+# rerun triggered by a widget only queries the database again after something was written.
+def get_data_version(tables):
+    """Cache key for data read from the given tables; changes on any write to them."""
+    return tuple(get_table_versions(tables).items())
+
+@st.cache_data(show_spinner=False)
+def load_dashboard_totals(data_version):
+    """Headline totals for the dashboard in one round trip."""
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT
+                (SELECT COALESCE(SUM(amount), 0) FROM contributions WHERE votehead = 'shares') as shares_total,
+                (SELECT COALESCE(SUM(amount), 0) FROM contributions WHERE votehead = 'welfare') as welfare_total,
+                (SELECT COALESCE(SUM(amount), 0) FROM loans WHERE status = 'active') as active_loans_amount,
+                (SELECT COALESCE(SUM(amount), 0) FROM dividends) as dividends_paid,
+                (SELECT COUNT(*) FROM members WHERE status = 'active') as total_members,
+                (SELECT COUNT(*) FROM meetings) as total_meetings,
+                (SELECT COUNT(*) FROM penalties) as pending_penalties,
+                (SELECT COALESCE(SUM(amount), 0) FROM expenses) as total_expenses
+        """)).mappings().one()
+    return dict(row)
+
+TREND_MONTHS = 24
+
+@st.cache_data(show_spinner=False)
+def load_contribution_trend(start_month, data_version):
+    """Monthly contribution totals per votehead from start_month ('YYYY-MM') on, for the trend chart."""
+    trend = get_monthly_rollup(['contributions'], start_month=start_month)
+    return trend[['month', 'votehead', 'amount']].rename(columns={'amount': 'total'})
+
+@st.cache_data(show_spinner=False)
+def load_member_list(search, status, sort_by, as_of, data_version):
+    """Members matching the filters with their batch summary stats, indexed by member id.
+    
+    A search goes through the fuzzy member index; sorted by name, its matches keep their rank order.
+    """
+    member_ids = search_member_ids(search) if search else None
+    members_df = get_members(member_ids, status=status, sort_by='join_date' if sort_by == "Join Date" else 'name')
+    members_stats = get_member_stats(members_df['id'].tolist())
+    if search and sort_by == "Name":
+        rank = {member_id: position for position, member_id in enumerate(member_ids)}
+        members_df = members_df.sort_values('id', key=lambda ids: ids.map(rank), ignore_index=True)
+    if sort_by == "Total Contributions" and not members_df.empty:
+        total_contributions = members_df['id'].map(members_stats['shares'] + members_stats['welfare'])
+        members_df = members_df.assign(total_contributions=total_contributions).sort_values(
+            'total_contributions', ascending=False)
+    return members_df, members_stats
+
+@st.cache_data(show_spinner=False)
+def load_member_loans(member_id, as_of, data_version):
+    """One member's active loans with their balances, for the repayment forms."""
+    return get_loans_with_balances(member_ids=[member_id], as_of=as_of)
+
+@st.cache_data(show_spinner=False)
+def load_attendance_summary(last_n, data_version):
+    """Active members' attendance rates and absence streaks from the attendance bitmaps, longest current streak first."""
+    summary = attendance_summary(get_attendance_bitmaps(), last_n)
+    members = get_members(status='active').set_index('id')
+    summary = summary[summary.index.isin(members.index)]
+    summary.insert(0, 'name', members['name'])
+    return summary.sort_values(['current_absence_streak', 'last_n_rate', 'name'], ascending=[False, True, True],
+                               ignore_index=True)
+
+@st.cache_data(show_spinner=False)
+def load_meeting_list(data_version):
+    """Every meeting with its attendance counts, newest first."""
+    return pd.read_sql("""
+        SELECT m.*, 
+               COUNT(a.id) as total_attendance,
+               SUM(CASE WHEN a.present THEN 1 ELSE 0 END) as present_count
+        FROM meetings m
+        LEFT JOIN attendance a ON m.id = a.meeting_id
+        GROUP BY m.id
+        ORDER BY m.date DESC
+    """, engine)
+
+@st.cache_data(show_spinner=False)
+def load_active_loans(as_of, data_version):
+    """Active loans with balances, due-date status and schedule arrears, plus their instalments."""
+    loans_df = get_loans_with_balances(status='active', as_of=as_of).sort_values(['due_date', 'id'], ignore_index=True)
+    if loans_df.empty:
+        return loans_df, pd.DataFrame()
+    
+    # Calculate status
+    loans_df['days_to_due'] = days_until(loans_df['due_date'], as_of)
+    
+    # Expected-vs-actual tracking against the instalment schedules
+    instalments_df = get_active_loan_instalments()
+    loans_df['arrears'] = 0.0
+    loans_df['instalments_in_arrears'] = 0
+    loans_df['next_due_date'] = pd.NaT
+    if not instalments_df.empty:
+        arrears_df = summarize_loan_arrears(instalments_df, as_of).set_index('loan_id')
+        for column in ['arrears', 'instalments_in_arrears', 'next_due_date']:
+            loans_df[column] = loans_df['id'].map(arrears_df[column]).fillna(loans_df[column])
+    
+    loans_df['status_icon'] = loan_status_icons(loans_df['days_to_due'], loans_df['arrears'])
+    return loans_df, instalments_df
+
+LOAN_ELIGIBILITY_TABLES = ['members', 'contributions', 'loans', 'repayments', 'loan_instalments', *ATTENDANCE_BITMAP_TABLES]
+
+@st.cache_data(show_spinner=False)
+def load_loan_eligibility(share_multiple, min_attendance_rate, as_of, data_version):
+    """Every active member's loan eligibility (see compute_loan_eligibility), by member id."""
+    members = get_members(status='active')
+    shares = pd.read_sql("""
+        SELECT member_id, SUM(amount) as shares
+        FROM contributions
+        WHERE votehead = 'shares'
+        GROUP BY member_id
+    """, engine).set_index('member_id')['shares']
+    active_loans, _ = load_active_loans(as_of, get_data_version(['loans', 'repayments', 'members', 'loan_instalments']))
+    if active_loans.empty:
+        active_loans = active_loans.assign(days_to_due=pd.Series(dtype=int), arrears=pd.Series(dtype=float))
+    attendance = attendance_summary(get_attendance_bitmaps(), RECENT_MEETINGS)
+    return compute_loan_eligibility(members, shares, active_loans, attendance, share_multiple, min_attendance_rate)
+
+RATE_SIMULATION_TABLES = ['loans', 'repayments', 'members', 'contributions', 'expenses']
+
+@st.cache_data(show_spinner=False, max_entries=20)
+def load_rate_simulation(parameters, as_of, data_version):
+    """Projects the active loan book under every scenario of a rate simulator parameter set.
+    
+    `parameters` is a tuple of (emergency rates, development rates, development terms, emergency
+    terms, months, relend rate, collection rate, reprice existing). Expenses are projected at the
+    average monthly spend of the last 12 months. Returns the scenario summary, the projection
+    arrays and the loans they cover.
+    """
+    (emergency_rates, development_rates, development_terms, emergency_terms,
+     months, relend_rate, collection_rate, reprice_existing) = parameters
+    loans = get_loans_with_balances(status='active', as_of=as_of)
+    scenarios = scenario_grid(emergency_rates, development_rates, development_terms, emergency_terms)
+    projection = simulate_loan_book(loans, scenarios, months, as_of, relend_rate, collection_rate, reprice_existing)
+    
+    with engine.connect() as conn:
+        shares_held = conn.execute(text("SELECT COALESCE(SUM(amount), 0) FROM contributions WHERE votehead = 'shares'")).scalar()
+    recent_expenses = get_monthly_rollup(['expenses'], start_month=add_months(as_of.replace(day=1), -12).strftime('%Y-%m'),
+                                         end_month=add_months(as_of.replace(day=1), -1).strftime('%Y-%m'))
+    expenses = recent_expenses['amount'].sum() / 12 * months
+    summary = summarize_scenarios(scenarios, projection, expenses, shares_held, collection_rate)
+    return summary, projection, loans[['id', 'member_id', 'member_name', 'balance']]
+
+def days_until(dates, as_of):
+    """Whole days from as_of to each date (negative once past) for a Series of dates or ISO date strings."""
+    return (pd.to_datetime(dates) - pd.Timestamp(as_of)).dt.days
+
+def loan_status_icons(days_to_due, arrears):
+    """Status icon per loan: 🚨 overdue, ⚠️ due within a week or in arrears, ✅ otherwise."""
+    return np.select([days_to_due < 0, (days_to_due <= 7) | (arrears > 0)], ["🚨", "⚠️"], "✅")
+
+def benchmark_row_operations(rows=10_000, repeat=5):
+    """Times the row-wise pandas code the loan, meeting and dashboard pages used against its vectorized form.
+    
+    Returns {operation: {'row_wise_ms', 'vectorized_ms', 'speedup'}} (best of `repeat` runs) on
+    `rows` synthetic loans/members, checking both forms give the same answer.
+    """
+    rng = np.random.default_rng(0)
+    as_of = date.today()
+    frame = pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        'name': [f"Member {n:05d}" for n in range(rows)],
+        'due_date': [(as_of + timedelta(days=int(d))).isoformat() for d in rng.integers(-60, 365, rows)],
+        'arrears': np.where(rng.random(rows) < 0.1, 500.0, 0.0),
+        'present': rng.integers(0, 2, rows),
+    })
+    frame['days_to_due'] = days_until(frame['due_date'], as_of)
+    
+    operations = {
+        'days_to_due': (
+            lambda: frame['due_date'].apply(lambda x: (datetime.strptime(x, '%Y-%m-%d').date() - as_of).days),
+            lambda: days_until(frame['due_date'], as_of),
+        ),
+        'status_icon': (
+            lambda: frame.apply(
+                lambda row: "🚨" if row['days_to_due'] < 0 else "⚠️" if row['days_to_due'] <= 7 or row['arrears'] > 0 else "✅",
+                axis=1),
+            lambda: loan_status_icons(frame['days_to_due'], frame['arrears']),
+        ),
+        'option_dict': (
+            lambda: {row['name']: row['id'] for _, row in frame.iterrows()},
+            lambda: dict(zip(frame['name'], frame['id'])),
+        ),
+        'present_count': (
+            lambda: sum(1 for _, member in frame.iterrows() if member['present']),
+            lambda: int(frame['present'].sum()),
+        ),
+    }
+    results = {}
+    for name, (row_wise, vectorized) in operations.items():
+        timings, outputs = {}, []
+        for label, func in [('row_wise_ms', row_wise), ('vectorized_ms', vectorized)]:
+            best = float('inf')
+            for _ in range(repeat):
+                timer = time.perf_counter()
+                output = func()
+                best = min(best, time.perf_counter() - timer)
+            timings[label] = best * 1000
+            outputs.append(output)
+        same = outputs[0] == outputs[1] if isinstance(outputs[0], (dict, int)) else np.array_equal(*map(np.asarray, outputs))
+        if not same:
+            raise AssertionError(f"{name}: the vectorized result differs from the row-wise one")
+        results[name] = {**timings, 'speedup': timings['row_wise_ms'] / timings['vectorized_ms']}
+    return results
+
+# --- Report Data ---
+# Each report's figures come from one cached loader, shared by the page and its PDF export.
+REPORT_TABLES = {
+    "Financial Summary": ['contributions', 'loans', 'repayments'],
+    "Member Performance": ['members', 'contributions', 'loans', 'attendance'],
+    "Loan Analysis": ['members', 'loans', 'repayments'],
+    "Attendance Report": ['members', 'meetings', 'attendance'],
+    "Monthly Statement": ['contributions', 'loans', 'repayments'], # via the monthly rollup
+}
+MEMBER_PERFORMANCE_COLUMNS = {
+    'name': 'Member Name',
+    'total_contributions': 'Total Contributions (KSh)',
+    'total_shares': 'Shares (KSh)',
+    'total_welfare': 'Welfare (KSh)',
+    'loan_count': 'Loans Taken',
+    'attendance_rate': 'Attendance (%)'
+}
+LOAN_BREAKDOWN_COLUMNS = {
+    'type': 'Loan Type',
+    'count': 'Loans',
+    'total_amount': 'Total Amount (KSh)',
+    'avg_amount': 'Average Amount (KSh)'
+}
+OVERDUE_LOAN_COLUMNS = {
+    'member_name': 'Member',
+    'type': 'Loan Type',
+    'amount': 'Amount (KSh)',
+    'balance': 'Balance (KSh)',
+    'due_date': 'Due Date',
+    'days_overdue': 'Days Overdue',
+    'par_bucket': 'Aging'
+}
+MEMBER_ATTENDANCE_COLUMNS = {
+    'name': 'Member Name',
+    'total_meetings': 'Total Meetings',
+    'attended': 'Attended',
+    'attendance_rate': 'Attendance Rate (%)'
+}
+MEETING_ATTENDANCE_COLUMNS = {
+    'date': 'Meeting Date',
+    'total_marked': 'Members Marked',
+    'present_count': 'Present',
+    'meeting_attendance_rate': 'Attendance Rate (%)'
+}
+
+def get_report_data_version(report_type, export_dir=None):
+    """Cache key for a report's data: the write versions of its tables, or the export it reads."""
+    if export_dir:
+        return (('export', get_export_manifest(export_dir)['exported_at']),)
+    return get_data_version(REPORT_TABLES[report_type])
+
+@st.cache_data(show_spinner=False)
+def load_financial_summary(start_date, end_date, data_version):
+    """Contribution, loan and repayment totals for a date range, with the summary table."""
+    params = {'start_date': start_date, 'end_date': end_date}
+    with engine.connect() as conn:
+        financial_data = conn.execute(text("""
+            SELECT 
+                COALESCE(SUM(CASE WHEN votehead = 'shares' THEN amount END), 0) as total_shares,
+                COALESCE(SUM(CASE WHEN votehead = 'welfare' THEN amount END), 0) as total_welfare,
+                COUNT(DISTINCT member_id) as contributing_members
+            FROM contributions 
+            WHERE date BETWEEN :start_date AND :end_date
+        """), params).fetchone()
+        loans_data = conn.execute(text("""
+            SELECT 
+                COALESCE(SUM(amount), 0) as loans_disbursed,
+                COUNT(*) as loans_count
+            FROM loans 
+            WHERE start_date BETWEEN :start_date AND :end_date
+        """), params).fetchone()
+        total_repayments = conn.execute(text("""
+            SELECT COALESCE(SUM(amount), 0) as total_repayments
+            FROM repayments 
+            WHERE date BETWEEN :start_date AND :end_date
+        """), params).scalar()
+    
+    summary_df = pd.DataFrame({
+        'Category': ['Member Contributions', 'Loans Disbursed', 'Loan Repayments', 'Net Cash Flow'],
+        'Shares (KSh)': [financial_data.total_shares, 0, 0, financial_data.total_shares],
+        'Welfare (KSh)': [financial_data.total_welfare, 0, 0, financial_data.total_welfare],
+        'Loans (KSh)': [0, -loans_data.loans_disbursed, total_repayments,
+                        total_repayments - loans_data.loans_disbursed],
+        'Total (KSh)': [
+            financial_data.total_shares + financial_data.total_welfare,
+            -loans_data.loans_disbursed,
+            total_repayments,
+            financial_data.total_shares + financial_data.total_welfare +
+            total_repayments - loans_data.loans_disbursed
+        ]
+    })
+    return {
+        'total_shares': financial_data.total_shares,
+        'total_welfare': financial_data.total_welfare,
+        'contributing_members': financial_data.contributing_members,
+        'loans_disbursed': loans_data.loans_disbursed,
+        'loans_count': loans_data.loans_count,
+        'total_repayments': total_repayments,
+        'summary': summary_df
+    }
+
+@st.cache_data(show_spinner=False)
+def load_member_performance(export_dir, data_version):
+    """Per-member contribution, loan and attendance totals, top contributors first."""
+    member_performance = get_exported_member_performance(export_dir) if export_dir else get_member_performance()
+    member_performance['total_contributions'] = member_performance['total_shares'] + member_performance['total_welfare']
+    member_performance['attendance_rate'] = (
+        member_performance['meetings_attended'] / 
+        member_performance['total_meetings'].replace(0, 1) * 100
+    ).round(1)
+    return member_performance
+
+@st.cache_data(show_spinner=False)
+def load_loan_analysis(export_dir, as_of, data_version):
+    """Loan book metrics, distribution, portfolio-at-risk aging and its 12-month trend (None if no loans)."""
+    loan_book = get_exported_loan_book(export_dir) if export_dir else get_loan_book()
+    if loan_book.empty:
+        return None
+    
+    loans = loan_book.drop_duplicates('id')
+    today = pd.Timestamp(as_of)
+    month_ends = get_recent_month_ends(12, as_of)
+    par = compute_portfolio_at_risk(loan_book, month_ends + [as_of])
+    current = par[par['as_of'] == today]
+    overdue = current[current['days_overdue'] > 0]
+    
+    # Repayments are summed per loan first, so each loan amount is counted once
+    total_disbursed = loans['amount'].sum()
+    metrics = {
+        'active_loans': int((loans['status'] == 'active').sum()),
+        'overdue_loans': len(overdue),
+        'average_amount': loans['amount'].mean(),
+        'collection_rate': (loans['total_repaid'].sum() / total_disbursed * 100) if total_disbursed > 0 else 0,
+        'outstanding': current['balance'].sum(),
+        'at_risk': overdue['balance'].sum(),
+        'at_risk_30': current.loc[current['days_overdue'] > 30, 'balance'].sum(),
+    }
+    breakdown = loans.groupby('type').agg(
+        count=('id', 'count'),
+        total_amount=('amount', 'sum'),
+        avg_amount=('amount', 'mean')
+    ).reset_index()
+    
+    aging_by_type = pd.DataFrame()
+    if not current.empty:
+        aging_by_type = current.pivot_table(
+            index='par_bucket', columns='type', values='balance',
+            aggfunc='sum', fill_value=0, observed=False
+        )
+        aging_by_type['Total'] = aging_by_type.sum(axis=1)
+        aging_by_type = aging_by_type.round(2)
+    aging_by_member = pd.DataFrame()
+    if not overdue.empty:
+        aging_by_member = overdue.pivot_table(
+            index='member_name', columns='par_bucket', values='balance',
+            aggfunc='sum', fill_value=0, observed=True
+        )
+        aging_by_member['Total'] = aging_by_member.sum(axis=1)
+        aging_by_member = aging_by_member.sort_values('Total', ascending=False).round(2)
+    
+    history = par[par['as_of'] != today].assign(
+        at_risk=lambda df: df['balance'].where(df['days_overdue'] > 0, 0),
+        at_risk_30=lambda df: df['balance'].where(df['days_overdue'] > 30, 0)
+    )
+    trend = history.groupby('as_of')[['balance', 'at_risk', 'at_risk_30']].sum().reindex(
+        pd.to_datetime(month_ends), fill_value=0
+    )
+    outstanding_by_month = trend['balance'].replace(0, np.nan)
+    trend['PAR > 0 (%)'] = (trend['at_risk'] / outstanding_by_month * 100).fillna(0).round(1)
+    trend['PAR > 30 (%)'] = (trend['at_risk_30'] / outstanding_by_month * 100).fillna(0).round(1)
+    trend = trend.reset_index(names='month_end')
+    trend['month_end'] = trend['month_end'].dt.strftime('%Y-%m-%d')
+    
+    return {
+        'metrics': metrics,
+        'breakdown': breakdown,
+        'aging_by_type': aging_by_type,
+        'aging_by_member': aging_by_member,
+        'overdue': overdue.sort_values('days_overdue', ascending=False)[list(OVERDUE_LOAN_COLUMNS)].round(2),
+        'trend': trend,
+    }
+
+ATTENDANCE_PERIODS = {
+    "Last 3 months": 3,
+    "Last 6 months": 6,
+    "Last 12 months": 12,
+    "This financial year": None,
+    "Custom range": None,
+}
+
+def get_attendance_period(choice, today=None):
+    """(start, end) dates of a preset attendance period, in calendar months ending today."""
+    today = today or date.today()
+    if choice == "This financial year":
+        return get_financial_year_period(get_financial_year(today))[0], today
+    return add_months(today, -ATTENDANCE_PERIODS[choice]), today
+
+@st.cache_data(show_spinner=False)
+def load_attendance_report(start, end, data_version):
+    """Attendance per active member, per meeting and as a member x meeting matrix for meetings from start to end.
+    
+    One query: the period's meetings are found by their (unique, indexed) date first, then their
+    attendance is joined through ix_attendance_meeting. Both aggregations and the heatmap matrix
+    are built from those rows in pandas. The matrix holds 1 (present), 0 (absent) or NaN (not marked),
+    one row per active member labelled by name, lowest attendance first.
+    """
+    marks = pd.read_sql(text("""
+        WITH period_meetings AS (
+            SELECT id, date FROM meetings WHERE date >= :start AND date <= :end
+        )
+        SELECT pm.id as meeting_id, pm.date, a.member_id, m.name, m.status, a.present
+        FROM period_meetings pm
+        LEFT JOIN attendance a ON a.meeting_id = pm.id
+        LEFT JOIN members m ON m.id = a.member_id
+    """), engine, params={'start': start, 'end': end})
+    marks['present'] = marks['present'].astype(float)
+    
+    meeting_attendance = marks.groupby(['meeting_id', 'date'], as_index=False).agg(
+        total_marked=('member_id', 'count'), present_count=('present', 'sum'))
+    meeting_attendance['present_count'] = meeting_attendance['present_count'].astype(int)
+    meeting_attendance['meeting_attendance_rate'] = (
+        meeting_attendance['present_count'] * 100 / meeting_attendance['total_marked'].replace(0, np.nan)).round(1)
+    meeting_attendance = meeting_attendance.sort_values('date', ascending=False, ignore_index=True).drop(columns='meeting_id')
+    
+    active_marks = marks[marks['status'] == 'active']
+    attendance_stats = active_marks.groupby(['member_id', 'name'], as_index=False).agg(
+        total_meetings=('present', 'size'), attended=('present', 'sum'))
+    attendance_stats['attended'] = attendance_stats['attended'].astype(int)
+    attendance_stats['attendance_rate'] = (attendance_stats['attended'] * 100 / attendance_stats['total_meetings']).round(1)
+    attendance_stats = attendance_stats.sort_values(['attendance_rate', 'name'], ascending=[False, True], ignore_index=True)
+    
+    # Pivot on member_id so members sharing a name keep their own rows; label the rows by name
+    lowest_first = attendance_stats.sort_values(['attendance_rate', 'name'])
+    heatmap = active_marks.pivot_table(index='member_id', columns='date', values='present', aggfunc='max')
+    heatmap = heatmap.reindex(lowest_first['member_id']).set_axis(lowest_first['name'], axis='index')
+    return attendance_stats.drop(columns='member_id'), meeting_attendance, heatmap
+
+@st.cache_data(show_spinner=False)
+def load_monthly_statement(month_key, data_version):
+    """Opening balances, the month's flows and closing balances for one month ('YYYY-MM')."""
+    # Opening balances and the month's flows from the monthly rollup
+    rollup = get_monthly_rollup(['contributions', 'disbursements', 'repayments'], end_month=month_key)
+    in_month = rollup['month'] == month_key
+    is_shares = (rollup['flow'] == 'contributions') & (rollup['votehead'] == 'shares')
+    is_welfare = (rollup['flow'] == 'contributions') & (rollup['votehead'] == 'welfare')
+    
+    opening_shares = rollup.loc[is_shares & ~in_month, 'amount'].sum()
+    opening_welfare = rollup.loc[is_welfare & ~in_month, 'amount'].sum()
+    
+    # Current month transactions
+    month_shares = rollup.loc[is_shares & in_month, 'amount'].sum()
+    month_welfare = rollup.loc[is_welfare & in_month, 'amount'].sum()
+    month_loans_disbursed = rollup.loc[(rollup['flow'] == 'disbursements') & in_month, 'amount'].sum()
+    month_repayments = rollup.loc[(rollup['flow'] == 'repayments') & in_month, 'amount'].sum()
+    
+    return pd.DataFrame({
+        'Description': [
+            'Opening Balance - Shares',
+            'Opening Balance - Welfare',
+            'Monthly Shares Contributions',
+            'Monthly Welfare Contributions',
+            'Loans Disbursed',
+            'Loan Repayments Received',
+            'Closing Balance - Shares',
+            'Closing Balance - Welfare',
+            'Net Cash Position'
+        ],
+        'Amount (KSh)': [
+            f"{opening_shares:,.2f}",
+            f"{opening_welfare:,.2f}",
+            f"{month_shares:,.2f}",
+            f"{month_welfare:,.2f}",
+            f"-{month_loans_disbursed:,.2f}",
+            f"{month_repayments:,.2f}",
+            f"{opening_shares + month_shares:,.2f}",
+            f"{opening_welfare + month_welfare:,.2f}",
+            f"{opening_shares + opening_welfare + month_shares + month_welfare - month_loans_disbursed + month_repayments:,.2f}"
+        ]
+    })
+
+def report_pdf_sections(report_type, params, data_version):
+    """Subtitle and (heading, DataFrame, columns) sections of a report's PDF."""
+    if report_type == "Financial Summary":
+        start_date, end_date = params
+        summary = load_financial_summary(start_date, end_date, data_version)
+        return f"{start_date:%d %b %Y} to {end_date:%d %b %Y}", [
+            ("Totals", pd.DataFrame({'Item': ['Contributing Members', 'Loans Disbursed (count)'],
+                                     'Value': [summary['contributing_members'], summary['loans_count']]}), None),
+            ("Summary", summary['summary'], None),
+        ]
+    if report_type == "Member Performance":
+        member_performance = load_member_performance(params[0], data_version)
+        return "All active members", [
+            ("All Members Performance", member_performance, MEMBER_PERFORMANCE_COLUMNS),
+        ]
+    if report_type == "Loan Analysis":
+        export_dir, as_of = params
+        analysis = load_loan_analysis(export_dir, as_of, data_version)
+        if analysis is None:
+            return f"As of {as_of:%d %b %Y}", []
+        metrics = analysis['metrics']
+        return f"As of {as_of:%d %b %Y}", [
+            ("Overview", pd.DataFrame({
+                'Measure': ['Active Loans', 'Overdue Loans', 'Average Loan Amount (KSh)', 'Collection Rate (%)',
+                            'Outstanding Balance (KSh)', 'At Risk > 0 days (KSh)', 'At Risk > 30 days (KSh)'],
+                'Value': [str(metrics['active_loans']), str(metrics['overdue_loans']), f"{metrics['average_amount']:,.2f}",
+                          f"{metrics['collection_rate']:.1f}", f"{metrics['outstanding']:,.2f}",
+                          f"{metrics['at_risk']:,.2f}", f"{metrics['at_risk_30']:,.2f}"]
+            }), None),
+            ("Loan Distribution", analysis['breakdown'], LOAN_BREAKDOWN_COLUMNS),
+            ("Portfolio at Risk by Loan Type (KSh)", analysis['aging_by_type'].reset_index(names='Aging'), None),
+            ("Overdue Balances by Member (KSh)", analysis['aging_by_member'].reset_index(names='Member'), None),
+            ("Overdue Loans", analysis['overdue'], OVERDUE_LOAN_COLUMNS),
+            ("PAR Trend (Last 12 Month-Ends)", analysis['trend'],
+             {'month_end': 'Month End', 'balance': 'Outstanding (KSh)', 'PAR > 0 (%)': 'PAR > 0 (%)',
+              'PAR > 30 (%)': 'PAR > 30 (%)'}),
+        ]
+    if report_type == "Attendance Report":
+        start, end = params
+        attendance_stats, meeting_attendance, _ = load_attendance_report(start, end, data_version)
+        return f"Meetings from {start:%d %b %Y} to {end:%d %b %Y}", [
+            ("Member Attendance", attendance_stats, MEMBER_ATTENDANCE_COLUMNS),
+            ("Meeting-wise Attendance", meeting_attendance, MEETING_ATTENDANCE_COLUMNS),
+        ]
+    if report_type == "Monthly Statement":
+        year, month = params
+        return f"{calendar.month_name[month]} {year}", [
+            ("Statement", load_monthly_statement(f"{year}-{month:02d}", data_version), None),
+        ]
+    raise ValueError(f"Unknown report: {report_type}")
+
+@st.cache_data(show_spinner=False, max_entries=50)
+def render_report_pdf(report_type, params, data_version):
+    """PDF bytes of a report, cached per (report, parameters, data version) so downloads are instant."""
+    subtitle, sections = report_pdf_sections(report_type, params, data_version)
+    return generate_pdf(report_story(f"{report_type} Report", subtitle, sections), f"{report_type} Report").getvalue()
+
+# --- Enhanced UI Component Functions ---
+def describe_write_error(error):
+    """Message for a failed save: a plain sentence for a closed financial year, else the error itself."""
+    if is_period_locked_error(error):
+        return "This record falls in a closed financial year, which can no longer be changed."
+    return str(error)
+
+def hide_panel(state_key):
+    """Button callback closing an inline details panel before its fragment reruns."""
+    st.session_state[state_key] = False
+
+MEMBER_PICKER_LIMIT = 20
+
+def preselect_best_member(key, status):
+    """Search-box callback choosing the best match for the new query in a member_picker."""
+    query = st.session_state[f"{key}_query"]
+    matches = search_members(query, 1, status) if query else []
+    st.session_state[f"{key}_select"] = int(matches['id'].iloc[0]) if len(matches) else None
+
+def member_picker(label, key, status='active'):
+    """Searchable member selectbox; returns the chosen member's id, or None until one is chosen.
+    
+    Only the best MEMBER_PICKER_LIMIT matches for the typed name or phone number are offered,
+    straight from the in-memory search index, so it stays quick however big the roster. The best
+    match is preselected once something is typed. Widgets in a form only rerun on submit, so
+    place the picker above the form it feeds.
+    """
+    query = st.text_input(f"🔍 Find {label.lower()}", key=f"{key}_query", placeholder="Type a name or phone number",
+                          on_change=preselect_best_member, args=(key, status))
+    matches = search_members(query, MEMBER_PICKER_LIMIT, status)
+    labels = dict(zip(matches['id'].astype(int), matches['name'] + matches['phone'].fillna('').map(
+        lambda phone: f" ({phone})" if phone else "")))
+    return st.selectbox(label, options=list(labels), format_func=labels.get, index=None,
+                        placeholder="Choose a member", key=f"{key}_select")
+
+def show_dashboard():
+    """Displays the main dashboard with key financial metrics and recent activities."""
+    st.title("📊 Dashboard Overview")
+    st.markdown("Welcome to Shalom Blessing SHG - Your complete group management solution")
+    
+    session = Session()
+    try:
+        totals = load_dashboard_totals(get_data_version(
+            ['contributions', 'loans', 'dividends', 'members', 'meetings', 'penalties', 'expenses']))
+        shares_total = totals['shares_total']
+        welfare_total = totals['welfare_total']
+        active_loans_amount = totals['active_loans_amount']
+        total_expenses = totals['total_expenses']
         
-        # Create two columns for charts
-        col1, col2 = st.columns(2)
+        # --- Key Metrics ---
+        st.subheader("📈 Financial Health Summary")
+        col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.markdown("##### 💰 Monthly Contributions Trend")
-            contrib_data = pd.read_sql("""
-                SELECT strftime('%Y-%m', date) as month, 
-                       votehead, 
-                       SUM(amount) as total 
-                FROM contributions 
-                GROUP BY month, votehead 
-                ORDER BY month DESC
-                LIMIT 24
-            """, engine)
+            st.metric("Total Shares", f"KSh {shares_total:,.2f}", delta="↗️ Growing")
             
-            if not contrib_data.empty:
-                fig = px.line(contrib_data, x='month', y='total', color='votehead', 
-                             title="Contributions Trend", markers=True,
-                             color_discrete_sequence=['#667eea', '#764ba2', '#f093fb'])
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='#1e293b')
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("📊 No contribution data available yet.")
-        
         with col2:
-            st.markdown("##### 📈 Financial Overview")
-            # Create a summary chart
-            financial_summary = pd.DataFrame({
-                'Category': ['Shares', 'Welfare', 'Loans', 'Expenses'],
-                'Amount': [shares_total, welfare_total, active_loans_amount, total_expenses],
-                'Color': ['#667eea', '#764ba2', '#f093fb', '#ffeaa7']
-            })
+            st.metric("Total Welfare", f"KSh {welfare_total:,.2f}", delta="💚 Strong")
             
-            if financial_summary['Amount'].sum() > 0:
-                fig = px.pie(financial_summary, values='Amount', names='Category',
-                           title="Financial Distribution",
-                           color_discrete_sequence=['#667eea', '#764ba2', '#f093fb', '#ffeaa7'])
-                fig.update_layout(
-                    plot_bgcolor='rgba(0,0,0,0)',
-                    paper_bgcolor='rgba(0,0,0,0)',
-                    font=dict(color='#1e293b')
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("📊 No financial data available yet.")
+        with col3:
+            st.metric("Active Loans", f"KSh {active_loans_amount:,.2f}", delta="🏦 Lending")
+            
+        with col4:
+            st.metric("Dividends Paid", f"KSh {totals['dividends_paid']:,.2f}", delta="💎 Returns")
+
+        st.markdown("---")
+
+        # --- Quick Stats Row ---
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.info(f"👥 **{totals['total_members']}** Active Members")
+        with col2:
+            st.info(f"📅 **{totals['total_meetings']}** Total Meetings")
+        with col3:
+            st.info(f"⚖️ **{totals['pending_penalties']}** Total Penalties")
+        with col4:
+            st.info(f"💸 **KSh {total_expenses:,.2f}** Total Expenses")
+
+        st.markdown("---")
+
+        # --- Alerts & Notifications ---
+        st.subheader("🔔 Important Alerts")
+        
+        # Overdue loans alert
+        overdue_loans = pd.read_sql("""
+            SELECT m.name, l.amount, l.due_date 
+            FROM loans l 
+            JOIN members m ON l.member_id = m.id 
+            WHERE l.status = 'active' AND l.due_date < ?
+            ORDER BY l.due_date
+        """, engine, params=(date.today().isoformat(),), parse_dates=['due_date'])
+        
+        if not overdue_loans.empty:
+            with st.container():
+                st.error("🚨 **Overdue Loans Alert!**")
+                days_overdue = -days_until(overdue_loans['due_date'], date.today())
+                for name, amount, days in zip(overdue_loans['name'], overdue_loans['amount'], days_overdue):
+                    st.write(f"• **{name}**: KSh {amount:,.2f} - **{days} days overdue**")
+        else:
+            st.success("✅ **No overdue loans!** All members are up to date.")
+
+        # Next meeting info
+        show_next_meeting_alert()
+
+        st.markdown("---")
+
+        # --- Enhanced Visualizations ---
+        show_financial_analytics(shares_total, welfare_total, active_loans_amount, total_expenses)
 
         # Recent Activity
         st.subheader("🕒 Recent Activity")
@@ -723,6 +2299,74 @@ def show_dashboard():
     finally:
         session.close()
 
+@st.fragment
+def show_next_meeting_alert():
+    """Next meeting banner; sending reminders reruns only this section."""
+    next_meeting_date = get_next_meeting_date()
+    reminder_date = get_meeting_reminder_date(next_meeting_date)
+    days_until_meeting = (next_meeting_date - date.today()).days
+    
+    if days_until_meeting <= 7:
+        st.warning(f"🗓️ **Upcoming Meeting:** {next_meeting_date.strftime('%A, %B %d, %Y')} - **{days_until_meeting} days away**")
+        st.info(f"📱 **Reminder Date:** {reminder_date.strftime('%A, %B %d, %Y')} - Send SMS reminders!")
+        if st.button("📱 Send SMS Reminders", key="send_sms_reminders"):
+            try:
+                queued = queue_meeting_reminders(next_meeting_date)
+                run_job_in_background('sms_dispatch')
+                st.success(f"✅ {queued} reminder(s) queued - sending in the background.")
+            except ValueError as e:
+                st.error(f"❌ {e}. Schedule the meeting first.")
+    else:
+        st.info(f"🗓️ **Next Meeting:** {next_meeting_date.strftime('%A, %B %d, %Y')} (Third Sunday)")
+
+@st.fragment
+def show_financial_analytics(shares_total, welfare_total, active_loans_amount, total_expenses):
+    """Dashboard charts, drawn from cached data."""
+    st.subheader("📊 Financial Analytics")
+    
+    # Create two columns for charts
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("##### 💰 Monthly Contributions Trend")
+        trend_start = add_months(date.today().replace(day=1), 1 - TREND_MONTHS).strftime('%Y-%m')
+        contrib_data = load_contribution_trend(trend_start, get_data_version(['contributions']))
+        
+        if not contrib_data.empty:
+            fig = px.line(contrib_data, x='month', y='total', color='votehead', 
+                         title="Contributions Trend", markers=True,
+                         color_discrete_sequence=['#667eea', '#764ba2', '#f093fb'])
+            fig.update_layout(
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                font=dict(color='#1e293b')
+            )
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("📊 No contribution data available yet.")
+    
+    with col2:
+        st.markdown("##### 📈 Financial Overview")
+        # Create a summary chart
+        financial_summary = pd.DataFrame({
+            'Category': ['Shares', 'Welfare', 'Loans', 'Expenses'],
+            'Amount': [shares_total, welfare_total, active_loans_amount, total_expenses],
+            'Color': ['#667eea', '#764ba2', '#f093fb', '#ffeaa7']
+        })
+        
+        if financial_summary['Amount'].sum() > 0:
+            fig = px.pie(financial_summary, values='Amount', names='Category',
+                       title="Financial Distribution",
+                       color_discrete_sequence=['#667eea', '#764ba2', '#f093fb', '#ffeaa7'])
+            fig.update_layout(
+                plot_bgcolor='rgba(0,0,0,0)',
+                paper_bgcolor='rgba(0,0,0,0)',
+                font=dict(color='#1e293b')
+            )
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("📊 No financial data available yet.")
+
 def show_members():
     """Displays and manages member information."""
     st.title("👥 Members Management")
@@ -730,7 +2374,7 @@ def show_members():
     # Enhanced search with filters
     col1, col2, col3 = st.columns([3, 1, 1])
     with col1:
-        search_query = st.text_input("🔍 Search members by name...", placeholder="Enter member name")
+        search_query = st.text_input("🔍 Search members by name or phone...", placeholder="Enter a name or phone number")
     with col2:
         status_filter = st.selectbox("Status", ["All", "Active", "Inactive"])
     with col3:
@@ -738,26 +2382,14 @@ def show_members():
 
     session = Session()
     try:
-        # Build query based on filters
-        query = "SELECT * FROM members WHERE 1=1"
-        params = []
-        
-        if search_query:
-            query += " AND name LIKE ?"
-            params.append(f"%{search_query}%")
-        
-        if status_filter != "All":
-            query += " AND status = ?"
-            params.append(status_filter.lower())
-        
-        if sort_by == "Name":
-            query += " ORDER BY name"
-        elif sort_by == "Join Date":
-            query += " ORDER BY join_date DESC"
-        else:
-            query += " ORDER BY name"  # Default for contributions sorting
-        
-        members_df = pd.read_sql(query, engine, params=params)
+        # Members and their summary stats, batch-loaded and cached until a relevant write
+        members_df, members_stats = load_member_list(
+            search_query,
+            status_filter.lower() if status_filter != "All" else None,
+            sort_by,
+            date.today(),
+            get_data_version(['members', 'contributions', 'loans', 'repayments', 'attendance'])
+        )
         
         if members_df.empty:
             st.info("No members found matching your criteria.")
@@ -796,86 +2428,49 @@ def show_members():
         st.subheader(f"📋 Members List ({len(members_df)} found)")
         
         for _, member in members_df.iterrows():
-            # Get member summary stats
-            member_stats = get_member_summary_stats(member['id'])
-            
-            with st.container():
-                st.markdown(f"""
-                <div class="member-card">
-                    <div style="display: flex; justify-content: between; align-items: center;">
-                        <div>
-                            <h3 style="margin: 0; color: #1e293b;">👤 {member['name']}</h3>
-                            <p style="margin: 5px 0; color: #64748b;">
-                                📞 {member['phone'] or 'No phone'} | 
-                                📅 Joined: {member['join_date']} | 
-                                Status: <span style="color: {'#16a34a' if member['status'] == 'active' else '#dc2626'};">
-                                    {member['status'].title()}
-                                </span>
-                            </p>
-                        </div>
-                    </div>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Quick stats row
-                col1, col2, col3, col4, col5 = st.columns(5)
-                with col1:
-                    st.metric("Shares", f"KSh {member_stats['shares']:,.0f}")
-                with col2:
-                    st.metric("Welfare", f"KSh {member_stats['welfare']:,.0f}")
-                with col3:
-                    st.metric("Loan Balance", f"KSh {member_stats['loan_balance']:,.0f}")
-                with col4:
-                    st.metric("Attendance", f"{member_stats['attendance_rate']:.1f}%")
-                with col5:
-                    if st.button("View Details", key=f"view_{member['id']}", type="secondary"):
-                        st.session_state.selected_member_id = member['id']
-                        st.session_state.show_member_details = True
-        
-        # Show member details modal
-        if st.session_state.get('show_member_details') and st.session_state.get('selected_member_id'):
-            show_member_details_modal(st.session_state.selected_member_id)
+            show_member_card(member, members_stats.loc[member['id']])
     
     finally:
         session.close()
 
-def get_member_summary_stats(member_id):
-    """Retrieves quick summary statistics for a member."""
-    session = Session()
-    try:
-        shares = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM contributions 
-            WHERE member_id = :mid AND votehead = 'shares'
-        """), {'mid': member_id}).scalar()
-        
-        welfare = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM contributions 
-            WHERE member_id = :mid AND votehead = 'welfare'
-        """), {'mid': member_id}).scalar()
-        
-        # Calculate total loan balance
-        loans = session.execute(text("""
-            SELECT id FROM loans WHERE member_id = :mid AND status = 'active'
-        """), {'mid': member_id}).fetchall()
-        
-        loan_balance = sum(calculate_loan_balance(loan[0]) for loan in loans)
-        
-        # Attendance rate
-        attendance_data = session.execute(text("""
-            SELECT COUNT(*) as total, SUM(CASE WHEN present THEN 1 ELSE 0 END) as present
-            FROM attendance WHERE member_id = :mid
-        """), {'mid': member_id}).fetchone()
+@st.fragment
+def show_member_card(member, member_stats):
+    """One member card; opening or closing its details reruns only this card."""
+    with st.container():
+        st.markdown(f"""
+        <div class="member-card">
+            <div style="display: flex; justify-content: between; align-items: center;">
+                <div>
+                    <h3 style="margin: 0; color: #1e293b;">👤 {member['name']}</h3>
+                    <p style="margin: 5px 0; color: #64748b;">
+                        📞 {member['phone'] or 'No phone'} | 
+                        📅 Joined: {member['join_date']} | 
+                        Status: <span style="color: {'#16a34a' if member['status'] == 'active' else '#dc2626'};">
+                            {member['status'].title()}
+                        </span>
+                    </p>
+                </div>
+            </div>
+        </div>
+        """, unsafe_allow_html=True)
         
-        attendance_rate = (attendance_data.present / attendance_data.total * 100) if attendance_data.total > 0 else 0
+        # Quick stats row
+        col1, col2, col3, col4, col5 = st.columns(5)
+        with col1:
+            st.metric("Shares", f"KSh {member_stats['shares']:,.0f}")
+        with col2:
+            st.metric("Welfare", f"KSh {member_stats['welfare']:,.0f}")
+        with col3:
+            st.metric("Loan Balance", f"KSh {member_stats['loan_balance']:,.0f}")
+        with col4:
+            st.metric("Attendance", f"{member_stats['attendance_rate']:.1f}%")
+        with col5:
+            if st.button("View Details", key=f"view_{member['id']}", type="secondary"):
+                st.session_state[f"show_member_details_{member['id']}"] = True
         
-        return {
-            'shares': shares,
-            'welfare': welfare,
-            'loan_balance': loan_balance,
-            'attendance_rate': attendance_rate
-        }
-    finally:
-        session.close()
+        # Member details open inside the card
+        if st.session_state.get(f"show_member_details_{member['id']}"):
+            show_member_details_modal(member['id'])
 
 def show_member_details_modal(member_id):
     """Displays detailed member information in a modal-like container."""
@@ -893,9 +2488,8 @@ def show_member_details_modal(member_id):
     with col1:
         st.subheader(f"👤 {member.name} - Detailed Profile")
     with col2:
-        if st.button("✖️ Close", key="close_member_details"):
-            st.session_state.show_member_details = False
-            st.rerun()
+        st.button("✖️ Close", key=f"close_member_details_{member_id}",
+                  on_click=hide_panel, args=(f"show_member_details_{member_id}",))
     
     # Member overview metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -980,75 +2574,93 @@ def show_meetings():
                         st.success(f"✅ Meeting scheduled for {meeting_date.strftime('%A, %B %d, %Y')}")
                         st.rerun()
                 except Exception as e:
-                    st.error(f"❌ Error scheduling meeting: {str(e)}")
+                    st.error(f"❌ Error scheduling meeting: {describe_write_error(e)}")
                 finally:
                     session.close()
     
     # Meetings list
-    session = Session()
-    try:
-        meetings_df = pd.read_sql("""
-            SELECT m.*, 
-                   COUNT(a.id) as total_attendance,
-                   SUM(CASE WHEN a.present THEN 1 ELSE 0 END) as present_count
-            FROM meetings m
-            LEFT JOIN attendance a ON m.id = a.meeting_id
-            GROUP BY m.id
-            ORDER BY m.date DESC
-        """, engine)
-        
-        if meetings_df.empty:
-            st.info("📅 No meetings scheduled yet.")
-            return
-        
-        st.subheader(f"📋 Meetings History ({len(meetings_df)} meetings)")
+    meetings_df = load_meeting_list(get_data_version(['meetings', 'attendance']))
+    
+    if meetings_df.empty:
+        st.info("📅 No meetings scheduled yet.")
+        return
+    
+    with st.expander("📈 Attendance Streaks", expanded=False):
+        show_attendance_streaks()
+    
+    st.subheader(f"📋 Meetings History ({len(meetings_df)} meetings)")
+    
+    for _, meeting in meetings_df.iterrows():
+        show_meeting_card(meeting)
+
+def show_attendance_streaks():
+    """Members' recent attendance and absence streaks, flagging those missing meetings in a row."""
+    last_n = st.number_input("Recent meetings to rate", min_value=1, max_value=52, value=RECENT_MEETINGS,
+                             key="streak_last_n")
+    summary = load_attendance_summary(int(last_n), get_data_version(ATTENDANCE_BITMAP_TABLES))
+    if summary.empty:
+        st.info("No attendance recorded yet.")
+        return
+    
+    absent_now = summary[summary['current_absence_streak'] >= 2]
+    if not absent_now.empty:
+        st.warning(f"⚠️ **{len(absent_now)}** active member(s) have missed their last 2 or more meetings")
+    st.dataframe(
+        summary.round(1).rename(columns={
+            'name': 'Member',
+            'meetings_attended': 'Attended',
+            'meetings_marked': 'Marked',
+            'attendance_rate': 'Attendance (%)',
+            'last_n_rate': f'Last {int(last_n)} (%)',
+            'current_absence_streak': 'Missed in a Row',
+            'longest_absence_streak': 'Longest Absence Run'
+        }),
+        use_container_width=True, hide_index=True
+    )
+
+@st.fragment
+def show_meeting_card(meeting):
+    """One meeting row; managing its attendance reruns only this row until attendance is saved."""
+    meeting_date = datetime.strptime(meeting['date'], '%Y-%m-%d').date()
+    is_past = meeting_date < date.today()
+    is_today = meeting_date == date.today()
+    
+    # Status indicator
+    if is_today:
+        status_color = "#f59e0b"
+        status_text = "🔔 TODAY"
+    elif is_past:
+        status_color = "#64748b"
+        status_text = "✅ COMPLETED"
+    else:
+        status_color = "#3b82f6"
+        status_text = "📅 UPCOMING"
+    
+    with st.container():
+        col1, col2, col3 = st.columns([3, 1, 1])
         
-        for _, meeting in meetings_df.iterrows():
-            meeting_date = datetime.strptime(meeting['date'], '%Y-%m-%d').date()
-            is_past = meeting_date < date.today()
-            is_today = meeting_date == date.today()
+        with col1:
+            st.markdown(f"""
+            **📅 {meeting_date.strftime('%A, %B %d, %Y')}**
+            <span style="color: {status_color}; font-weight: bold;">{status_text}</span>
             
-            # Status indicator
-            if is_today:
-                status_color = "#f59e0b"
-                status_text = "🔔 TODAY"
-            elif is_past:
-                status_color = "#64748b"
-                status_text = "✅ COMPLETED"
+            📝 *{meeting['notes'] or 'No notes'}*
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            if meeting['total_attendance'] > 0:
+                attendance_rate = (meeting['present_count'] / meeting['total_attendance']) * 100
+                st.metric("Attendance", f"{attendance_rate:.1f}%", 
+                         f"{meeting['present_count']}/{meeting['total_attendance']}")
             else:
-                status_color = "#3b82f6"
-                status_text = "📅 UPCOMING"
-            
-            with st.container():
-                col1, col2, col3 = st.columns([3, 1, 1])
-                
-                with col1:
-                    st.markdown(f"""
-                    **📅 {meeting_date.strftime('%A, %B %d, %Y')}**
-                    <span style="color: {status_color}; font-weight: bold;">{status_text}</span>
-                    
-                    📝 *{meeting['notes'] or 'No notes'}*
-                    """, unsafe_allow_html=True)
-                
-                with col2:
-                    if meeting['total_attendance'] > 0:
-                        attendance_rate = (meeting['present_count'] / meeting['total_attendance']) * 100
-                        st.metric("Attendance", f"{attendance_rate:.1f}%", 
-                                 f"{meeting['present_count']}/{meeting['total_attendance']}")
-                    else:
-                        st.write("No attendance recorded")
-                
-                with col3:
-                    if st.button(f"Manage", key=f"manage_{meeting['id']}", type="secondary"):
-                        st.session_state.selected_meeting_id = meeting['id']
-                        st.session_state.show_meeting_management = True
+                st.write("No attendance recorded")
         
-        # Meeting management modal
-        if st.session_state.get('show_meeting_management') and st.session_state.get('selected_meeting_id'):
-            show_meeting_management_modal(st.session_state.selected_meeting_id)
+        with col3:
+            if st.button("Manage", key=f"manage_{meeting['id']}", type="secondary"):
+                st.session_state[f"show_meeting_management_{meeting['id']}"] = True
     
-    finally:
-        session.close()
+    if st.session_state.get(f"show_meeting_management_{meeting['id']}"):
+        show_meeting_management_modal(meeting['id'])
 
 def show_meeting_management_modal(meeting_id):
     """Shows the interface for managing a specific meeting's attendance."""
@@ -1064,20 +2676,19 @@ def show_meeting_management_modal(meeting_id):
         with col1:
             st.subheader(f"📅 Meeting: {meeting.date.strftime('%A, %B %d, %Y')}")
         with col2:
-            if st.button("✖️ Close", key="close_meeting_mgmt"):
-                st.session_state.show_meeting_management = False
-                st.rerun()
+            st.button("✖️ Close", key=f"close_meeting_mgmt_{meeting_id}",
+                      on_click=hide_panel, args=(f"show_meeting_management_{meeting_id}",))
         
         # Get all members and their attendance for this meeting
-        members_attendance = pd.read_sql("""
+        members_attendance = pd.read_sql(text("""
             SELECT m.id, m.name, 
                    COALESCE(a.present, 0) as present,
                    COALESCE(a.id, 0) as attendance_id
             FROM members m
-            LEFT JOIN attendance a ON m.id = a.member_id AND a.meeting_id = ?
+            LEFT JOIN attendance a ON m.id = a.member_id AND a.meeting_id = :meeting_id
             WHERE m.status = 'active'
             ORDER BY m.name
-        """, engine, params=[meeting_id])
+        """), engine, params={'meeting_id': meeting_id})
         
         # Attendance management
         st.markdown("##### ✅ Mark Attendance")
@@ -1085,37 +2696,30 @@ def show_meeting_management_modal(meeting_id):
         with st.form(f"attendance_form_{meeting_id}"):
             attendance_data = {}
             
-            for _, member in members_attendance.iterrows():
-                attendance_data[member['id']] = st.checkbox(
-                    f"👤 {member['name']}", 
-                    value=bool(member['present']),
-                    key=f"attendance_{meeting_id}_{member['id']}"
+            for member_id, name, present in zip(members_attendance['id'], members_attendance['name'],
+                                                members_attendance['present']):
+                attendance_data[int(member_id)] = st.checkbox(
+                    f"👤 {name}", 
+                    value=bool(present),
+                    key=f"attendance_{meeting_id}_{member_id}"
                 )
             
             if st.form_submit_button("💾 Save Attendance", type="primary"):
-                # Update attendance records
-                for member_id, is_present in attendance_data.items():
-                    existing_attendance = session.query(Attendance).filter(
-                        Attendance.meeting_id == meeting_id,
-                        Attendance.member_id == member_id
-                    ).first()
-                    
-                    if existing_attendance:
-                        existing_attendance.present = is_present
-                    else:
-                        new_attendance = Attendance(
-                            meeting_id=meeting_id,
-                            member_id=member_id,
-                            present=is_present
-                        )
-                        session.add(new_attendance)
-                
-                session.commit()
-                st.success("✅ Attendance updated successfully!")
-                st.rerun()
+                try:
+                    # Attendance rows and the members' attendance bitmaps are saved together
+                    save_meeting_attendance(meeting_id, attendance_data)
+                    penalties_added = apply_absence_penalties(meeting_id)
+                except Exception as e:
+                    st.error(f"❌ Error saving attendance: {describe_write_error(e)}")
+                else:
+                    # Toasts outlive the rerun below; st.success/st.info would be cleared by it
+                    st.toast("✅ Attendance updated successfully!")
+                    if penalties_added:
+                        st.toast(f"⚖️ {penalties_added} absence penalty(ies) recorded.")
+                    st.rerun()
         
         # Show attendance summary
-        present_count = sum(1 for _, member in members_attendance.iterrows() if member['present'])
+        present_count = int(members_attendance['present'].sum())
         total_count = len(members_attendance)
         
         if total_count > 0:
@@ -1150,14 +2754,10 @@ def show_contributions():
     
     # Add contribution form
     with st.expander("➕ Record New Contribution", expanded=False):
+        member_id = member_picker("Select Member", "contribution_member")
         with st.form("contribution_form"):
             col1, col2 = st.columns(2)
             with col1:
-                # Get active members for dropdown
-                members_df = pd.read_sql("SELECT id, name FROM members WHERE status = 'active' ORDER BY name", engine)
-                member_options = {f"{row['name']}": row['id'] for _, row in members_df.iterrows()}
-                
-                selected_member = st.selectbox("Select Member", options=list(member_options.keys()))
                 contribution_date = st.date_input("Date", value=date.today())
             
             with col2:
@@ -1165,20 +2765,19 @@ def show_contributions():
                 amount = st.number_input("Amount (KSh)", min_value=0.0, step=10.0)
             
             # Optional meeting association
-            meetings_df = pd.read_sql("SELECT id, date FROM meetings ORDER BY date DESC LIMIT 10", engine)
+            meetings_df = get_recent_meetings(10)
             meeting_options = {"No meeting": None}
-            meeting_options.update({f"Meeting - {row['date']}": row['id'] for _, row in meetings_df.iterrows()})
+            meeting_options.update(zip("Meeting - " + meetings_df['date'].astype(str), meetings_df['id']))
             
             selected_meeting = st.selectbox("Associate with Meeting (Optional)", options=list(meeting_options.keys()))
             
             if st.form_submit_button("💾 Record Contribution", type="primary"):
-                if selected_member and amount > 0:
+                if member_id and amount > 0:
                     if votehead == 'shares' and amount < SHARE_VALUE:
                         st.error(f"❌ Share contributions must be at least KSh {SHARE_VALUE:,.2f} per share.")
                     else:
                         session = Session()
                         try:
-                            member_id = member_options[selected_member]
                             meeting_id = meeting_options[selected_meeting]
                             
                             new_contribution = Contribution(
@@ -1191,108 +2790,72 @@ def show_contributions():
                             
                             session.add(new_contribution)
                             session.commit()
-                            st.success(f"✅ Contribution of KSh {amount:,.2f} recorded for {selected_member}")
+                            st.success(f"✅ Contribution of KSh {amount:,.2f} recorded for {get_member_name(member_id)}")
                             if votehead == 'shares':
                                 shares_gained = int(amount / SHARE_VALUE)
                                 st.success(f"🎉 {shares_gained} share(s) added!")
                             st.rerun()
                         except Exception as e:
-                            st.error(f"❌ Error recording contribution: {str(e)}")
+                            st.error(f"❌ Error recording contribution: {describe_write_error(e)}")
                         finally:
                             session.close()
                 else:
                     st.error("Please select a member and enter a valid amount.")
 
+    with st.expander("📥 Bulk Import from Sheet", expanded=False):
+        show_bulk_import()
+
+    with st.expander("📲 M-Pesa Statement Reconciliation", expanded=False):
+        show_statement_reconciliation()
+
     # New section for recording loan repayments on the contributions page
     st.markdown("---")
     with st.expander("💸 Record Loan Repayment", expanded=True): # Expanded by default for visibility
+        st.subheader("Quick Loan Repayment")
+        repay_member_id = member_picker("Select Member to Repay Loan For", "quick_repay_member")
+        
+        # The member's active loans, one parameterized query cached until a loan or repayment changes
+        member_loans_df = pd.DataFrame(columns=['id', 'balance', 'version'])
+        loan_labels = {}
+        if repay_member_id:
+            member_loans_df = load_member_loans(repay_member_id, date.today(),
+                                                get_data_version(['loans', 'repayments', 'members']))
+            loan_labels = dict(zip(member_loans_df['id'], member_loans_df['type'].str.title() + " Loan (KSh "
+                                   + member_loans_df['balance'].map('{:,.2f}'.format) + " balance, Started: "
+                                   + member_loans_df['start_date'].astype(str) + ")"))
+        selected_loan_id = st.selectbox(
+            "Select Loan to Repay", 
+            options=list(loan_labels),
+            format_func=loan_labels.get,
+            index=0 if len(loan_labels) == 1 else None,
+            placeholder="No active loans" if repay_member_id and not loan_labels else "Select a loan",
+            key=f"quick_repay_loan_select_{repay_member_id}"
+        )
+        loan_row = member_loans_df[member_loans_df['id'] == selected_loan_id]
+        current_loan_balance = float(loan_row['balance'].iloc[0]) if not loan_row.empty else 0.0
+        
         with st.form("loan_repayment_quick_form"):
-            st.subheader("Quick Loan Repayment")
-            session = Session()
-            
-            # Get all active members for the first dropdown
-            all_members_df = pd.read_sql("SELECT id, name FROM members WHERE status = 'active' ORDER BY name", engine)
-            member_repay_options = {"-- Select Member --": None}
-            member_repay_options.update({f"{row['name']}": row['id'] for _, row in all_members_df.iterrows()})
-            
-            selected_repay_member_name = st.selectbox(
-                "Select Member to Repay Loan For", 
-                options=list(member_repay_options.keys()), 
-                key="quick_repay_member_select"
-            )
-            
-            selected_repay_member_id = member_repay_options[selected_repay_member_name]
-            
-            # Filter loans based on selected member
-            filtered_loans_df = pd.DataFrame()
-            if selected_repay_member_id:
-                try:
-                    filtered_loans_df = pd.read_sql(f"""
-                        SELECT l.id, m.name as member_name, l.amount, l.start_date, l.due_date, l.type
-                        FROM loans l
-                        JOIN members m ON l.member_id = m.id
-                        WHERE l.status = 'active' AND l.member_id = {selected_repay_member_id}
-                        ORDER BY l.start_date DESC
-                    """, engine)
-                except Exception as e:
-                    st.error(f"Error fetching loans for selected member: {e}")
-
-            loan_options_display = ["-- Select a Loan --"]
-            loan_options_map = {}
-            selected_loan_id = None
-            current_loan_balance = 0.0
-
-            if not filtered_loans_df.empty:
-                filtered_loans_df['current_balance'] = filtered_loans_df.apply(
-                    lambda row: calculate_loan_balance(row['id']), axis=1
-                )
-                
-                for _, row in filtered_loans_df.iterrows():
-                    display_text = f"{row['type'].title()} Loan (KSh {row['current_balance']:,.2f} balance, Started: {row['start_date']})"
-                    loan_options_display.append(display_text)
-                    loan_options_map[display_text] = row['id']
-            
-            selected_loan_display = st.selectbox(
-                "Select Loan to Repay", 
-                options=loan_options_display, 
-                key="quick_repay_loan_select"
-            )
-
-            if selected_loan_display != "-- Select a Loan --":
-                selected_loan_id = loan_options_map[selected_loan_display]
-                # Ensure the balance is for the *selected* loan, not just any active loan
-                loan_row = filtered_loans_df[filtered_loans_df['id'] == selected_loan_id]
-                if not loan_row.empty:
-                    current_loan_balance = loan_row['current_balance'].iloc[0]
-                else:
-                    current_loan_balance = 0.0 # Fallback if loan not found (shouldn't happen with correct filtering)
-
             repayment_amount = st.number_input(
                 "Repayment Amount (KSh)", 
                 min_value=0.0, 
-                max_value=float(current_loan_balance) if selected_loan_id else 0.0, # Max value is the selected loan's current balance
+                max_value=current_loan_balance if selected_loan_id else 0.0, # Max value is the selected loan's current balance
                 step=50.0, 
                 key="quick_repay_amount"
             )
             repayment_date = st.date_input("Date of Repayment", value=date.today(), key="quick_repay_date")
 
-            # The submit button is now unconditionally inside the form
             if st.form_submit_button("Record Repayment", type="primary"):
-                if selected_repay_member_id is None:
+                if repay_member_id is None:
                     st.error("Please select a member first.")
-                elif selected_loan_id is None or selected_loan_display == "-- Select a Loan --":
+                elif selected_loan_id is None or loan_row.empty:
                     st.error("Please select a valid loan from the dropdown for the selected member.")
                 elif repayment_amount <= 0:
                     st.error("Please enter a valid repayment amount greater than zero.")
                 elif repayment_amount > current_loan_balance:
                     st.error(f"Repayment amount cannot exceed the current loan balance of KSh {current_loan_balance:,.2f}.")
                 else:
-                    try:
-                        record_loan_repayment(selected_loan_id, repayment_amount, repayment_date)
+                    if record_loan_repayment(selected_loan_id, repayment_amount, repayment_date, int(loan_row['version'].iloc[0])):
                         st.rerun()
-                    except Exception as e:
-                        st.error(f"Error recording repayment: {e}")
-            session.close() # Ensure session is closed after form submission logic
 
     st.markdown("---") # Separator between forms and history
 
@@ -1306,7 +2869,7 @@ def show_contributions():
     with col2:
         votehead_filter = st.selectbox("Vote Head", ["All", "Shares", "Welfare"])
     with col3:
-        member_filter = st.text_input("Search Member", placeholder="Enter member name...")
+        member_filter = st.text_input("Search Member", placeholder="Enter a name or phone number...")
     
     # Build query
     query = """
@@ -1332,12 +2895,12 @@ def show_contributions():
         params.append(votehead_filter.lower())
     
     if member_filter:
-        query += " AND m.name LIKE ?"
-        params.append(f"%{member_filter}%")
+        query += " AND m.id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(search_member_ids(member_filter)))
     
     query += " ORDER BY c.date DESC, m.name"
     
-    contributions_df = pd.read_sql(query, engine, params=params)
+    contributions_df = pd.read_sql(query, engine, params=tuple(params))
     
     if not contributions_df.empty:
         # Summary stats for filtered data
@@ -1367,6 +2930,121 @@ def show_contributions():
     else:
         st.info("No contributions found matching your criteria.")
 
+def show_bulk_import():
+    """Imports a meeting's contributions, repayments and attendance from a CSV/XLSX sheet with a dry run."""
+    st.write("Columns: **member**, **date**, **votehead** (shares/welfare/repayment), **amount**, "
+             "optional **loan_id** for repayments and optional **present** (yes/no) for attendance.")
+    template = "member,date,votehead,amount,loan_id,present\n"
+    st.download_button("Download Template", data=template, file_name="bulk_import_template.csv", mime="text/csv")
+    
+    uploaded_file = st.file_uploader("Upload Sheet", type=["csv", "xlsx"], key="bulk_import_file")
+    if uploaded_file is None:
+        return
+    upload_key = f"{uploaded_file.name}:{uploaded_file.size}"
+    if st.session_state.get('bulk_import_done') == upload_key:
+        st.success("✅ This sheet has been imported.")
+        return
+    
+    try:
+        plan, report = plan_bulk_import(read_import_rows(uploaded_file, uploaded_file.name))
+    except ImportError:
+        st.error("❌ Reading XLSX sheets requires the openpyxl package. Save the sheet as CSV instead.")
+        return
+    except Exception as e:
+        st.error(f"❌ Could not read the sheet: {e}")
+        return
+    
+    error_count = int((report['Status'] == 'error').sum())
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Contributions", len(plan['contributions']))
+    with col2:
+        st.metric("Repayments", len(plan['repayments']))
+    with col3:
+        st.metric("Attendance Changes", len(plan['attendance_new']) + len(plan['attendance_update']))
+    with col4:
+        st.metric("Errors", error_count)
+    
+    st.markdown("##### Dry Run")
+    st.dataframe(report, use_container_width=True, hide_index=True)
+    
+    if error_count:
+        st.warning("⚠️ Fix the rows marked 'error' and upload the sheet again. Nothing has been imported.")
+    elif st.button("💾 Import Sheet", type="primary"):
+        try:
+            written = apply_bulk_import(plan)
+            st.session_state.bulk_import_done = upload_key
+            st.success(f"✅ Imported {written['contributions']} contribution(s), {written['repayments']} repayment(s) "
+                       f"and {written['attendance']} attendance record(s).")
+        except Exception as e:
+            st.error(f"❌ Import failed, nothing was saved: {describe_write_error(e)}")
+
+def show_statement_reconciliation():
+    """Reconciles a mobile-money statement against recorded contributions and repayments."""
+    col1, col2 = st.columns(2)
+    with col1:
+        uploaded_statement = st.file_uploader("Upload Statement (CSV)", type=["csv"], key="statement_file")
+    with col2:
+        statement_path = st.text_input("...or Statement File Path", placeholder="e.g. statements/mpesa_2025.csv")
+        default_votehead = st.selectbox("Post unlabelled payments as", ["shares", "welfare"], key="statement_votehead")
+    
+    source = uploaded_statement or (statement_path.strip() if statement_path.strip() else None)
+    if source is None:
+        return
+    if isinstance(source, str) and not os.path.isfile(source):
+        st.error(f"❌ File not found: {source}")
+        return
+    
+    try:
+        timer = time.perf_counter()
+        reconciled = reconcile_statement(load_mobile_money_statement(source))
+        elapsed = time.perf_counter() - timer
+    except Exception as e:
+        st.error(f"❌ Could not reconcile the statement: {e}")
+        return
+    
+    counts = reconciled['status'].value_counts()
+    st.caption(f"Reconciled {len(reconciled):,} statement lines in {elapsed:.2f}s")
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric("Ready to Post", int(counts.get('matched', 0)))
+    with col2:
+        st.metric("Already Recorded", int(counts.get('reconciled', 0)))
+    with col3:
+        st.metric("Unmatched", int(counts.get('unmatched', 0)))
+    with col4:
+        st.metric("Duplicates", int(counts.get('duplicate', 0)))
+    with col5:
+        st.metric("Ignored", int(counts.get('ignored', 0)))
+    
+    status_filter = st.multiselect("Show", ['matched', 'reconciled', 'unmatched', 'duplicate', 'ignored'],
+                                   default=['matched', 'unmatched', 'duplicate'])
+    display_df = reconciled[reconciled['status'].isin(status_filter)][
+        ['receipt', 'date', 'amount', 'phone_key', 'member_name', 'status', 'note']
+    ].rename(columns={
+        'receipt': 'Receipt',
+        'date': 'Date',
+        'amount': 'Amount (KSh)',
+        'phone_key': 'Phone',
+        'member_name': 'Member',
+        'status': 'Status',
+        'note': 'Note'
+    })
+    st.dataframe(display_df, use_container_width=True, hide_index=True)
+    st.download_button("Download Reconciliation CSV", data=reconciled.to_csv(index=False),
+                       file_name=f"reconciliation_{date.today()}.csv", mime="text/csv")
+    
+    if counts.get('matched', 0) and st.button(f"💾 Post {int(counts['matched'])} Matched Payment(s)", type="primary"):
+        try:
+            written, report = post_statement_lines(reconciled, default_votehead)
+            st.success(f"✅ Posted {written['contributions']} contribution(s) and {written['repayments']} repayment(s).")
+            rejected = report[report['Status'] != 'ok']
+            if not rejected.empty:
+                st.warning(f"⚠️ {len(rejected)} line(s) could not be posted:")
+                st.dataframe(rejected, use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"❌ Posting failed, nothing was saved: {describe_write_error(e)}")
+
 def show_loans():
     """Displays and manages loan applications and repayments."""
     st.title("🏦 Loans Management")
@@ -1386,14 +3064,13 @@ def show_loans():
             st.metric("Total Repaid", f"KSh {total_repaid:,.2f}")  
         with col4:
             # Re-calculate outstanding based on current balances of active loans
-            loans_df_for_outstanding = pd.read_sql("SELECT id FROM loans WHERE status = 'active'", engine)
-            calculated_outstanding = sum(calculate_loan_balance(loan_id[0]) for loan_id in loans_df_for_outstanding.values)
+            calculated_outstanding = get_loans_with_balances(status='active')['balance'].sum()
             st.metric("Total Outstanding", f"KSh {calculated_outstanding:,.2f}")
     finally:
         session.close()
     
     # Loan management tabs
-    tab1, tab2, tab3 = st.tabs(["💰 New Loan", "📋 Active Loans", "💸 Repayments"])
+    tab1, tab2, tab3, tab4 = st.tabs(["💰 New Loan", "📋 Active Loans", "💸 Repayments", "🧮 Rate Simulator"])
     
     with tab1:
         show_new_loan_form()
@@ -1403,25 +3080,31 @@ def show_loans():
     
     with tab3:
         show_loan_repayments()
+    
+    with tab4:
+        show_rate_simulator()
 
 def show_new_loan_form():
     """Form for creating new loans."""
+    st.subheader("Apply for a New Loan")
+    share_multiple, min_attendance_rate = get_loan_eligibility_rules()
+    eligibility = load_loan_eligibility(share_multiple, min_attendance_rate, date.today(),
+                                        get_data_version(LOAN_ELIGIBILITY_TABLES))
+    member_id = member_picker("Select Member", "new_loan_member")
+    member_eligibility = eligibility.loc[member_id] if member_id in eligibility.index else None
+    if member_eligibility is not None:
+        show_member_eligibility(member_eligibility, share_multiple)
     with st.form("new_loan_form"):
-        st.subheader("Apply for a New Loan")
         col1, col2 = st.columns(2)
         
         with col1:
-            # Get active members
-            members_df = pd.read_sql("SELECT id, name FROM members WHERE status = 'active' ORDER BY name", engine)
-            member_options = {f"{row['name']}": row['id'] for _, row in members_df.iterrows()}
-            
-            selected_member = st.selectbox("Select Member", options=list(member_options.keys()))
             loan_type = st.selectbox("Loan Type", ["development", "emergency"])
             amount = st.number_input("Loan Amount (KSh)", min_value=100.0, step=100.0)
         
         with col2:
             # Set default interest rate and due date based on loan type
-            default_interest_rate = 10.0 if loan_type == "development" else 2.0 # 2% for emergency
+            default_interest_rate = (DEVELOPMENT_INTEREST_RATE if loan_type == "development"
+                                     else EMERGENCY_MONTHLY_INTEREST_RATE * 100) # 2% a month for emergency
             interest_rate = st.number_input("Interest Rate (%)", min_value=0.0, max_value=100.0, 
                                             value=default_interest_rate, step=0.5)
             
@@ -1435,11 +3118,13 @@ def show_new_loan_form():
             due_date = st.date_input("Due Date", value=default_due)
         
         if st.form_submit_button("💰 Approve Loan", type="primary"):
-            if selected_member and amount > 0:
+            if member_eligibility is not None and not member_eligibility['eligible']:
+                st.error(f"🚫 {get_member_name(member_id)} is not eligible: {member_eligibility['block_reason']}.")
+            elif member_eligibility is not None and amount > member_eligibility['max_loan']:
+                st.error(f"🚫 KSh {amount:,.2f} is above the maximum loan of KSh {member_eligibility['max_loan']:,.2f}.")
+            elif member_id and amount > 0:
                 session = Session()
                 try:
-                    member_id = member_options[selected_member]
-                    
                     new_loan = Loan(
                         member_id=member_id,
                         type=loan_type,
@@ -1451,111 +3136,254 @@ def show_new_loan_form():
                     )
                     
                     session.add(new_loan)
+                    session.flush() # Assigns the loan id for its instalment rows
+                    schedule = save_loan_schedule(session, new_loan)
                     session.commit()
-                    st.success(f"✅ Loan of KSh {amount:,.2f} approved for {selected_member}")
+                    st.success(f"✅ Loan of KSh {amount:,.2f} approved for {get_member_name(member_id)}")
+                    st.info(f"📆 {len(schedule)} instalment(s) scheduled, first due {schedule[0]['due_date'].strftime('%Y-%m-%d')}")
                     st.rerun()
                 except Exception as e:
-                    st.error(f"❌ Error creating loan: {str(e)}")
+                    st.error(f"❌ Error creating loan: {describe_write_error(e)}")
                 finally:
                     session.close()
             else:
                 st.error("Please select a member and enter a valid amount.")
+    
+    with st.expander(f"📋 Loan Eligibility ({int(eligibility['eligible'].sum())} of {len(eligibility)} members eligible)"):
+        st.caption(f"Credit limit: {share_multiple:g}x shares held, less outstanding loan balances. Members in arrears "
+                   f"or attending under {min_attendance_rate:g}% of their last {RECENT_MEETINGS} meetings are blocked.")
+        st.dataframe(
+            eligibility.sort_values(['eligible', 'max_loan'], ascending=False)[list(LOAN_ELIGIBILITY_COLUMNS)]
+                .rename(columns=LOAN_ELIGIBILITY_COLUMNS),
+            use_container_width=True,
+            hide_index=True
+        )
+
+LOAN_ELIGIBILITY_COLUMNS = {
+    'name': 'Member', 'shares': 'Shares (KSh)', 'credit_limit': 'Credit Limit (KSh)', 'outstanding': 'Outstanding (KSh)',
+    'max_loan': 'Max Loan (KSh)', 'attendance_rate': 'Recent Attendance (%)', 'block_reason': 'Blocked Because',
+}
+
+def show_member_eligibility(member_eligibility, share_multiple):
+    """The picked member's maximum loan, or why they cannot borrow, above the loan form."""
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Shares Held", f"KSh {member_eligibility['shares']:,.2f}")
+    col2.metric("Outstanding", f"KSh {member_eligibility['outstanding']:,.2f}")
+    col3.metric("Maximum Loan", f"KSh {member_eligibility['max_loan']:,.2f}")
+    attendance_rate = member_eligibility['attendance_rate']
+    col4.metric(f"Last {RECENT_MEETINGS} Meetings", f"{attendance_rate:.0f}%" if pd.notna(attendance_rate) else "-")
+    if member_eligibility['eligible']:
+        st.success(f"✅ Eligible for up to KSh {member_eligibility['max_loan']:,.2f} "
+                   f"({share_multiple:g}x shares less outstanding balances)")
+    else:
+        st.error(f"🚫 Not eligible: {member_eligibility['block_reason']}")
+        if member_eligibility['arrears'] > 0:
+            st.caption(f"📉 KSh {member_eligibility['arrears']:,.2f} in arrears")
 
 def show_active_loans():
     """Displays active loans with management options for repayments."""
-    loans_df = pd.read_sql("""
-        SELECT l.id, m.name as member_name, l.type, l.amount, l.interest_rate,
-               l.start_date, l.due_date, l.status,
-               COALESCE(SUM(r.amount), 0) as total_repaid
-        FROM loans l
-        JOIN members m ON l.member_id = m.id
-        LEFT JOIN repayments r ON l.id = r.loan_id
-        WHERE l.status = 'active'
-        GROUP BY l.id
-        ORDER BY l.due_date
-    """, engine)
+    loans_df, instalments_df = load_active_loans(
+        date.today(), get_data_version(['loans', 'repayments', 'members', 'loan_instalments']))
     
     if loans_df.empty:
         st.info("No active loans found.")
         return
     
-    # Calculate balances and status
-    loans_df['balance'] = loans_df.apply(lambda row: calculate_loan_balance(row['id']), axis=1)
-    loans_df['days_to_due'] = loans_df['due_date'].apply(
-        lambda x: (datetime.strptime(x, '%Y-%m-%d').date() - date.today()).days
-    )
-    loans_df['status_icon'] = loans_df['days_to_due'].apply(
-        lambda x: "🚨" if x < 0 else "⚠️" if x <= 7 else "✅"
-    )
+    total_arrears = loans_df['arrears'].sum()
+    if total_arrears > 0:
+        st.warning(f"📉 **{(loans_df['arrears'] > 0).sum()}** loan(s) behind schedule - KSh {total_arrears:,.2f} in arrears")
     
     st.subheader(f"📋 Active Loans ({len(loans_df)} loans)")
     
     for _, loan in loans_df.iterrows():
-        with st.container():
-            col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
+        loan_schedule = instalments_df[instalments_df['loan_id'] == loan['id']] if not instalments_df.empty else instalments_df
+        show_active_loan_card(loan, loan_schedule)
+
+@st.fragment
+def show_active_loan_card(loan, loan_schedule):
+    """One active loan with its schedule and repayment form; reruns on its own until a repayment is saved."""
+    with st.container():
+        col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
+        
+        with col1:
+            st.markdown(f"""
+            **{loan['status_icon']} {loan['member_name']}**
+            *{loan['type'].title()} Loan - {loan['interest_rate']}% interest*
+            """)
+        
+        with col2:
+            st.metric("Amount", f"KSh {loan['amount']:,.2f}")
             
-            with col1:
-                st.markdown(f"""
-                **{loan['status_icon']} {loan['member_name']}**
-                *{loan['type'].title()} Loan - {loan['interest_rate']}% interest*
-                """)
+        with col3:
+            st.metric("Balance", f"KSh {loan['balance']:,.2f}")
             
-            with col2:
-                st.metric("Amount", f"KSh {loan['amount']:,.2f}")
-                
-            with col3:
-                st.metric("Balance", f"KSh {loan['balance']:,.2f}")
+        with col4:
+            days_text = f"{abs(loan['days_to_due'])} days {'overdue' if loan['days_to_due'] < 0 else 'remaining'}"
+            st.write(days_text)
+            if loan['arrears'] > 0:
+                st.write(f"📉 KSh {loan['arrears']:,.2f} arrears ({int(loan['instalments_in_arrears'])} instalment(s))")
+            elif pd.notna(loan['next_due_date']):
+                st.write(f"📆 Next: {pd.Timestamp(loan['next_due_date']).strftime('%Y-%m-%d')}")
+        
+        if not loan_schedule.empty:
+            with st.expander(f"📆 Instalment Schedule for {loan['member_name']}"):
+                st.dataframe(
+                    loan_schedule[['instalment_no', 'due_date', 'amount_due', 'paid', 'outstanding']].rename(columns={
+                        'instalment_no': 'No.',
+                        'due_date': 'Due Date',
+                        'amount_due': 'Amount Due (KSh)',
+                        'paid': 'Paid (KSh)',
+                        'outstanding': 'Outstanding (KSh)'
+                    }),
+                    use_container_width=True,
+                    hide_index=True
+                )
+        
+        # Repayment section (this is already there, but user requested another one on contributions page)
+        with st.expander(f"💸 Record Repayment for {loan['member_name']}"):
+            with st.form(f"repayment_form_{loan['id']}"):
+                col1, col2 = st.columns(2)
+                with col1:
+                    repayment_amount = st.number_input(
+                        "Repayment Amount", 
+                        min_value=0.0, 
+                        max_value=float(loan['balance']),
+                        step=50.0,
+                        key=f"repay_{loan['id']}"
+                    )
+                with col2:
+                    repayment_date = st.date_input("Date", value=date.today(), key=f"repay_date_{loan['id']}")
                 
-            with col4:
-                days_text = f"{abs(loan['days_to_due'])} days {'overdue' if loan['days_to_due'] < 0 else 'remaining'}"
-                st.write(days_text)
-            
-            # Repayment section (this is already there, but user requested another one on contributions page)
-            with st.expander(f"💸 Record Repayment for {loan['member_name']}"):
-                with st.form(f"repayment_form_{loan['id']}"):
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        repayment_amount = st.number_input(
-                            "Repayment Amount", 
-                            min_value=0.0, 
-                            max_value=float(loan['balance']),
-                            step=50.0,
-                            key=f"repay_{loan['id']}"
-                        )
-                    with col2:
-                        repayment_date = st.date_input("Date", value=date.today(), key=f"repay_date_{loan['id']}")
-                    
-                    if st.form_submit_button(f"Record Repayment", key=f"submit_repay_{loan['id']}"):
-                        if repayment_amount > 0:
-                            record_loan_repayment(loan['id'], repayment_amount, repayment_date)
+                if st.form_submit_button("Record Repayment", key=f"submit_repay_{loan['id']}"):
+                    if repayment_amount > 0:
+                        if record_loan_repayment(loan['id'], repayment_amount, repayment_date, int(loan['version'])):
                             st.rerun()
 
-def record_loan_repayment(loan_id, amount, repayment_date):
-    """Records a loan repayment and updates loan status if fully paid."""
-    session = Session()
-    try:
-        # Create repayment record
-        new_repayment = Repayment(
-            loan_id=loan_id,
-            amount=amount,
-            date=repayment_date
+RATE_SCENARIO_COLUMNS = {
+    'emergency_rate': 'Emergency (%/month)', 'development_rate': 'Development (%/year)',
+    'development_term': 'Development Term (months)', 'emergency_term': 'Emergency Term (months)',
+    'interest_income': 'Interest Income (KSh)', 'closing_balance': 'Closing Balance (KSh)',
+    'dividend_pool': 'Dividend Pool (KSh)', 'dividend_per_share': 'Dividend/Share (KSh)', 'pool_change': 'vs Current (KSh)',
+}
+
+def show_rate_simulator():
+    """What-if projections of interest income, balances and the dividend pool under other rates and terms."""
+    st.subheader("🧮 What-if Rate Simulator")
+    st.caption("Projects the active loan book month by month under every combination of the rates and terms below, "
+               "using the group's flat interest method. Repayments can be lent out again at the new terms.")
+    with st.form("rate_simulator_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            emergency_range = st.slider("Emergency Rate (% per month)", 0.5, 6.0, (1.0, 3.0), step=0.25)
+            development_range = st.slider("Development Rate (% per year)", 0.0, 30.0, (6.0, 16.0), step=0.5)
+            steps = st.number_input("Rates Tried per Range", min_value=2, max_value=21, value=11,
+                                    help="Evenly spaced rates tried between each range's ends.")
+            months = st.number_input("Projection Horizon (months)", min_value=1, max_value=36, value=12)
+        with col2:
+            development_terms = st.multiselect("Development Terms (months)", [6, 9, 12, 18, 24, 36], default=[6, 12, 24])
+            emergency_terms = st.multiselect("Emergency Terms (months)", [1, 2, 3], default=[1])
+            relend_rate = st.slider("Repayments Lent Out Again (%)", 0, 100, 100, step=5)
+            collection_rate = st.slider("Scheduled Repayments Collected (%)", 50, 100, 100, step=5)
+            reprice_existing = st.checkbox("Apply new rates and terms to existing loans too")
+        if st.form_submit_button("🧮 Run Simulation", type="primary"):
+            st.session_state['rate_simulation'] = (
+                tuple(np.linspace(*emergency_range, int(steps)).round(4)),
+                tuple(np.linspace(*development_range, int(steps)).round(4)),
+                tuple(sorted(development_terms or [DEVELOPMENT_LOAN_TERM_MONTHS])),
+                tuple(sorted(emergency_terms or [CURRENT_TERMS['emergency_term']])),
+                int(months), relend_rate / 100, collection_rate / 100, reprice_existing,
+            )
+    
+    parameters = st.session_state.get('rate_simulation')
+    if parameters is None:
+        return
+    summary, projection, loans = load_rate_simulation(
+        parameters, date.today(), get_data_version(RATE_SIMULATION_TABLES))
+    months = parameters[4]
+    current = summary[summary['current']].iloc[0]
+    best_position = int(summary['dividend_pool'].to_numpy().argmax())
+    best = summary.iloc[best_position]
+    
+    st.success(f"✅ {len(summary):,} scenarios projected over {months} months for {len(loans)} active loans")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Interest Income (current terms)", f"KSh {current['interest_income']:,.2f}")
+    col2.metric("Dividend Pool (current terms)", f"KSh {current['dividend_pool']:,.2f}")
+    col3.metric("Best Dividend Pool", f"KSh {best['dividend_pool']:,.2f}", delta=f"KSh {best['pool_change']:,.2f}")
+    col4.metric("Best Terms", f"{best['emergency_rate']:g}% / {best['development_rate']:g}%",
+                delta=f"{int(best['development_term'])}-month development", delta_color="off")
+    
+    # Dividend per share across the rate grid for one pair of terms
+    col1, col2 = st.columns(2)
+    with col1:
+        development_term = st.selectbox("Development Term", parameters[2], key=f"rate_simulator_development_term_{hash(parameters)}",
+                                        index=parameters[2].index(best['development_term']))
+    with col2:
+        emergency_term = st.selectbox("Emergency Term", parameters[3], key=f"rate_simulator_emergency_term_{hash(parameters)}",
+                                      index=parameters[3].index(best['emergency_term']))
+    grid = summary[summary['in_grid'] & (summary['development_term'] == development_term)
+                   & (summary['emergency_term'] == emergency_term)]
+    value_column = 'dividend_per_share' if summary['dividend_per_share'].notna().any() else 'dividend_pool'
+    surface = grid.pivot_table(index='development_rate', columns='emergency_rate', values=value_column)
+    fig = px.imshow(surface, origin='lower', aspect='auto', color_continuous_scale='Viridis',
+                    labels={'x': 'Emergency Rate (% per month)', 'y': 'Development Rate (% per year)',
+                            'color': RATE_SCENARIO_COLUMNS[value_column]},
+                    title=f"{RATE_SCENARIO_COLUMNS[value_column]} over {months} months")
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Month-by-month income and balances, current terms against the best scenario
+    month_ends = [add_months(date.today().replace(day=1), n + 1) - timedelta(days=1) for n in range(months)]
+    current_position = int(np.flatnonzero(summary['current'])[0])
+    trend = pd.DataFrame({
+        'month': month_ends * 4,
+        'amount': np.concatenate([projection['monthly_income'][current_position], projection['monthly_income'][best_position],
+                                  projection['monthly_balance'][current_position], projection['monthly_balance'][best_position]]),
+        'series': np.repeat(["Interest income", "Interest income", "Portfolio balance", "Portfolio balance"], months),
+        'scenario': np.repeat(["Current terms", "Best terms", "Current terms", "Best terms"], months),
+    })
+    fig = px.line(trend, x='month', y='amount', color='scenario', facet_row='series', markers=True,
+                  labels={'month': 'Month', 'amount': 'KSh', 'scenario': 'Scenario'})
+    fig.update_yaxes(matches=None)
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.subheader("🏆 Top Scenarios by Dividend Pool")
+    st.dataframe(
+        summary.nlargest(10, 'dividend_pool')[list(RATE_SCENARIO_COLUMNS)].rename(columns=RATE_SCENARIO_COLUMNS),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    with st.expander("👥 Projected Member Balances"):
+        balances = pd.DataFrame({
+            'member_name': loans['member_name'],
+            'balance': loans['balance'],
+            'current_terms': projection['loan_balances'][current_position],
+            'best_terms': projection['loan_balances'][best_position],
+        }).groupby('member_name').sum().sort_values('balance', ascending=False)
+        st.dataframe(
+            balances.rename(columns={'balance': 'Balance Today (KSh)', 'current_terms': f"In {months} Months, Current Terms (KSh)",
+                                     'best_terms': f"In {months} Months, Best Terms (KSh)"}).rename_axis('Member'),
+            use_container_width=True
         )
-        session.add(new_repayment)
-        
-        # Check if loan is fully paid
-        current_balance = calculate_loan_balance(loan_id)
-        if current_balance <= amount: # If new repayment covers or exceeds the balance
-            loan = session.query(Loan).get(loan_id)
-            loan.status = 'completed'
-        
-        session.commit()
-        st.success(f"✅ Repayment of KSh {amount:,.2f} recorded successfully!")
-        
+
+def record_loan_repayment(loan_id, amount, repayment_date, expected_version=None):
+    """Records a loan repayment and updates loan status if fully paid.
+    
+    Returns True on success; a stale form, a completed loan or an overpayment is reported and
+    nothing is written.
+    """
+    try:
+        remaining_balance = record_repayment(loan_id, amount, repayment_date, expected_version)
+    except LoanConflictError as e:
+        st.warning(f"⚠️ {e}")
+        return False
     except Exception as e:
-        session.rollback()
-        st.error(f"❌ Error recording repayment: {str(e)}")
-    finally:
-        session.close()
+        st.error(f"❌ Error recording repayment: {describe_write_error(e)}")
+        return False
+    if remaining_balance <= 0:
+        st.success(f"✅ Repayment of KSh {amount:,.2f} recorded - the loan is now fully paid!")
+    else:
+        st.success(f"✅ Repayment of KSh {amount:,.2f} recorded successfully!")
+    return True
 
 def show_loan_repayments():
     """Displays loan repayment history with filtering options."""
@@ -1566,7 +3394,7 @@ def show_loan_repayments():
     with col1:
         date_filter = st.selectbox("Period", ["All Time", "This Month", "Last 3 Months", "This Year"], key="repay_filter")
     with col2:
-        member_search = st.text_input("Search Member", placeholder="Enter member name...", key="repay_search")
+        member_search = st.text_input("Search Member", placeholder="Enter a name or phone number...", key="repay_search")
     
     # Query repayments with filters
     query = """
@@ -1587,12 +3415,12 @@ def show_loan_repayments():
         query += " AND strftime('%Y', r.date) = strftime('%Y', 'now')"
     
     if member_search:
-        query += " AND m.name LIKE ?"
-        params.append(f"%{member_search}%")
+        query += " AND m.id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(search_member_ids(member_search)))
     
     query += " ORDER BY r.date DESC"
     
-    repayments_df = pd.read_sql(query, engine, params=params)
+    repayments_df = pd.read_sql(query, engine, params=tuple(params))
     
     if not repayments_df.empty:
         st.info(f"📊 Showing {len(repayments_df)} repayments totaling KSh {repayments_df['amount'].sum():,.2f}")
@@ -1620,16 +3448,128 @@ def show_reports():
         ["Financial Summary", "Member Performance", "Loan Analysis", "Attendance Report", "Monthly Statement"]
     )
     
+    export_dir = None
+    if report_type in ("Member Performance", "Loan Analysis"):
+        export_dir = choose_report_source()
+    
     if report_type == "Financial Summary":
         show_financial_summary_report()
     elif report_type == "Member Performance":
-        show_member_performance_report()
+        show_member_performance_report(export_dir)
     elif report_type == "Loan Analysis":
-        show_loan_analysis_report()
+        show_loan_analysis_report(export_dir)
     elif report_type == "Attendance Report":
         show_attendance_report()
     elif report_type == "Monthly Statement":
         show_monthly_statement_report()
+    
+    st.markdown("---")
+    show_statement_pack()
+
+def show_statement_pack():
+    """Builds every member's statement for a financial year as a zip of PDFs or one merged PDF."""
+    with st.expander("🖨️ Annual Member Statements (PDF)"):
+        today = date.today()
+        current_year = get_financial_year(today)
+        first_year = int(current_year[:4])
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            financial_year = st.selectbox("Financial Year", [f"{y}-{y + 1}" for y in range(first_year, first_year - 10, -1)],
+                                          key="statement_pack_year")
+        with col2:
+            member_scope = st.selectbox("Members", ["Active", "All"], key="statement_pack_members")
+        with col3:
+            output = st.selectbox("Output", ["Zip of PDFs", "Single merged PDF"], key="statement_pack_output")
+        
+        if not st.button("🖨️ Build Statements", key="build_statement_pack"):
+            return
+        period_start, period_end = get_financial_year_period(financial_year)
+        members = get_members(status='active' if member_scope == "Active" else None)
+        if members.empty:
+            st.info("No members to produce statements for.")
+            return
+        
+        timer = time.perf_counter()
+        progress_bar = st.progress(0.0, text="Loading records...")
+        statements = split_statement_data(get_statement_data(members['id'].tolist(), period_start, period_end))
+        pack = render_statement_pack(
+            statements, financial_year,
+            output='zip' if output == "Zip of PDFs" else 'pdf',
+            progress=lambda done, total: progress_bar.progress(done / total, text=f"Rendered {done:,} of {total:,} statements")
+        )
+        st.success(f"✅ {len(statements):,} statements in {time.perf_counter() - timer:.1f}s")
+        st.download_button(
+            label="⬇️ Download Statements",
+            data=pack,
+            file_name=f"member_statements_{financial_year}.{'zip' if output == 'Zip of PDFs' else 'pdf'}",
+            mime="application/zip" if output == "Zip of PDFs" else "application/pdf",
+            key="download_statement_pack"
+        )
+
+def choose_report_source():
+    """Offers the last Parquet export as the data source; returns its directory, or None for live data."""
+    manifest = get_export_manifest() if PYARROW_AVAILABLE else None
+    if manifest is None:
+        return None
+    source = st.radio(
+        "Data source", ["Live database", f"Parquet export ({manifest['exported_at'].replace('T', ' ')})"],
+        horizontal=True,
+        help="The export is read with a columnar engine and does not load the live database."
+    )
+    return DEFAULT_EXPORT_DIR if source != "Live database" else None
+
+def show_analytics_export():
+    """Runs the Parquet analytical export and offers it as a zip download."""
+    st.subheader("🗄️ Analytical Export (Parquet)")
+    if not PYARROW_AVAILABLE:
+        st.info("Install pyarrow (`pip install pyarrow`) to enable the Parquet export.")
+        return
+    
+    manifest = get_export_manifest()
+    if manifest:
+        st.write(f"Last export: **{manifest['exported_at'].replace('T', ' ')}**")
+        st.dataframe(
+            pd.DataFrame([
+                {'Table': table, 'Rows': sum(partitions.values()), 'Partitions': ", ".join(sorted(partitions))}
+                for table, partitions in manifest['tables'].items()
+            ]),
+            use_container_width=True,
+            hide_index=True
+        )
+    else:
+        st.write("No export has been made yet.")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("📦 Export Now", key="run_analytics_export"):
+            with st.spinner("Exporting all tables..."):
+                manifest = export_all()
+            st.success(f"✅ Exported {sum(sum(p.values()) for p in manifest['tables'].values()):,} rows.")
+    with col2:
+        if manifest and st.button("⬇️ Prepare Zip Download", key="zip_analytics_export"):
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+                for folder, _, files in os.walk(DEFAULT_EXPORT_DIR):
+                    for name in files:
+                        path = os.path.join(folder, name)
+                        archive.write(path, os.path.relpath(path, DEFAULT_EXPORT_DIR))
+            st.download_button(
+                label="Download Export (.zip)",
+                data=buffer.getvalue(),
+                file_name=f"shalom_export_{manifest['exported_at'][:10]}.zip",
+                mime="application/zip"
+            )
+
+def report_pdf_button(report_type, params, data_version):
+    """Download button for a report's PDF; it is rendered only when clicked, then served from cache."""
+    st.download_button(
+        label="📄 Download PDF",
+        data=lambda: render_report_pdf(report_type, params, data_version),
+        file_name=f"{report_type.lower().replace(' ', '_')}_{date.today().isoformat()}.pdf",
+        mime="application/pdf",
+        on_click="ignore",
+        key=f"report_pdf_{report_type}"
+    )
 
 def show_financial_summary_report():
     """Displays a financial summary report for a selected date range."""
@@ -1646,103 +3586,40 @@ def show_financial_summary_report():
         st.error("Start date cannot be after end date!")
         return
     
-    session = Session()
-    try:
-        # Get financial data
-        financial_data = session.execute(text("""
-            SELECT 
-                COALESCE(SUM(CASE WHEN votehead = 'shares' THEN amount END), 0) as total_shares,
-                COALESCE(SUM(CASE WHEN votehead = 'welfare' THEN amount END), 0) as total_welfare,
-                COUNT(DISTINCT member_id) as contributing_members
-            FROM contributions 
-            WHERE date BETWEEN :start_date AND :end_date
-        """), {'start_date': start_date, 'end_date': end_date}).fetchone()
-        
-        loans_data = session.execute(text("""
-            SELECT 
-                COALESCE(SUM(amount), 0) as loans_disbursed,
-                COUNT(*) as loans_count
-            FROM loans 
-            WHERE start_date BETWEEN :start_date AND :end_date
-        """), {'start_date': start_date, 'end_date': end_date}).fetchone()
-        
-        # FIX: Corrected the parameters for repayments_data query to use start_date and end_date
-        repayments_data = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) as total_repayments
-            FROM repayments 
-            WHERE date BETWEEN :start_date AND :end_date
-        """), {'start_date': start_date, 'end_date': end_date}).scalar()
-        
-        # Display metrics
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Total Shares", f"KSh {financial_data.total_shares:,.2f}")
-        with col2:
-            st.metric("Total Welfare", f"KSh {financial_data.total_welfare:,.2f}")
-        with col3:
-            st.metric("Loans Disbursed", f"KSh {loans_data.loans_disbursed:,.2f}")
-        with col4:
-            st.metric("Loan Repayments", f"KSh {repayments_data:,.2f}") # Use repayments_data directly
-        
-        # Summary table
-        st.subheader("📋 Summary")
-        summary_data = {
-            'Category': ['Member Contributions', 'Loans Disbursed', 'Loan Repayments', 'Net Cash Flow'],
-            'Shares (KSh)': [financial_data.total_shares, 0, 0, financial_data.total_shares],
-            'Welfare (KSh)': [financial_data.total_welfare, 0, 0, financial_data.total_welfare],
-            'Loans (KSh)': [0, -loans_data.loans_disbursed, repayments_data, # Use repayments_data directly
-                           repayments_data - loans_data.loans_disbursed],
-            'Total (KSh)': [
-                financial_data.total_shares + financial_data.total_welfare,
-                -loans_data.loans_disbursed,
-                repayments_data, # Use repayments_data directly
-                financial_data.total_shares + financial_data.total_welfare + 
-                repayments_data - loans_data.loans_disbursed
-            ]
-        }
-        
-        summary_df = pd.DataFrame(summary_data)
-        st.dataframe(summary_df, use_container_width=True)
-        
-    finally:
-        session.close()
+    data_version = get_report_data_version("Financial Summary")
+    summary = load_financial_summary(start_date, end_date, data_version)
+    
+    # Display metrics
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Total Shares", f"KSh {summary['total_shares']:,.2f}")
+    with col2:
+        st.metric("Total Welfare", f"KSh {summary['total_welfare']:,.2f}")
+    with col3:
+        st.metric("Loans Disbursed", f"KSh {summary['loans_disbursed']:,.2f}")
+    with col4:
+        st.metric("Loan Repayments", f"KSh {summary['total_repayments']:,.2f}")
+    
+    # Summary table
+    st.subheader("📋 Summary")
+    st.dataframe(summary['summary'], use_container_width=True)
+    report_pdf_button("Financial Summary", (start_date, end_date), data_version)
 
-def show_member_performance_report():
-    """Displays a report on individual member performance based on contributions, loans, and attendance."""
+def show_member_performance_report(export_dir=None):
+    """Displays a report on individual member performance based on contributions, loans, and attendance.
+    
+    Reads the Parquet export in export_dir instead of the live database when one is given.
+    """
     st.subheader("👥 Member Performance Report")
     
     # Get member performance data
-    member_performance = pd.read_sql("""
-        SELECT 
-            m.name,
-            m.join_date,
-            COALESCE(SUM(CASE WHEN c.votehead = 'shares' THEN c.amount END), 0) as total_shares,
-            COALESCE(SUM(CASE WHEN c.votehead = 'welfare' THEN c.amount END), 0) as total_welfare,
-            COUNT(DISTINCT c.id) as contribution_count,
-            COUNT(DISTINCT l.id) as loan_count,
-            COALESCE(SUM(l.amount), 0) as total_loans,
-            (SELECT COUNT(*) FROM attendance a 
-             WHERE a.member_id = m.id AND a.present = 1) as meetings_attended,
-            (SELECT COUNT(*) FROM attendance a 
-             WHERE a.member_id = m.id) as total_meetings
-        FROM members m
-        LEFT JOIN contributions c ON m.id = c.member_id
-        LEFT JOIN loans l ON m.id = l.member_id
-        WHERE m.status = 'active'
-        GROUP BY m.id
-        ORDER BY total_shares + total_welfare DESC
-    """, engine)
+    data_version = get_report_data_version("Member Performance", export_dir)
+    member_performance = load_member_performance(export_dir, data_version)
     
     if member_performance.empty:
         st.info("No member data available.")
         return
     
-    # Calculate attendance rate
-    member_performance['attendance_rate'] = (
-        member_performance['meetings_attended'] / 
-        member_performance['total_meetings'].replace(0, 1) * 100
-    ).round(1)
-    
     # Display top performers
     st.subheader("🏆 Top Contributors")
     top_contributors = member_performance.head(5)
@@ -1752,7 +3629,7 @@ def show_member_performance_report():
         with col1:
             st.write(f"**{i}. {member['name']}**")
         with col2:
-            st.metric("Total Contributions", f"KSh {member['total_shares'] + member['total_welfare']:,.2f}")
+            st.metric("Total Contributions", f"KSh {member['total_contributions']:,.2f}")
         with col3:
             st.metric("Attendance", f"{member['attendance_rate']:.1f}%")
         with col4:
@@ -1760,113 +3637,88 @@ def show_member_performance_report():
     
     # Full member table
     st.subheader("📊 All Members Performance")
-    display_df = member_performance.copy()
-    display_df['total_contributions'] = display_df['total_shares'] + display_df['total_welfare']
-    
     st.dataframe(
-        display_df[['name', 'total_contributions', 'total_shares', 'total_welfare', 
-                   'loan_count', 'attendance_rate']].rename(columns={
-            'name': 'Member Name',
-            'total_contributions': 'Total Contributions (KSh)',
-            'total_shares': 'Shares (KSh)',
-            'total_welfare': 'Welfare (KSh)',
-            'loan_count': 'Loans Taken',
-            'attendance_rate': 'Attendance (%)'
-        }),
+        member_performance[list(MEMBER_PERFORMANCE_COLUMNS)].rename(columns=MEMBER_PERFORMANCE_COLUMNS),
         use_container_width=True
     )
+    report_pdf_button("Member Performance", (export_dir,), data_version)
 
-def show_loan_analysis_report():
-    """Displays a detailed loan analysis report."""
+def show_loan_analysis_report(export_dir=None):
+    """Displays a loan analysis report with portfolio-at-risk aging and its 12-month trend.
+    
+    Reads the Parquet export in export_dir instead of the live database when one is given.
+    """
     st.subheader("🏦 Loan Analysis Report")
     
-    session = Session()
-    try:
-        # Loan overview metrics
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            active_loans = session.execute(text("SELECT COUNT(*) FROM loans WHERE status = 'active'")).scalar()
-            st.metric("Active Loans", active_loans)
-        
-        with col2:
-            overdue_loans = session.execute(text("""
-                SELECT COUNT(*) FROM loans 
-                WHERE status = 'active' AND due_date < date('now')
-            """)).scalar()
-            st.metric("Overdue Loans", overdue_loans)
-        
-        with col3:
-            avg_loan_amount = session.execute(text("SELECT AVG(amount) FROM loans")).scalar() or 0
-            st.metric("Avg Loan Amount", f"KSh {avg_loan_amount:,.2f}")
-        
-        with col4:
-            # Collection rate based on disbursed vs. repaid
-            collection_rate_data = session.execute(text("""
-                SELECT 
-                    COALESCE(SUM(l.amount), 0) as total_disbursed,
-                    COALESCE(SUM(r.amount), 0) as total_repaid
-                FROM loans l
-                LEFT JOIN repayments r ON l.id = r.loan_id
-            """)).fetchone()
-            
-            total_disbursed_for_rate = collection_rate_data.total_disbursed
-            total_repaid_for_rate = collection_rate_data.total_repaid
-
-            collection_rate = (total_repaid_for_rate / total_disbursed_for_rate * 100) if total_disbursed_for_rate > 0 else 0
-            st.metric("Collection Rate", f"{collection_rate:.1f}%")
-        
-        # Loan type breakdown
-        st.subheader("📊 Loan Distribution")
-        loan_breakdown = pd.read_sql("""
-            SELECT 
-                type as loan_type,
-                COUNT(*) as count,
-                SUM(amount) as total_amount,
-                AVG(amount) as avg_amount
-            FROM loans
-            GROUP BY type
-        """, engine)
-        
-        if not loan_breakdown.empty:
-            col1, col2 = st.columns(2)
-            with col1:
-                st.write("**By Count:**")
-                for _, row in loan_breakdown.iterrows():
-                    st.write(f"• {row['loan_type'].title()}: {row['count']} loans")
-            
-            with col2:
-                st.write("**By Amount:**")
-                for _, row in loan_breakdown.iterrows():
-                    st.write(f"• {row['loan_type'].title()}: KSh {row['total_amount']:,.2f}")
+    data_version = get_report_data_version("Loan Analysis", export_dir)
+    analysis = load_loan_analysis(export_dir, date.today(), data_version)
+    if analysis is None:
+        st.info("No loans recorded yet.")
+        return
+    metrics = analysis['metrics']
+    
+    # Loan overview metrics
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Active Loans", metrics['active_loans'])
+    with col2:
+        st.metric("Overdue Loans", metrics['overdue_loans'])
+    with col3:
+        st.metric("Avg Loan Amount", f"KSh {metrics['average_amount']:,.2f}")
+    with col4:
+        st.metric("Collection Rate", f"{metrics['collection_rate']:.1f}%")
+    
+    # Loan type breakdown
+    st.subheader("📊 Loan Distribution")
+    st.dataframe(
+        analysis['breakdown'].rename(columns=LOAN_BREAKDOWN_COLUMNS),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    # Portfolio at risk
+    st.subheader("⏳ Portfolio at Risk (Aging)")
+    outstanding = metrics['outstanding']
+    at_risk = metrics['at_risk']
+    at_risk_30 = metrics['at_risk_30']
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Outstanding Balance", f"KSh {outstanding:,.2f}")
+    with col2:
+        st.metric("PAR > 0 days", f"{(at_risk / outstanding * 100) if outstanding > 0 else 0:.1f}%", f"KSh {at_risk:,.2f}", delta_color="off")
+    with col3:
+        st.metric("PAR > 30 days", f"{(at_risk_30 / outstanding * 100) if outstanding > 0 else 0:.1f}%", f"KSh {at_risk_30:,.2f}", delta_color="off")
+    
+    if analysis['aging_by_type'].empty:
+        st.success("✅ No outstanding loan balances.")
+    else:
+        st.markdown("##### By Loan Type (KSh)")
+        st.dataframe(analysis['aging_by_type'], use_container_width=True)
+    
+    if not analysis['overdue'].empty:
+        st.markdown("##### 🚨 Overdue Balances by Member (KSh)")
+        st.dataframe(analysis['aging_by_member'], use_container_width=True)
         
-        # Overdue loans details
-        if overdue_loans > 0:
-            st.subheader("🚨 Overdue Loans")
-            overdue_details = pd.read_sql("""
-                SELECT 
-                    m.name as member_name,
-                    l.type,
-                    l.amount,
-                    l.due_date,
-                    (julianday('now') - julianday(l.due_date)) as days_overdue
-                FROM loans l
-                JOIN members m ON l.member_id = m.id
-                WHERE l.status = 'active' AND l.due_date < date('now')
-                ORDER BY days_overdue DESC
-            """, engine)
-            
-            for _, loan in overdue_details.iterrows():
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write(f"**{loan['member_name']}**")
-                with col2:
-                    st.write(f"KSh {loan['amount']:,.2f} ({loan['type']})")
-                with col3:
-                    st.write(f"⏰ {int(loan['days_overdue'])} days overdue")
+        st.markdown("##### 🚨 Overdue Loans")
+        st.dataframe(
+            analysis['overdue'].rename(columns=OVERDUE_LOAN_COLUMNS),
+            use_container_width=True,
+            hide_index=True
+        )
     
-    finally:
-        session.close()
+    # PAR trend over the last 12 month-ends
+    st.subheader("📈 PAR Trend (Last 12 Month-Ends)")
+    fig = px.line(analysis['trend'], x='month_end', y=['PAR > 0 (%)', 'PAR > 30 (%)'], markers=True,
+                  title="Portfolio at Risk", color_discrete_sequence=['#f093fb', '#dc2626'])
+    fig.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='#1e293b'),
+        yaxis_title="% of outstanding balance"
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    report_pdf_button("Loan Analysis", (export_dir, date.today()), data_version)
 
 def show_attendance_report():
     """Displays an attendance analysis report for a selected period."""
@@ -1875,29 +3727,21 @@ def show_attendance_report():
     # Date range for analysis
     col1, col2 = st.columns(2)
     with col1:
-        months_back = st.selectbox("Analysis Period", [3, 6, 12], format_func=lambda x: f"Last {x} months")
+        period = st.selectbox("Analysis Period", list(ATTENDANCE_PERIODS), index=1)
     with col2:
-        start_analysis = date.today() - timedelta(days=months_back * 30)
-        st.write(f"Analyzing from: {start_analysis.strftime('%Y-%m-%d')}")
-    
-    # Overall attendance statistics
-    attendance_stats = pd.read_sql("""
-        SELECT 
-            m.name,
-            COUNT(a.id) as total_meetings,
-            SUM(CASE WHEN a.present THEN 1 ELSE 0 END) as attended,
-            ROUND(
-                (SUM(CASE WHEN a.present THEN 1 ELSE 0 END) * 100.0 / COUNT(a.id)), 1
-            ) as attendance_rate
-        FROM members m
-        LEFT JOIN attendance a ON m.id = a.member_id
-        LEFT JOIN meetings mt ON a.meeting_id = mt.id
-        WHERE m.status = 'active' 
-        AND (mt.date IS NULL OR mt.date >= ?)
-        GROUP BY m.id
-        HAVING total_meetings > 0
-        ORDER BY attendance_rate DESC
-    """, engine, params=[start_analysis])
+        if period == "Custom range":
+            default_start, default_end = get_attendance_period("Last 6 months")
+            date_range = st.date_input("Meetings between", value=(default_start, default_end), max_value=date.today())
+            if len(date_range) != 2:
+                st.info("Choose the last day of the range.")
+                return
+            start, end = date_range
+        else:
+            start, end = get_attendance_period(period)
+            st.write(f"Analyzing from: {start.strftime('%Y-%m-%d')} to {end.strftime('%Y-%m-%d')}")
+    
+    data_version = get_report_data_version("Attendance Report")
+    attendance_stats, meeting_attendance, heatmap = load_attendance_report(start, end, data_version)
     
     if attendance_stats.empty:
         st.info("No attendance data available for the selected period.")
@@ -1919,42 +3763,33 @@ def show_attendance_report():
     # Member attendance details
     st.subheader("👥 Member Attendance Details")
     st.dataframe(
-        attendance_stats.rename(columns={
-            'name': 'Member Name',
-            'total_meetings': 'Total Meetings',
-            'attended': 'Attended',
-            'attendance_rate': 'Attendance Rate (%)'
-        }),
+        attendance_stats.rename(columns=MEMBER_ATTENDANCE_COLUMNS),
         use_container_width=True
     )
     
+    # Member x meeting heatmap, lowest attendance first
+    st.subheader("🗓️ Attendance Heatmap")
+    if heatmap.empty:
+        st.info("No attendance marks to chart for the selected period.")
+    else:
+        members_shown = st.number_input("Members shown (lowest attendance first)", min_value=min(5, len(heatmap)),
+                                        max_value=len(heatmap), value=min(30, len(heatmap)), step=5)
+        shown = heatmap.head(int(members_shown))
+        fig = px.imshow(shown, x=[str(d) for d in shown.columns], y=shown.index, zmin=0, zmax=1, aspect='auto',
+                        color_continuous_scale=[[0, '#ef4444'], [1, '#22c55e']],
+                        labels={'x': 'Meeting', 'y': 'Member', 'color': 'Present'})
+        fig.update_layout(height=160 + 18 * len(shown), coloraxis_showscale=False, plot_bgcolor='#e5e7eb')
+        st.plotly_chart(fig, use_container_width=True)
+        st.caption("Green: present · Red: absent · Grey: not marked")
+    
     # Meeting-wise attendance
     st.subheader("📊 Meeting-wise Attendance")
-    meeting_attendance = pd.read_sql("""
-        SELECT 
-            mt.date,
-            COUNT(a.id) as total_marked,
-            SUM(CASE WHEN a.present THEN 1 ELSE 0 END) as present_count,
-            ROUND(
-                (SUM(CASE WHEN a.present THEN 1 ELSE 0 END) * 100.0 / COUNT(a.id)), 1
-            ) as meeting_attendance_rate
-        FROM meetings mt
-        LEFT JOIN attendance a ON mt.id = a.meeting_id
-        WHERE mt.date >= ?
-        GROUP BY mt.id
-        ORDER BY mt.date DESC
-    """, engine, params=[start_analysis])
-    
     if not meeting_attendance.empty:
         st.dataframe(
-            meeting_attendance.rename(columns={
-                'date': 'Meeting Date',
-                'total_marked': 'Members Marked',
-                'present_count': 'Present',
-                'meeting_attendance_rate': 'Attendance Rate (%)'
-            }),
+            meeting_attendance.rename(columns=MEETING_ATTENDANCE_COLUMNS),
             use_container_width=True
         )
+    report_pdf_button("Attendance Report", (start, end), data_version)
 
 def show_monthly_statement_report():
     """Generates and displays a monthly financial statement."""
@@ -1969,103 +3804,288 @@ def show_monthly_statement_report():
     
     # Generate statement for selected month
     month_start = date(selected_year, selected_month, 1)
-    if selected_month == 12:
-        month_end = date(selected_year + 1, 1, 1) - timedelta(days=1)
-    else:
-        month_end = date(selected_year, selected_month + 1, 1) - timedelta(days=1)
     
     st.write(f"**Statement Period:** {month_start.strftime('%B %Y')}")
     
-    session = Session()
-    try:
-        # Opening balances (previous month)
-        prev_month_end = month_start - timedelta(days=1)
-        
-        opening_shares = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM contributions 
-            WHERE votehead = 'shares' AND date <= :end_date
-        """), {'end_date': prev_month_end}).scalar()
-        
-        opening_welfare = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM contributions 
-            WHERE votehead = 'welfare' AND date <= :end_date
-        """), {'end_date': prev_month_end}).scalar()
-        
-        # Current month transactions
-        month_shares = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM contributions 
-            WHERE votehead = 'shares' AND date BETWEEN :start_date AND :end_date
-        """), {'start_date': month_start, 'end_date': month_end}).scalar()
-        
-        month_welfare = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM contributions 
-            WHERE votehead = 'welfare' AND date BETWEEN :start_date AND :end_date
-        """), {'start_date': month_start, 'end_date': month_end}).scalar()
-        
-        month_loans_disbursed = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM loans 
-            WHERE start_date BETWEEN :start_date AND :end_date
-        """), {'start_date': month_start, 'end_date': month_end}).scalar()
-        
-        month_repayments = session.execute(text("""
-            SELECT COALESCE(SUM(amount), 0) FROM repayments 
-            WHERE date BETWEEN :start_date AND :end_date
-        """), {'start_date': month_start, 'end_date': month_end}).scalar()
-        
-        # Create statement table
-        statement_data = {
-            'Description': [
-                'Opening Balance - Shares',
-                'Opening Balance - Welfare',
-                'Monthly Shares Contributions',
-                'Monthly Welfare Contributions',
-                'Loans Disbursed',
-                'Loan Repayments Received',
-                'Closing Balance - Shares',
-                'Closing Balance - Welfare',
-                'Net Cash Position'
-            ],
-            'Amount (KSh)': [
-                f"{opening_shares:,.2f}",
-                f"{opening_welfare:,.2f}",
-                f"{month_shares:,.2f}",
-                f"{month_welfare:,.2f}",
-                f"-{month_loans_disbursed:,.2f}",
-                f"{month_repayments:,.2f}",
-                f"{opening_shares + month_shares:,.2f}",
-                f"{opening_welfare + month_welfare:,.2f}",
-                f"{opening_shares + opening_welfare + month_shares + month_welfare - month_loans_disbursed + month_repayments:,.2f}"
-            ]
-        }
-        
-        statement_df = pd.DataFrame(statement_data)
-        st.dataframe(statement_df, use_container_width=True)
-        
-        # Export option
-        if st.button("📊 Export Statement"):
-            csv = statement_df.to_csv(index=False)
-            st.download_button(
-                label="Download Monthly Statement",
-                data=csv,
-                file_name=f"monthly_statement_{selected_year}_{selected_month:02d}.csv",
-                mime="text/csv"
+    data_version = get_report_data_version("Monthly Statement")
+    statement_df = load_monthly_statement(month_start.strftime('%Y-%m'), data_version)
+    st.dataframe(statement_df, use_container_width=True)
+    
+    # Export option
+    if st.button("📊 Export Statement"):
+        csv = statement_df.to_csv(index=False)
+        st.download_button(
+            label="Download Monthly Statement",
+            data=csv,
+            file_name=f"monthly_statement_{selected_year}_{selected_month:02d}.csv",
+            mime="text/csv"
+        )
+    report_pdf_button("Monthly Statement", (selected_year, selected_month), data_version)
+
+def show_sms_queue():
+    """Displays the SMS reminder queue and a gateway throughput test."""
+    st.subheader("📱 SMS Reminders")
+    queue_stats = pd.read_sql("""
+        SELECT status, COUNT(*) as messages, MAX(sent_at) as last_sent
+        FROM sms_messages
+        GROUP BY status
+    """, engine)
+    counts = dict(zip(queue_stats['status'], queue_stats['messages']))
+    
+    col1, col2, col3, col4 = st.columns([1, 1, 1, 1])
+    with col1:
+        st.metric("Pending", int(counts.get('pending', 0)))
+    with col2:
+        st.metric("Sent", int(counts.get('sent', 0)))
+    with col3:
+        st.metric("Failed", int(counts.get('failed', 0)))
+    with col4:
+        if st.button("📤 Send Pending Now", disabled=not counts.get('pending')):
+            run_job_in_background('sms_dispatch')
+            st.info("⏳ Sending in the background.")
+    
+    if counts.get('failed'):
+        failed_messages = pd.read_sql("""
+            SELECT m.name, s.phone, s.attempts, s.last_error
+            FROM sms_messages s
+            JOIN members m ON s.member_id = m.id
+            WHERE s.status = 'failed'
+            ORDER BY s.id DESC
+            LIMIT 50
+        """, engine)
+        st.dataframe(failed_messages, use_container_width=True, hide_index=True)
+    
+    with st.expander("⚡ Gateway Throughput Test"):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            message_count = st.number_input("Messages", min_value=10, max_value=100000, value=1000, step=100)
+        with col2:
+            concurrency = st.number_input("Concurrency", min_value=1, max_value=500, value=SMS_CONCURRENCY)
+        with col3:
+            latency_ms = st.number_input("Simulated latency (ms)", min_value=0, max_value=5000, value=50)
+        if st.button("Run Throughput Test"):
+            result = benchmark_sms_dispatch(int(message_count), int(concurrency), latency_ms / 1000)
+            st.success(f"✅ {result['sent']:,} messages in {result['seconds']:.2f}s "
+                       f"({result['messages_per_second']:,.0f} messages/s)")
+
+def show_scheduled_jobs():
+    """Displays the background maintenance jobs with their last runtime and outcome."""
+    st.subheader("🕒 Scheduled Jobs")
+    runs = get_job_runs()
+    now = datetime.now()
+    
+    for name, job in SCHEDULED_JOBS.items():
+        run = runs.get(name)
+        status_icon = {'success': '✅', 'failed': '❌', 'running': '⏳'}.get(run.last_status if run else None, '⚪')
+        col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
+        with col1:
+            st.markdown(f"**{status_icon} {name}** `{job['cron']}`")
+            st.caption(job['description'])
+        with col2:
+            if run and run.last_started:
+                st.write(f"Last run: {run.last_started.strftime('%Y-%m-%d %H:%M')}")
+                if run.last_duration is not None:
+                    st.caption(f"Took {run.last_duration:.2f}s")
+            else:
+                st.write("Never run")
+        with col3:
+            st.write(f"Next: {cron_next_run(job['cron'], now).strftime('%Y-%m-%d %H:%M')}")
+            if run and run.last_message:
+                st.caption(run.last_message)
+        with col4:
+            if st.button("Run Now", key=f"run_job_{name}"):
+                run_job_in_background(name)
+                st.info(f"⏳ {name} started in the background.")
+
+def show_backups():
+    """Lists database snapshots and takes, verifies or restores them."""
+    st.subheader("💾 Database Backups")
+    backups = get_backups()
+    
+    if st.button("💾 Back Up Now"):
+        with st.spinner("Taking a snapshot..."):
+            entry = create_backup(label='manual')
+        st.success(f"✅ Saved {entry['file']} ({entry['compressed_bytes'] / 1e6:.2f} MB) in {entry['seconds']:.2f}s")
+        backups = get_backups()
+    
+    if not backups:
+        st.info("No backups yet. A snapshot is taken nightly by the database_backup job.")
+        return
+    
+    st.dataframe(
+        pd.DataFrame(backups)[['created_at', 'label', 'database_bytes', 'compressed_bytes', 'seconds', 'sha256']].rename(columns={
+            'created_at': 'Taken', 'label': 'Label', 'database_bytes': 'Size (bytes)',
+            'compressed_bytes': 'Compressed (bytes)', 'seconds': 'Took (s)', 'sha256': 'SHA-256'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    chosen = st.selectbox(
+        "Snapshot", [backup['file'] for backup in backups],
+        format_func=lambda file: next(f"{b['created_at'].replace('T', ' ')} ({b['label']})" for b in backups if b['file'] == file)
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🔍 Verify Checksum"):
+            if verify_backup(chosen):
+                st.success("✅ Snapshot matches its recorded checksum.")
+            else:
+                st.error("❌ Checksum mismatch - this snapshot is corrupt.")
+    with col2:
+        confirm = st.checkbox("I understand everything recorded after this snapshot will be replaced")
+        if st.button("♻️ Restore Snapshot", disabled=not confirm):
+            try:
+                safety_backup = restore_backup(chosen)
+            except ValueError as e:
+                st.error(f"❌ {e}")
+            else:
+                st.success(f"✅ Restored. The previous state was saved as {safety_backup['file']}.")
+    
+    with st.expander("⚡ Backup Throughput Test"):
+        if st.button("Run Backup Test"):
+            with st.spinner("Timing member statistics queries with and without a backup running..."):
+                result = benchmark_backup(lambda: get_member_stats())
+            st.success(f"✅ {result['database_mb']:.1f} MB copied at {result['copy_mb_per_second']:,.0f} MB/s, "
+                       f"compressed {result['compression_ratio']:.1f}x")
+            st.dataframe(
+                pd.DataFrame([
+                    {'Query': probe, 'Condition': condition, 'Median (ms)': timings['median_ms'],
+                     'p95 (ms)': timings['p95_ms'], 'Samples': timings['samples']}
+                    for condition, results in [('Idle', result['baseline']), ('During backup', result['during_backup'])]
+                    for probe, timings in results.items()
+                ]),
+                use_container_width=True,
+                hide_index=True
             )
+
+def show_change_log():
+    """Displays the most recent audited changes, optionally for one table."""
+    st.subheader("📜 Change Log")
+    col1, col2 = st.columns(2)
+    with col1:
+        table = st.selectbox("Table", ["All"] + [t for t in get_table_versions() if t != 'change_log'], key="change_log_table")
+    with col2:
+        limit = st.number_input("Entries", min_value=10, max_value=1000, value=100, step=10, key="change_log_limit")
     
-    finally:
-        session.close()
+    changes = get_changes(tables=None if table == "All" else [table], limit=int(limit), newest_first=True)
+    if changes.empty:
+        st.info("No changes recorded yet.")
+        return
+    
+    changes['changes'] = changes['changes'].map(
+        lambda diff: "; ".join(f"{column}: {old} → {new}" for column, (old, new) in diff.items())
+    )
+    st.dataframe(
+        changes.rename(columns={
+            'seq': 'Seq', 'changed_at': 'When', 'changed_by': 'By', 'table_name': 'Table',
+            'row_id': 'Row', 'operation': 'Operation', 'changes': 'Changes'
+        })[['Seq', 'When', 'By', 'Table', 'Row', 'Operation', 'Changes']],
+        use_container_width=True,
+        hide_index=True
+    )
+
+def show_financial_year_close():
+    """Closes ended financial years, shows their frozen balances and archives their raw rows."""
+    st.subheader("📕 Financial Year Close")
+    closes = get_year_closes()
+    
+    if not closes.empty:
+        closes_display = closes[['financial_year', 'period_start', 'period_end', 'closed_at', 'archived_at', 'archived_rows']]
+        st.dataframe(
+            closes_display.rename(columns={
+                'financial_year': 'Financial Year',
+                'period_start': 'From',
+                'period_end': 'To',
+                'closed_at': 'Closed',
+                'archived_at': 'Archived',
+                'archived_rows': 'Rows Archived'
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    closable_years = get_closable_financial_years()
+    if closable_years:
+        with st.form("close_financial_year_form"):
+            financial_year = st.selectbox("Year to close", closable_years[:1],
+                                          help="Years close in order, oldest first.")
+            period_start, period_end = get_financial_year_period(financial_year)
+            confirmed = st.checkbox(f"I understand records dated up to {period_end.strftime('%d %b %Y')} will be locked")
+            if st.form_submit_button("📕 Close Financial Year", type="primary"):
+                if confirmed:
+                    try:
+                        members_saved, loans_saved = close_financial_year(financial_year)
+                        st.success(f"✅ {financial_year} closed - balances frozen for {members_saved} member(s) and {loans_saved} loan(s).")
+                        st.rerun()
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                else:
+                    st.error("Please confirm before closing the year.")
+    else:
+        st.info("No ended financial year is waiting to be closed.")
+    
+    if closes.empty:
+        return
+    
+    unarchived = closes[closes['archived_at'].isna()]
+    if not unarchived.empty:
+        year_to_archive = unarchived['financial_year'].iloc[0]
+        if st.button(f"🗄️ Move {year_to_archive} records to archive", key="archive_financial_year",
+                     help="Moves the year's raw records to the archive file, leaving brought-forward totals."):
+            try:
+                moved = archive_financial_year(year_to_archive)
+                st.success(f"✅ {moved} record(s) moved to the archive.")
+            except ValueError as e:
+                st.error(f"❌ {e}")
+    
+    selected_year = st.selectbox("View closed year", closes['financial_year'][::-1].tolist(), key="closed_year_view")
+    member_balances, loan_balances = get_year_end_snapshot(selected_year)
+    tab1, tab2, tab3 = st.tabs(["👥 Member Balances", "🏦 Loan Balances", "🗄️ Archived Records"])
+    with tab1:
+        st.dataframe(
+            member_balances[['member_name', 'shares_in_year', 'welfare_in_year', 'penalties_in_year',
+                             'shares_closing', 'welfare_closing', 'loan_balance', 'meetings_attended', 'meetings_marked']].rename(columns={
+                'member_name': 'Member',
+                'shares_in_year': 'Shares in Year (KSh)',
+                'welfare_in_year': 'Welfare in Year (KSh)',
+                'penalties_in_year': 'Penalties in Year (KSh)',
+                'shares_closing': 'Closing Shares (KSh)',
+                'welfare_closing': 'Closing Welfare (KSh)',
+                'loan_balance': 'Loan Balance (KSh)',
+                'meetings_attended': 'Meetings Attended',
+                'meetings_marked': 'Meetings Marked'
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+    with tab2:
+        st.dataframe(
+            loan_balances[['member_name', 'type', 'amount', 'start_date', 'repaid_in_year', 'repaid_to_date', 'closing_balance']].rename(columns={
+                'member_name': 'Member',
+                'type': 'Type',
+                'amount': 'Amount (KSh)',
+                'start_date': 'Start Date',
+                'repaid_in_year': 'Repaid in Year (KSh)',
+                'repaid_to_date': 'Repaid to Date (KSh)',
+                'closing_balance': 'Closing Balance (KSh)'
+            }),
+            use_container_width=True,
+            hide_index=True
+        )
+    with tab3:
+        if pd.isna(closes.set_index('financial_year').loc[selected_year, 'archived_at']):
+            st.info("This year's records have not been archived; they are still in the live database.")
+        else:
+            table = st.selectbox("Records", list(ARCHIVED_TABLES), key="archived_table")
+            if st.button("📂 Load from archive", key="load_archived_rows"):
+                st.dataframe(load_archived_rows(table, selected_year), use_container_width=True, hide_index=True)
 
 # Main application logic
 def main():
     """Main function to run the Streamlit application."""
-    # Initialize session states if they don't exist
-    if 'selected_member_id' not in st.session_state:
-        st.session_state.selected_member_id = None
-    if 'show_member_details' not in st.session_state:
-        st.session_state.show_member_details = False
-    if 'selected_meeting_id' not in st.session_state:
-        st.session_state.selected_meeting_id = None
-    if 'show_meeting_management' not in st.session_state:
-        st.session_state.show_meeting_management = False
+    backfill_loan_schedules()
+    start_job_scheduler()
 
     with st.sidebar:
         st.title("🤝 Shalom Blessing SHG") # Changed title to include handshake emoji
@@ -2109,6 +4129,69 @@ def main():
             # This would typically save to the database. For now, it's just a display.
             # save_setting("share_value", str(new_share_value)) 
             st.success(f"Share value is currently set to KSh {new_share_value:,.2f}. (Requires backend update for persistence)")
+        
+        st.markdown("---")
+        st.subheader("⚖️ Penalty Rules")
+        with st.form("penalty_rules_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                absence_amount = st.number_input(
+                    "Absence Penalty (KSh)", min_value=0.0, step=50.0,
+                    value=get_setting_amount(ABSENCE_PENALTY_SETTING),
+                    help="Charged to each member marked absent when a meeting's attendance is saved. 0 disables it."
+                )
+            with col2:
+                late_amount = st.number_input(
+                    "Late Repayment Penalty (KSh)", min_value=0.0, step=50.0,
+                    value=get_setting_amount(LATE_REPAYMENT_PENALTY_SETTING),
+                    help="Charged once per active loan that is past its due date. 0 disables it."
+                )
+            if st.form_submit_button("Save Penalty Rules", type="primary"):
+                save_setting(ABSENCE_PENALTY_SETTING, str(absence_amount))
+                save_setting(LATE_REPAYMENT_PENALTY_SETTING, str(late_amount))
+                st.success("✅ Penalty rules saved.")
+        
+        if st.button("⚖️ Apply Late Repayment Penalties Now"):
+            penalties_added = apply_late_repayment_penalties()
+            st.success(f"✅ {penalties_added} late repayment penalty(ies) recorded.")
+        
+        st.markdown("---")
+        st.subheader("🏦 Loan Eligibility Rules")
+        share_multiple, min_attendance_rate = get_loan_eligibility_rules()
+        with st.form("loan_eligibility_rules_form"):
+            col1, col2 = st.columns(2)
+            with col1:
+                new_share_multiple = st.number_input(
+                    "Credit Limit (x Shares Held)", min_value=0.0, step=0.5, value=share_multiple,
+                    help="A member can owe at most this multiple of their shares across all active loans."
+                )
+            with col2:
+                new_min_attendance = st.number_input(
+                    "Minimum Recent Attendance (%)", min_value=0.0, max_value=100.0, step=5.0, value=min_attendance_rate,
+                    help=f"Members attending fewer of their last {RECENT_MEETINGS} meetings cannot borrow. 0 disables it."
+                )
+            if st.form_submit_button("Save Eligibility Rules", type="primary"):
+                save_setting(LOAN_SHARE_MULTIPLE_SETTING, str(new_share_multiple))
+                save_setting(LOAN_MIN_ATTENDANCE_SETTING, str(new_min_attendance))
+                st.success("✅ Loan eligibility rules saved.")
+        
+        st.markdown("---")
+        show_sms_queue()
+        
+        st.markdown("---")
+        show_scheduled_jobs()
+        
+        st.markdown("---")
+        show_change_log()
+        
+        st.markdown("---")
+        show_backups()
+        
+        st.markdown("---")
+        show_financial_year_close()
+        
+        st.markdown("---")
+        show_analytics_export()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+"""Per-member attendance bitmaps and the group-wide attendance analytics built on them.
+
+Each member's attendance is kept in attendance_bitmaps as two bit strings with one bit per
+meeting in date order: `marked` (attendance was recorded for the member) and `present`.
+Unpacked together they form a members x meetings boolean matrix, so questions such as "who
+has missed their last three meetings" or "attendance over the last six meetings" are a few
+NumPy operations over the whole group instead of joins of attendance with meetings.
+
+save_meeting_attendance updates the bits for the saved meeting in the same transaction as
+the attendance rows. Any other write to meetings, members or attendance (bulk import,
+archiving, a restore) leaves the stored bitmaps behind the table versions they were built
+from, and the next read rebuilds them.
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from database import engine, Session, Attendance, AttendanceBitmap, get_table_versions
+
+ATTENDANCE_BITMAP_TABLES = ['meetings', 'attendance', 'members']
+RECENT_MEETINGS = 6 # meetings counted in the "last N meetings" attendance rate
+
+def versions_stamp(versions):
+    """The source_versions value for a set of table write versions."""
+    return ",".join(f"{table}:{versions.get(table, 0)}" for table in ATTENDANCE_BITMAP_TABLES)
+
+def current_stamp(conn):
+    """Stamp of the current table versions, read on conn so it sees that transaction's own writes."""
+    versions = dict(conn.execute(text("SELECT table_name, version FROM table_versions")).fetchall())
+    return versions_stamp(versions)
+
+def stored_stamp(conn):
+    """Stamp the stored bitmaps were built at (None if there are none or they disagree)."""
+    stamps = conn.execute(text("SELECT DISTINCT source_versions FROM attendance_bitmaps")).scalars().all()
+    return stamps[0] if len(stamps) == 1 else None
+
+def get_meeting_order(conn):
+    """Meetings (id, date) in bit order: by date, then id."""
+    return pd.read_sql(text("SELECT id, date FROM meetings ORDER BY date, id"), conn)
+
+def attendance_matrix(conn):
+    """Builds the (member_ids, meetings, present, marked) matrices from the attendance rows."""
+    meetings = get_meeting_order(conn)
+    member_ids = np.array(conn.execute(text("SELECT id FROM members ORDER BY id")).scalars().all(), dtype=np.int64)
+    rows = pd.read_sql(text("SELECT member_id, meeting_id, present FROM attendance"), conn)
+    member_positions = pd.Index(member_ids).get_indexer(rows['member_id'])
+    meeting_positions = pd.Index(meetings['id']).get_indexer(rows['meeting_id'])
+    valid = (member_positions >= 0) & (meeting_positions >= 0)
+
+    present = np.zeros((len(member_ids), len(meetings)), dtype=bool)
+    marked = np.zeros_like(present)
+    marked[member_positions[valid], meeting_positions[valid]] = True
+    present[member_positions[valid], meeting_positions[valid]] = rows['present'].to_numpy(dtype=bool)[valid]
+    return member_ids, meetings, present, marked
+
+def write_bitmaps(conn, member_ids, present, marked, stamp):
+    """Replaces the stored bitmaps with packed rows of the given matrices."""
+    present_bytes = np.packbits(present, axis=1)
+    marked_bytes = np.packbits(marked, axis=1)
+    conn.execute(text("DELETE FROM attendance_bitmaps"))
+    if len(member_ids):
+        conn.execute(AttendanceBitmap.__table__.insert(), [
+            {'member_id': int(member_id), 'present': present_bytes[n].tobytes(), 'marked': marked_bytes[n].tobytes(),
+             'meeting_count': present.shape[1], 'source_versions': stamp}
+            for n, member_id in enumerate(member_ids)
+        ])
+
+def read_bitmaps(conn):
+    """Unpacks the stored bitmaps into (member_ids, present, marked) matrices."""
+    rows = conn.execute(text("""
+        SELECT member_id, present, marked, meeting_count FROM attendance_bitmaps ORDER BY member_id
+    """)).fetchall()
+    meeting_count = rows[0].meeting_count if rows else 0
+    width = (meeting_count + 7) // 8
+    def unpack(column):
+        packed = np.frombuffer(b"".join(getattr(row, column) for row in rows), dtype=np.uint8).reshape(len(rows), width)
+        return np.unpackbits(packed, axis=1, count=meeting_count).astype(bool)
+    return np.array([row.member_id for row in rows], dtype=np.int64), unpack('present'), unpack('marked')
+
+def rebuild_attendance_bitmaps(conn=None):
+    """Rebuilds every member's bitmaps from the attendance rows; returns the number of members."""
+    if conn is None:
+        with engine.begin() as conn:
+            return rebuild_attendance_bitmaps(conn)
+    member_ids, _, present, marked = attendance_matrix(conn)
+    write_bitmaps(conn, member_ids, present, marked, current_stamp(conn))
+    return len(member_ids)
+
+def update_meeting_bits(conn, meeting_id):
+    """Rewrites one meeting's bit in every member's bitmaps from its attendance rows.
+
+    Only valid while the stored bitmaps are otherwise current (see save_meeting_attendance).
+    """
+    meetings = get_meeting_order(conn)
+    position = int(np.flatnonzero(meetings['id'].to_numpy() == meeting_id)[0])
+    member_ids, present, marked = read_bitmaps(conn)
+    rows = pd.read_sql(text("SELECT member_id, present FROM attendance WHERE meeting_id = :mid"), conn,
+                       params={'mid': meeting_id})
+    member_positions = pd.Index(member_ids).get_indexer(rows['member_id'])
+    valid = member_positions >= 0
+    present[:, position] = False
+    marked[:, position] = False
+    marked[member_positions[valid], position] = True
+    present[member_positions[valid], position] = rows['present'].to_numpy(dtype=bool)[valid]
+    write_bitmaps(conn, member_ids, present, marked, current_stamp(conn))
+
+def save_meeting_attendance(meeting_id, attendance):
+    """Saves a meeting's attendance ({member_id: present}) and its bitmap bits in one transaction.
+
+    The write lock is taken first (BEGIN IMMEDIATE), so the bitmaps can be checked against the
+    table versions and then patched without another writer slipping in between. If they were
+    already behind, they are rebuilt instead. Returns the number of attendance rows written.
+    """
+    session = Session()
+    try:
+        conn = session.connection()
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        bitmaps_current = stored_stamp(conn) == current_stamp(conn)
+        existing = {row.member_id: row for row in session.query(Attendance).filter(Attendance.meeting_id == meeting_id)}
+        for member_id, is_present in attendance.items():
+            if member_id in existing:
+                existing[member_id].present = bool(is_present)
+            else:
+                session.add(Attendance(meeting_id=meeting_id, member_id=member_id, present=bool(is_present)))
+        session.flush()
+        if bitmaps_current:
+            update_meeting_bits(conn, meeting_id)
+        else:
+            rebuild_attendance_bitmaps(conn)
+        session.commit()
+        return len(attendance)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+_bitmap_lock = threading.Lock()
+_cached_bitmaps = {'stamp': None, 'bitmaps': None}
+
+def get_attendance_bitmaps():
+    """The group's attendance as matrices, rebuilding the stored bitmaps first if they are behind.
+
+    Returns a dict of member_ids (sorted), meetings (id, date in bit order) and the present and
+    marked boolean matrices (members x meetings). Unpacked matrices are kept per process until
+    the next relevant write.
+    """
+    stamp = versions_stamp(get_table_versions(ATTENDANCE_BITMAP_TABLES))
+    with _bitmap_lock:
+        if _cached_bitmaps['stamp'] != stamp:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                if stored_stamp(conn) != current_stamp(conn):
+                    rebuild_attendance_bitmaps(conn)
+                member_ids, present, marked = read_bitmaps(conn)
+                meetings = get_meeting_order(conn)
+                stamp = current_stamp(conn)
+                conn.commit()
+            _cached_bitmaps.update(stamp=stamp, bitmaps={
+                'member_ids': member_ids, 'meetings': meetings, 'present': present, 'marked': marked})
+        return _cached_bitmaps['bitmaps']
+
+# --- Analytics ---
+# Every function takes the matrices of get_attendance_bitmaps and answers for all members at once.
+# Meetings a member was not marked at (before they joined, or not recorded) are skipped rather
+# than counted as absences.
+def absence_runs(present, marked):
+    """Length of the run of consecutive marked absences ending at each meeting (0 where present)."""
+    absent = marked & ~present
+    absences_so_far = np.cumsum(absent, axis=1, dtype=np.int32)
+    at_last_attendance = np.maximum.accumulate(np.where(marked & present, absences_so_far, 0), axis=1)
+    return absences_so_far - at_last_attendance
+
+def recent_marked(marked, last_n):
+    """Mask of each member's last `last_n` marked meetings."""
+    marked_from_end = np.cumsum(marked[:, ::-1], axis=1, dtype=np.int32)[:, ::-1]
+    return marked & (marked_from_end <= last_n)
+
+def trailing_sums(matrix, window):
+    """Per-row sums over the trailing `window` columns ending at each column."""
+    totals = np.concatenate([np.zeros((len(matrix), 1), dtype=np.int32), np.cumsum(matrix, axis=1, dtype=np.int32)], axis=1)
+    window_starts = np.maximum(np.arange(1, matrix.shape[1] + 1) - window, 0)
+    return totals[:, 1:] - totals[:, window_starts]
+
+def rolling_attendance_rates(bitmaps, window=RECENT_MEETINGS):
+    """Members x meeting dates DataFrame of the attendance rate (%) over the trailing `window` meetings."""
+    attended = trailing_sums(bitmaps['present'] & bitmaps['marked'], window)
+    marked = trailing_sums(bitmaps['marked'], window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rates = attended / marked * 100
+    return pd.DataFrame(rates, index=bitmaps['member_ids'], columns=bitmaps['meetings']['date'])
+
+def attendance_summary(bitmaps, last_n=RECENT_MEETINGS):
+    """Per-member attendance figures indexed by member id.
+
+    Columns: meetings_marked, meetings_attended, attendance_rate (%), last_n_rate (% of the
+    member's last `last_n` marked meetings), longest_absence_streak and current_absence_streak
+    (consecutive marked absences up to the latest meeting).
+    """
+    present, marked = bitmaps['present'], bitmaps['marked']
+    attended = present & marked
+    recent = recent_marked(marked, last_n)
+    runs = absence_runs(present, marked)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary = pd.DataFrame({
+            'meetings_marked': marked.sum(axis=1),
+            'meetings_attended': attended.sum(axis=1),
+            'attendance_rate': attended.sum(axis=1) / marked.sum(axis=1) * 100,
+            'last_n_rate': (attended & recent).sum(axis=1) / recent.sum(axis=1) * 100,
+            'longest_absence_streak': runs.max(axis=1) if runs.shape[1] else 0,
+            'current_absence_streak': runs[:, -1] if runs.shape[1] else 0,
+        }, index=pd.Index(bitmaps['member_ids'], name='member_id'))
+    return summary
+
+def sample_bitmaps(member_count=1000, meeting_count=120, seed=0):
+    """Synthetic bitmaps (members joining over time, ~80% attendance), for benchmarks."""
+    rng = np.random.default_rng(seed)
+    joined_at = rng.integers(0, meeting_count, member_count)
+    marked = np.arange(meeting_count) >= joined_at[:, None]
+    return {
+        'member_ids': np.arange(1, member_count + 1),
+        'meetings': pd.DataFrame({'id': np.arange(1, meeting_count + 1),
+                                  'date': pd.date_range('2020-01-04', periods=meeting_count, freq='4W-SAT')}),
+        'present': marked & (rng.random((member_count, meeting_count)) < 0.8),
+        'marked': marked,
+    }
+
+def benchmark_attendance_analytics(member_count=1000, meeting_count=120, repeat=20):
+    """Times attendance_summary over bitmaps against the same figures from long-format rows.
+
+    The row-based baseline is what the reports do today: group the attendance rows per member
+    for the rates and walk each member's meetings in date order for the streaks.
+    """
+    bitmaps = sample_bitmaps(member_count, meeting_count)
+    member_positions, meeting_positions = np.nonzero(bitmaps['marked'])
+    rows = pd.DataFrame({'member_id': bitmaps['member_ids'][member_positions], 'meeting': meeting_positions,
+                         'present': bitmaps['present'][member_positions, meeting_positions]})
+
+    def row_based():
+        grouped = rows.groupby('member_id')['present']
+        rates = grouped.mean() * 100
+        recent = rows.groupby('member_id').tail(RECENT_MEETINGS).groupby('member_id')['present'].mean() * 100
+        streaks = {}
+        for member_id, member_rows in rows.groupby('member_id'):
+            longest = current = 0
+            for present in member_rows['present']:
+                current = 0 if present else current + 1
+                longest = max(longest, current)
+            streaks[member_id] = (longest, current)
+        return rates, recent, streaks
+
+    def best_of(func):
+        timings = []
+        for _ in range(repeat):
+            timer = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - timer)
+        return min(timings), result
+
+    bitmap_seconds, summary = best_of(lambda: attendance_summary(bitmaps))
+    row_seconds, (rates, recent, streaks) = best_of(row_based)
+    longest = pd.Series({member_id: streak[0] for member_id, streak in streaks.items()})
+    if not (np.allclose(summary['attendance_rate'].loc[rates.index], rates)
+            and np.allclose(summary['last_n_rate'].loc[recent.index], recent)
+            and (summary['longest_absence_streak'].loc[longest.index] == longest).all()):
+        raise AssertionError("Bitmap analytics disagree with the row-based figures")
+    return {
+        'members': member_count, 'meetings': meeting_count,
+        'bitmap_bytes': 2 * member_count * ((meeting_count + 7) // 8),
+        'bitmap_us': bitmap_seconds * 1e6, 'rows_ms': row_seconds * 1000,
+        'speedup': row_seconds / bitmap_seconds,
+    }
@@ -0,0 +1,250 @@
+"""Online backups of the SQLite database file, with rotation, checksums and restore.
+
+    python backup.py                 # take a snapshot
+    python backup.py --list          # list snapshots
+    python backup.py --restore FILE  # restore one (the current state is snapshotted first)
+
+Snapshots are taken with SQLite's online backup API a few pages at a time, releasing the
+read lock between steps, so the app keeps reading and writing while a backup runs. Each
+snapshot is integrity-checked, gzip-compressed and recorded in index.json with its SHA-256;
+only the newest BACKUP_KEEP are kept.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from database import engine, get_table_versions
+
+DEFAULT_BACKUP_DIR = os.environ.get("SHALOM_BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.environ.get("SHALOM_BACKUP_KEEP", "14"))
+BACKUP_PAGES_PER_STEP = 256 # 1 MB per step at SQLite's default 4 KB page size
+BACKUP_STEP_PAUSE = 0.005 # seconds between steps, so waiting writers get the lock
+INDEX_FILE = "index.json"
+
+def database_path():
+    """Path of the live SQLite database file."""
+    if engine.url.get_backend_name() != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        raise RuntimeError("Backups need a file-based SQLite database")
+    return engine.url.database
+
+def file_sha256(path):
+    """Hex SHA-256 of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def check_integrity(path):
+    """Raises ValueError unless SQLite's integrity check passes for the database file."""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise ValueError(f"Integrity check failed for {path}: {result}")
+
+def copy_database(source_path, target_path, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+    """Copies a live database with the online backup API; returns the number of pages copied.
+
+    A write to the source between steps makes SQLite restart the copy, so the result is always
+    a consistent snapshot of one moment.
+    """
+    page_count = 0
+    def step_done(status, remaining, total):
+        nonlocal page_count
+        page_count = total
+        if remaining and pause:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_path, check_same_thread=False)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=step_done)
+    finally:
+        target.close()
+        source.close()
+    return page_count
+
+def get_backups(backup_dir=None):
+    """Snapshot records from the index, newest first, skipping files that no longer exist."""
+    backup_dir = backup_dir or DEFAULT_BACKUP_DIR
+    path = os.path.join(backup_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        backups = json.load(f)
+    return [entry for entry in backups if os.path.exists(os.path.join(backup_dir, entry['file']))]
+
+def save_backup_index(backups, backup_dir):
+    """Writes the index atomically so a crash never leaves it half-written."""
+    path = os.path.join(backup_dir, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(backups, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def create_backup(backup_dir=None, label='scheduled', keep=BACKUP_KEEP,
+                  pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+    """Takes a compressed, checksummed snapshot of the live database and rotates old ones.
+
+    Returns the snapshot's index record.
+    """
+    backup_dir = backup_dir or DEFAULT_BACKUP_DIR
+    os.makedirs(backup_dir, exist_ok=True)
+    created = datetime.now()
+    file_name = f"shalom_blessing-{created.strftime('%Y%m%d-%H%M%S-%f')}.db.gz"
+
+    timer = time.perf_counter()
+    with tempfile.TemporaryDirectory(dir=backup_dir) as work_dir:
+        snapshot_path = os.path.join(work_dir, "snapshot.db")
+        page_count = copy_database(database_path(), snapshot_path, pages, pause)
+        copy_seconds = time.perf_counter() - timer
+        check_integrity(snapshot_path)
+        database_bytes = os.path.getsize(snapshot_path)
+        with open(snapshot_path, 'rb') as src, gzip.open(os.path.join(work_dir, file_name), 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(os.path.join(work_dir, file_name), os.path.join(backup_dir, file_name))
+
+    entry = {
+        'file': file_name,
+        'created_at': created.isoformat(timespec='seconds'),
+        'label': label,
+        'pages': page_count,
+        'database_bytes': database_bytes,
+        'compressed_bytes': os.path.getsize(os.path.join(backup_dir, file_name)),
+        'sha256': file_sha256(os.path.join(backup_dir, file_name)),
+        'copy_seconds': round(copy_seconds, 3),
+        'seconds': round(time.perf_counter() - timer, 3),
+    }
+    backups = [entry] + get_backups(backup_dir)
+    for old in backups[keep:]:
+        os.remove(os.path.join(backup_dir, old['file']))
+    save_backup_index(backups[:keep], backup_dir)
+    return entry
+
+def verify_backup(file_name, backup_dir=None):
+    """Returns True if the snapshot file still matches the checksum recorded when it was taken."""
+    backup_dir = backup_dir or DEFAULT_BACKUP_DIR
+    entry = next((b for b in get_backups(backup_dir) if b['file'] == file_name), None)
+    if entry is None:
+        raise ValueError(f"No backup named {file_name}")
+    return file_sha256(os.path.join(backup_dir, file_name)) == entry['sha256']
+
+def restore_backup(file_name, backup_dir=None):
+    """Replaces the live database with a snapshot; returns the record of the safety snapshot.
+
+    The snapshot's checksum and integrity are checked first, and the current database is
+    backed up (label 'pre-restore') so the restore itself can be undone. Table versions are
+    moved past both the old and restored values so no cached page data survives the restore.
+    """
+    backup_dir = backup_dir or DEFAULT_BACKUP_DIR
+    if not verify_backup(file_name, backup_dir):
+        raise ValueError(f"Checksum mismatch: {file_name} is corrupt")
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as work_dir:
+        restored_path = os.path.join(work_dir, "restore.db")
+        with gzip.open(os.path.join(backup_dir, file_name), 'rb') as src, open(restored_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        check_integrity(restored_path)
+
+        safety_backup = create_backup(backup_dir, label='pre-restore', keep=BACKUP_KEEP + 1)
+        previous_versions = get_table_versions()
+        engine.dispose() # No pooled connection may hold a stale view of the replaced file
+        copy_database(restored_path, database_path(), pages=-1, pause=0)
+
+    with engine.begin() as conn:
+        restored_versions = dict(conn.execute(text("SELECT table_name, version FROM table_versions")).fetchall())
+        for table, version in previous_versions.items():
+            conn.execute(text("""
+                INSERT INTO table_versions (table_name, version) VALUES (:table, :version)
+                ON CONFLICT(table_name) DO UPDATE SET version = excluded.version
+            """), {'table': table, 'version': max(version, restored_versions.get(table, 0)) + 1})
+    return safety_backup
+
+def scheduled_backup():
+    """Job entry point: takes a snapshot and returns a one-line summary."""
+    entry = create_backup()
+    return (f"{entry['file']}: {entry['database_bytes'] / 1e6:.1f} MB -> "
+            f"{entry['compressed_bytes'] / 1e6:.1f} MB in {entry['seconds']:.2f}s")
+
+def benchmark_backup(probe, probes=50, pages=BACKUP_PAGES_PER_STEP, pause=BACKUP_STEP_PAUSE):
+    """Measures backup throughput and how much a running backup slows a concurrent page query.
+
+    `probe` is a callable standing in for a page load (e.g. a repository query). It is timed
+    `probes` times on its own, then repeatedly while snapshots are taken into a temporary
+    directory. A write-lock probe (BEGIN IMMEDIATE; ROLLBACK) is timed the same way, since
+    writers are the ones a backup step can hold up.
+    """
+    def lock_probe():
+        conn = sqlite3.connect(database_path(), timeout=30)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.rollback()
+        finally:
+            conn.close()
+
+    def time_calls(func, count=None, until=None):
+        timings = []
+        while (count is not None and len(timings) < count) or (until is not None and not until.is_set()):
+            timer = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - timer)
+            if until is not None:
+                time.sleep(0.01) # Paced like page traffic rather than a busy loop holding the GIL
+        return timings
+
+    def summary(timings):
+        return {'median_ms': statistics.median(timings) * 1000,
+                'p95_ms': sorted(timings)[int(len(timings) * 0.95)] * 1000, 'samples': len(timings)}
+
+    baseline = {'read': summary(time_calls(probe, probes)), 'write_lock': summary(time_calls(lock_probe, probes))}
+
+    done = threading.Event()
+    during = {}
+    threads = [
+        threading.Thread(target=lambda: during.setdefault('read', time_calls(probe, until=done))),
+        threading.Thread(target=lambda: during.setdefault('write_lock', time_calls(lock_probe, until=done))),
+    ]
+    with tempfile.TemporaryDirectory() as backup_dir:
+        for thread in threads:
+            thread.start()
+        entries = []
+        timer = time.perf_counter()
+        while len(entries) < 3 or time.perf_counter() - timer < 1:
+            entries.append(create_backup(backup_dir, label='benchmark', pages=pages, pause=pause))
+        done.set()
+        for thread in threads:
+            thread.join()
+
+    copy_seconds = sum(entry['copy_seconds'] for entry in entries)
+    return {
+        'backups': len(entries),
+        'database_mb': entries[0]['database_bytes'] / 1e6,
+        'compression_ratio': entries[0]['database_bytes'] / entries[0]['compressed_bytes'],
+        'copy_mb_per_second': sum(entry['database_bytes'] for entry in entries) / 1e6 / copy_seconds,
+        'backup_seconds': statistics.mean(entry['seconds'] for entry in entries),
+        'baseline': baseline,
+        'during_backup': {name: summary(timings) for name, timings in during.items()},
+    }
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == '--list':
+        for backup in get_backups():
+            print(f"{backup['file']}  {backup['label']:<12} {backup['compressed_bytes'] / 1e6:8.2f} MB  {backup['sha256'][:12]}")
+    elif len(sys.argv) > 2 and sys.argv[1] == '--restore':
+        safety = restore_backup(sys.argv[2])
+        print(f"Restored {sys.argv[2]}; previous state saved as {safety['file']}")
+    else:
+        print(scheduled_backup())
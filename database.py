@@ -0,0 +1,698 @@
+"""Database configuration, models and core loan calculations for Shalom Blessing SHG.
+
+Shared by the Streamlit app, the JSON API and batch jobs; importing it does not import Streamlit.
+"""
+import os
+import calendar
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import create_engine, text, Column, Integer, String, Float, Boolean, Date, DateTime, LargeBinary
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import ForeignKey, event
+
+# --- Database Configuration (SQLite) ---
+DATABASE_URL = os.environ.get("SHALOM_DATABASE_URL", "sqlite:///shalom_blessing_v2.db")
+
+def get_database_engine():
+    """Initializes and returns the SQLAlchemy engine."""
+    return create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+engine = get_database_engine() # Created once per process when the module is first imported
+
+change_actor = ContextVar('change_actor', default='app')
+
+@event.listens_for(engine, 'connect')
+def register_change_actor(dbapi_connection, connection_record):
+    """Lets the change-log triggers ask who is writing (see acting_as)."""
+    dbapi_connection.create_function('change_actor', 0, change_actor.get)
+
+# Raw rows of archived financial years are moved here; attached only while it is read or written
+ARCHIVE_DATABASE_PATH = os.environ.get("SHALOM_ARCHIVE_PATH", "shalom_blessing_archive.db")
+
+@contextmanager
+def attached_archive(path=None):
+    """Yields a connection with the archive database file attached as schema 'archive'.
+
+    The file is created on first use. Commit on the yielded connection before leaving the block;
+    anything uncommitted is rolled back so the archive can be detached.
+    """
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ATTACH DATABASE ? AS archive", (path or ARCHIVE_DATABASE_PATH,))
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql("DETACH DATABASE archive")
+
+Base = declarative_base()
+
+# --- Database Models ---
+class Member(Base):
+    __tablename__ = 'members'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False, unique=True)
+    phone = Column(String(20))
+    status = Column(String(20), default='active')
+    join_date = Column(Date, default=date.today)
+    
+class Meeting(Base):
+    __tablename__ = 'meetings'
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False, unique=True)
+    notes = Column(String(500))
+    financial_year = Column(String(10))
+
+class Attendance(Base):
+    __tablename__ = 'attendance'
+    id = Column(Integer, primary_key=True)
+    meeting_id = Column(Integer, ForeignKey('meetings.id', ondelete="CASCADE"))
+    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
+    present = Column(Boolean, default=False)
+
+class Contribution(Base):
+    __tablename__ = 'contributions'
+    id = Column(Integer, primary_key=True)
+    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
+    meeting_id = Column(Integer, ForeignKey('meetings.id', ondelete="CASCADE"), nullable=True)
+    votehead = Column(String(20)) # e.g., 'shares', 'welfare'
+    amount = Column(Float)
+    date = Column(Date, default=date.today)
+
+class Loan(Base):
+    __tablename__ = 'loans'
+    id = Column(Integer, primary_key=True)
+    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
+    type = Column(String(20)) # e.g., 'development', 'emergency'
+    amount = Column(Float)
+    interest_rate = Column(Float)
+    start_date = Column(Date)
+    due_date = Column(Date)
+    status = Column(String(20), default='active') # 'active', 'completed', 'defaulted'
+    version = Column(Integer, nullable=False, default=1, server_default='1') # compare-and-swap token, bumped on every ORM update
+    __mapper_args__ = {'version_id_col': version}
+
+class Repayment(Base):
+    __tablename__ = 'repayments'
+    id = Column(Integer, primary_key=True)
+    loan_id = Column(Integer, ForeignKey('loans.id', ondelete="CASCADE"))
+    amount = Column(Float)
+    date = Column(Date, default=date.today)
+
+class Penalty(Base):
+    __tablename__ = 'penalties'
+    id = Column(Integer, primary_key=True)
+    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
+    amount = Column(Float)
+    reason = Column(String(200))
+    date = Column(Date, default=date.today)
+    category = Column(String(20)) # 'absence', 'late_repayment' for generated penalties; NULL if manual
+    meeting_id = Column(Integer, ForeignKey('meetings.id', ondelete="CASCADE"), nullable=True)
+    loan_id = Column(Integer, ForeignKey('loans.id', ondelete="CASCADE"), nullable=True)
+
+class Expense(Base):
+    __tablename__ = 'expenses'
+    id = Column(Integer, primary_key=True)
+    category = Column(String(50))
+    description = Column(String(200))
+    amount = Column(Float)
+    date = Column(Date, default=date.today)
+
+class Dividend(Base):
+    __tablename__ = 'dividends'
+    id = Column(Integer, primary_key=True)
+    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
+    amount = Column(Float)
+    cycle_year = Column(String(10))
+    shares = Column(Integer)
+    rate_per_share = Column(Float)
+    
+class Setting(Base):
+    __tablename__ = 'settings'
+    key = Column(String(50), primary_key=True)
+    value = Column(String(200))
+
+# SMS Reminder class (for future SMS integration)
+class SMSReminder(Base):
+    __tablename__ = 'sms_reminders'
+    id = Column(Integer, primary_key=True)
+    meeting_id = Column(Integer, ForeignKey('meetings.id', ondelete="CASCADE"))
+    sent_date = Column(Date)
+    status = Column(String(20), default='pending')  # pending, sent, failed
+
+class SMSMessage(Base):
+    __tablename__ = 'sms_messages'
+    id = Column(Integer, primary_key=True)
+    reminder_id = Column(Integer, ForeignKey('sms_reminders.id', ondelete="CASCADE"), index=True)
+    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
+    phone = Column(String(20))
+    body = Column(String(320))
+    status = Column(String(20), default='pending', index=True)  # pending, sent, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(String(200))
+    sent_at = Column(DateTime)
+
+class StatementReceipt(Base):
+    __tablename__ = 'statement_receipts'
+    receipt = Column(String(30), primary_key=True) # Mobile-money transaction code
+    member_id = Column(Integer, ForeignKey('members.id', ondelete="CASCADE"))
+    amount = Column(Float)
+    date = Column(Date)
+    votehead = Column(String(20)) # what the line was posted as: shares, welfare, repayment
+    posted_at = Column(DateTime)
+
+class LoanInstalment(Base):
+    __tablename__ = 'loan_instalments'
+    id = Column(Integer, primary_key=True)
+    loan_id = Column(Integer, ForeignKey('loans.id', ondelete="CASCADE"), index=True)
+    instalment_no = Column(Integer)
+    due_date = Column(Date)
+    principal_due = Column(Float)
+    interest_due = Column(Float)
+    amount_due = Column(Float) # principal_due + interest_due
+
+class JobRun(Base):
+    __tablename__ = 'job_runs'
+    name = Column(String(50), primary_key=True)
+    last_started = Column(DateTime)
+    last_finished = Column(DateTime)
+    last_status = Column(String(20)) # 'running', 'success', 'failed'
+    last_message = Column(String(500))
+    last_duration = Column(Float) # seconds
+
+class TableVersion(Base):
+    __tablename__ = 'table_versions'
+    table_name = Column(String(50), primary_key=True)
+    version = Column(Integer, default=0) # bumped by triggers on every insert, update and delete
+
+class MonthlyRollup(Base):
+    __tablename__ = 'monthly_rollup'
+    month = Column(String(7), primary_key=True) # 'YYYY-MM'
+    flow = Column(String(20), primary_key=True) # contributions, disbursements, repayments, penalties, expenses
+    votehead = Column(String(50), primary_key=True) # votehead, loan type or category within the flow ('' if none)
+    amount = Column(Float, default=0.0)
+    entries = Column(Integer, default=0)
+
+class FinancialYearClose(Base):
+    __tablename__ = 'financial_year_closes'
+    financial_year = Column(String(10), primary_key=True) # e.g. '2024-2025' (March to February)
+    period_start = Column(Date)
+    period_end = Column(Date)
+    closed_at = Column(DateTime)
+    locked = Column(Boolean, default=True) # rows dated up to period_end reject edits while set
+    archived_at = Column(DateTime) # set once the year's raw rows were moved to the archive file
+    archived_rows = Column(Integer, default=0)
+
+class MemberYearBalance(Base):
+    __tablename__ = 'member_year_balances'
+    financial_year = Column(String(10), primary_key=True)
+    member_id = Column(Integer, primary_key=True)
+    shares_in_year = Column(Float, default=0.0)
+    welfare_in_year = Column(Float, default=0.0)
+    penalties_in_year = Column(Float, default=0.0)
+    shares_closing = Column(Float, default=0.0) # cumulative to period_end
+    welfare_closing = Column(Float, default=0.0)
+    loan_balance = Column(Float, default=0.0) # outstanding on all loans at period_end
+    meetings_marked = Column(Integer, default=0)
+    meetings_attended = Column(Integer, default=0)
+
+class LoanYearBalance(Base):
+    __tablename__ = 'loan_year_balances'
+    financial_year = Column(String(10), primary_key=True)
+    loan_id = Column(Integer, primary_key=True)
+    member_id = Column(Integer)
+    type = Column(String(20))
+    amount = Column(Float)
+    start_date = Column(Date)
+    repaid_in_year = Column(Float, default=0.0)
+    repaid_to_date = Column(Float, default=0.0) # cumulative to period_end
+    closing_balance = Column(Float, default=0.0)
+
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+    __table_args__ = {'sqlite_autoincrement': True} # seq values are never reused, even after a rollback
+    seq = Column(Integer, primary_key=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(String(100), nullable=False) # primary key value; JSON list for composite keys
+    operation = Column(String(10), nullable=False) # 'insert', 'update', 'delete'
+    changes = Column(String, nullable=False) # JSON {column: [old, new]}
+    changed_at = Column(DateTime, nullable=False)
+    changed_by = Column(String(100))
+
+class AttendanceBitmap(Base):
+    __tablename__ = 'attendance_bitmaps'
+    member_id = Column(Integer, primary_key=True)
+    present = Column(LargeBinary) # bit n set: attended the n-th meeting in date order (numpy.packbits layout)
+    marked = Column(LargeBinary) # bit n set: attendance was recorded for the member at the n-th meeting
+    meeting_count = Column(Integer, default=0)
+    source_versions = Column(String(100)) # meetings/attendance/members write versions the bits reflect
+
+Base.metadata.create_all(engine) # Create tables if they don't exist
+
+# Additive changes to tables that already existed before a column was introduced
+SCHEMA_COLUMN_ADDITIONS = [
+    ('penalties', 'category', 'VARCHAR(20)'),
+    ('penalties', 'meeting_id', 'INTEGER REFERENCES meetings(id) ON DELETE CASCADE'),
+    ('penalties', 'loan_id', 'INTEGER REFERENCES loans(id) ON DELETE CASCADE'),
+    ('loans', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+]
+SCHEMA_INDEXES = [
+    # One generated absence penalty per member per meeting, one late penalty per loan
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_penalties_absence ON penalties (member_id, meeting_id) WHERE category = 'absence'",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_penalties_late_repayment ON penalties (loan_id) WHERE category = 'late_repayment'",
+    # Covers the attendance of a range of meetings (report queries look meetings up by their unique date first)
+    "CREATE INDEX IF NOT EXISTS ix_attendance_meeting ON attendance (meeting_id, member_id, present)",
+]
+
+# Tables whose write version is tracked, for ETags and caches keyed on the data they read
+VERSIONED_TABLES = [
+    'members', 'meetings', 'attendance', 'contributions', 'loans', 'repayments',
+    'penalties', 'expenses', 'dividends', 'loan_instalments', 'change_log',
+]
+
+# Money flows summarised in monthly_rollup: flow -> (source table, date column, votehead column or None)
+ROLLUP_FLOWS = {
+    'contributions': ('contributions', 'date', 'votehead'),
+    'disbursements': ('loans', 'start_date', 'type'),
+    'repayments': ('repayments', 'date', None),
+    'penalties': ('penalties', 'date', 'category'),
+    'expenses': ('expenses', 'date', 'category'),
+}
+
+# Writes dated on or before these dates are rejected / no longer counted in the rollup
+LOCKED_THROUGH_SQL = "(SELECT COALESCE(MAX(period_end), '') FROM financial_year_closes WHERE locked)"
+CLOSED_THROUGH_SQL = "(SELECT COALESCE(MAX(period_end), '') FROM financial_year_closes)"
+
+# Tables guarded by closed periods: table -> (date expression per row, columns whose update is guarded)
+PERIOD_LOCKED_TABLES = {
+    'contributions': ("{row}.date", None),
+    'repayments': ("{row}.date", None),
+    'penalties': ("{row}.date", None),
+    'expenses': ("{row}.date", None),
+    'meetings': ("{row}.date", None),
+    'attendance': ("(SELECT date FROM meetings WHERE id = {row}.meeting_id)", None),
+    # A loan from a closed year may still be repaid and completed; only its terms are frozen
+    'loans': ("{row}.start_date", "member_id, type, amount, interest_rate, start_date"),
+}
+
+PERIOD_LOCKED_MESSAGE = 'This record falls in a closed financial year and cannot be changed'
+
+def is_period_locked_error(error):
+    """True if a database error was raised by a period-lock trigger."""
+    return PERIOD_LOCKED_MESSAGE in str(error)
+
+def period_lock_trigger_sql(table, operation):
+    """Trigger rejecting writes to rows dated inside a locked (closed) financial year."""
+    date_expression, guarded_columns = PERIOD_LOCKED_TABLES[table]
+    rows = {'INSERT': ['NEW'], 'DELETE': ['OLD'], 'UPDATE': ['OLD', 'NEW']}[operation]
+    condition = " OR ".join(f"{date_expression.format(row=row)} <= {LOCKED_THROUGH_SQL}" for row in rows)
+    event = f"UPDATE OF {guarded_columns}" if operation == 'UPDATE' and guarded_columns else operation
+    return f"""
+        CREATE TRIGGER trg_{table}_lock_{operation.lower()}
+        BEFORE {event} ON {table}
+        WHEN {condition}
+        BEGIN
+            SELECT RAISE(ABORT, '{PERIOD_LOCKED_MESSAGE}');
+        END
+    """
+
+def rollup_upsert_sql(flow, select):
+    """SQL adding the (month, votehead, amount, entries) rows of a SELECT into monthly_rollup."""
+    return f"""
+        INSERT INTO monthly_rollup (month, flow, votehead, amount, entries)
+        SELECT month, '{flow}', votehead, amount, entries FROM ({select}) WHERE month IS NOT NULL
+        ON CONFLICT(month, flow, votehead) DO UPDATE SET
+            amount = amount + excluded.amount, entries = entries + excluded.entries;
+    """
+
+def rollup_trigger_sql(flow, operation):
+    """Trigger keeping monthly_rollup in step with one write operation on a flow's source table."""
+    table, date_column, votehead_column = ROLLUP_FLOWS[flow]
+    changes = []
+    for row, sign in (('OLD', -1), ('NEW', 1)):
+        if (row, operation) in (('OLD', 'INSERT'), ('NEW', 'DELETE')):
+            continue
+        votehead = f"COALESCE({row}.{votehead_column}, '')" if votehead_column else "''"
+        month = f"strftime('%Y-%m', {row}.{date_column})"
+        # Closed periods are frozen in the rollup, so archiving their rows does not change it
+        changes.append(rollup_upsert_sql(flow, f"""
+            SELECT {month} as month, {votehead} as votehead,
+                   {sign} * COALESCE({row}.amount, 0) as amount, {sign} as entries
+            WHERE {row}.{date_column} > {CLOSED_THROUGH_SQL}
+        """))
+        if row == 'OLD':
+            # Drop the month's row once its last entry is gone, as a rebuild would
+            changes.append(f"""
+                DELETE FROM monthly_rollup
+                WHERE month = {month} AND flow = '{flow}' AND votehead = {votehead} AND entries = 0;
+            """)
+    return f"""
+        CREATE TRIGGER trg_{table}_rollup_{operation.lower()}
+        AFTER {operation} ON {table}
+        BEGIN
+            {''.join(changes)}
+        END
+    """
+
+def rebuild_monthly_rollup(conn=None):
+    """Recomputes the open-period months of monthly_rollup from the source tables.
+
+    Months of closed financial years are frozen and kept as they are, since their raw rows may
+    have been archived. Returns the number of rollup rows.
+    """
+    if conn is None:
+        with engine.begin() as conn:
+            return rebuild_monthly_rollup(conn)
+    closed_through = conn.execute(text(f"SELECT {CLOSED_THROUGH_SQL}")).scalar()
+    conn.execute(text("DELETE FROM monthly_rollup WHERE month > :month"), {'month': str(closed_through)[:7]})
+    for flow, (table, date_column, votehead_column) in ROLLUP_FLOWS.items():
+        votehead = f"COALESCE({votehead_column}, '')" if votehead_column else "''"
+        conn.execute(text(rollup_upsert_sql(flow, f"""
+            SELECT strftime('%Y-%m', {date_column}) as month, {votehead} as votehead,
+                   SUM(COALESCE(amount, 0)) as amount, COUNT(*) as entries
+            FROM {table}
+            WHERE {date_column} > :closed_through
+            GROUP BY month, votehead
+        """)), {'closed_through': closed_through})
+    return conn.execute(text("SELECT COUNT(*) FROM monthly_rollup")).scalar()
+
+# --- Change Log ---
+# Every write to the other tables is appended to change_log by AFTER triggers, in the same
+# transaction, whether it comes from the ORM or from raw SQL. Bookkeeping tables the app
+# maintains itself are not logged.
+CHANGE_LOG_EXCLUDED_TABLES = {'change_log', 'table_versions', 'job_runs', 'monthly_rollup', 'attendance_bitmaps'}
+CHANGE_LOGGED_TABLES = [table for table in Base.metadata.tables if table not in CHANGE_LOG_EXCLUDED_TABLES]
+
+def change_log_trigger_sql(table, operation):
+    """Trigger appending a change_log row for each row a statement inserts, updates or deletes.
+
+    `changes` is a JSON {column: [old, new]} of every column for inserts and deletes, and of the
+    changed columns for updates (updates that change nothing are not logged). `changed_by` comes
+    from the change_actor() SQL function registered on the app's connections.
+    """
+    row = 'OLD' if operation == 'DELETE' else 'NEW'
+    keys = [f"{row}.{column.name}" for column in table.primary_key]
+    row_id = f"CAST({keys[0]} AS TEXT)" if len(keys) == 1 else f"json_array({', '.join(keys)})"
+    columns = [column.name for column in table.columns]
+    if operation == 'INSERT':
+        values = {column: f"json_array(NULL, NEW.{column})" for column in columns}
+    elif operation == 'DELETE':
+        values = {column: f"json_array(OLD.{column}, NULL)" for column in columns}
+    else:
+        values = {column: f"CASE WHEN OLD.{column} IS NOT NEW.{column} THEN json_array(OLD.{column}, NEW.{column}) END"
+                  for column in columns}
+    # json_patch onto {} drops the unchanged (NULL) columns
+    changes = "json_patch('{}', json_object(" + ", ".join(f"'{column}', {value}" for column, value in values.items()) + "))"
+    condition = ""
+    if operation == 'UPDATE':
+        condition = "WHEN " + " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in columns)
+    return f"""
+        CREATE TRIGGER trg_{table.name}_change_log_{operation.lower()}
+        AFTER {operation} ON {table.name}
+        {condition}
+        BEGIN
+            INSERT INTO change_log (table_name, row_id, operation, changes, changed_at, changed_by)
+            VALUES ('{table.name}', {row_id}, '{operation.lower()}', {changes},
+                    strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'), change_actor());
+        END
+    """
+
+def migrate_schema():
+    """Adds columns, indexes and triggers that create_all cannot add to existing tables."""
+    with engine.begin() as conn:
+        for table, column, ddl in SCHEMA_COLUMN_ADDITIONS:
+            existing_columns = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+            if column not in existing_columns:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        for statement in SCHEMA_INDEXES:
+            conn.execute(text(statement))
+        for table in VERSIONED_TABLES:
+            for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(text(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{operation.lower()}
+                    AFTER {operation} ON {table}
+                    BEGIN
+                        INSERT INTO table_versions (table_name, version) VALUES ('{table}', 1)
+                        ON CONFLICT(table_name) DO UPDATE SET version = version + 1;
+                    END
+                """))
+        # Rollup and period-lock triggers are recreated on every start so changes to them apply
+        for flow, (table, _, _) in ROLLUP_FLOWS.items():
+            for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{table}_rollup_{operation.lower()}"))
+                conn.execute(text(rollup_trigger_sql(flow, operation)))
+        for table in PERIOD_LOCKED_TABLES:
+            for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{table}_lock_{operation.lower()}"))
+                conn.execute(text(period_lock_trigger_sql(table, operation)))
+        for table in CHANGE_LOGGED_TABLES:
+            for operation in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(text(f"DROP TRIGGER IF EXISTS trg_{table}_change_log_{operation.lower()}"))
+                conn.execute(text(change_log_trigger_sql(Base.metadata.tables[table], operation)))
+        # The change log is append-only
+        for operation in ('UPDATE', 'DELETE'):
+            conn.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_change_log_no_{operation.lower()}
+                BEFORE {operation} ON change_log
+                BEGIN
+                    SELECT RAISE(ABORT, 'The change log is append-only');
+                END
+            """))
+        # First run against an existing database: seed the rollup from the history
+        if not conn.execute(text("SELECT 1 FROM monthly_rollup LIMIT 1")).first():
+            rebuild_monthly_rollup(conn)
+
+migrate_schema()
+Session = sessionmaker(bind=engine)
+
+@contextmanager
+def acting_as(actor):
+    """Attributes change-log entries written inside the block to actor (e.g. 'job:sms_dispatch')."""
+    token = change_actor.set(actor)
+    try:
+        yield
+    finally:
+        change_actor.reset(token)
+
+# --- Helper & Utility Functions ---
+SHARE_VALUE = 1000 # KSh 1000 per share
+EMERGENCY_MONTHLY_INTEREST_RATE = 0.02 # 2% simple interest per month
+DEVELOPMENT_LOAN_TERM_MONTHS = 12
+DEVELOPMENT_INTEREST_RATE = 10.0 # default annual simple interest (%) on development loans
+
+def get_setting(key, default=None):
+    """Retrieves a setting from the database."""
+    session = Session()
+    setting = session.query(Setting).filter(Setting.key == key).first()
+    session.close()
+    return setting.value if setting else default
+
+def save_setting(key, value):
+    """Saves a setting to the database."""
+    session = Session()
+    setting = session.query(Setting).filter(Setting.key == key).first()
+    if setting:
+        setting.value = value
+    else:
+        setting = Setting(key=key, value=value)
+        session.add(setting)
+    session.commit()
+    session.close()
+
+def get_table_versions(tables=None, conn=None):
+    """Returns the current write version of each tracked table (0 if never written).
+    
+    Pass `conn` to read them inside that connection's transaction.
+    """
+    tables = tables or VERSIONED_TABLES
+    if conn is None:
+        with engine.connect() as conn:
+            return get_table_versions(tables, conn)
+    versions = dict(conn.execute(text("SELECT table_name, version FROM table_versions")).fetchall())
+    return {table: versions.get(table, 0) for table in tables}
+
+def get_setting_amount(key, default=0.0):
+    """Retrieves a numeric (KSh) setting, falling back to the default if unset or invalid."""
+    try:
+        return float(get_setting(key, default))
+    except (TypeError, ValueError):
+        return default
+
+def loan_balance(loan, total_repaid, as_of=None):
+    """Balance of a Loan given the total repaid on it, including interest.
+    
+    Emergency loans: 2% simple interest monthly on the original amount.
+    Development loans: Annual simple interest on the original amount.
+    """
+    as_of = as_of or date.today()
+    interest = 0
+    if loan.type == 'emergency':
+        # Full calendar months elapsed since the loan start; none before the start month
+        months_elapsed = max(0, (as_of.year - loan.start_date.year) * 12 + (as_of.month - loan.start_date.month))
+        if as_of < loan.start_date:
+            months_elapsed = 0
+        interest = loan.amount * EMERGENCY_MONTHLY_INTEREST_RATE * months_elapsed
+    else: # For development loans (or any other type)
+        # Annual simple interest
+        days_elapsed = (as_of - loan.start_date).days
+        interest = loan.amount * (loan.interest_rate / 100) * (days_elapsed / 365)
+    
+    total_owed = loan.amount + interest
+    return max(0, total_owed - total_repaid)
+
+def calculate_loan_balance(loan_id):
+    """Calculates the current balance for a loan, including interest."""
+    session = Session()
+    try:
+        loan = session.query(Loan).get(loan_id)
+        if not loan: return 0
+        total_repaid = session.execute(text("SELECT COALESCE(SUM(amount), 0) FROM repayments WHERE loan_id = :lid"), {'lid': loan_id}).scalar()
+        return loan_balance(loan, total_repaid)
+    finally:
+        session.close()
+
+class LoanConflictError(ValueError):
+    """The loan changed after the caller read it; reload and try again."""
+
+def record_repayment(loan_id, amount, repayment_date, expected_version=None, session_factory=None):
+    """Records a repayment in one transaction; returns the loan's remaining balance.
+    
+    The write lock is taken before the balance is read (BEGIN IMMEDIATE), so two repayments of
+    the same loan are serialized and the second sees the first. The loan's version is bumped with
+    a compare-and-swap: if expected_version (the version the caller showed the user) is stale, or
+    the row changed underneath, LoanConflictError is raised and nothing is written. Repayments
+    above the balance, or on a loan that is not active, raise ValueError.
+    """
+    session = (session_factory or Session)()
+    try:
+        session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        loan = session.get(Loan, loan_id)
+        if loan is None:
+            raise ValueError(f"Loan {loan_id} does not exist")
+        if expected_version is not None and loan.version != expected_version:
+            raise LoanConflictError("This loan was updated by someone else - reload it and try again")
+        if loan.status != 'active':
+            raise ValueError(f"This loan is {loan.status}; repayments can only be recorded on active loans")
+        total_repaid = session.execute(
+            text("SELECT COALESCE(SUM(amount), 0) FROM repayments WHERE loan_id = :lid"), {'lid': loan_id}
+        ).scalar()
+        balance = round(loan_balance(loan, total_repaid), 2)
+        if amount > balance:
+            raise ValueError(f"Repayment of KSh {amount:,.2f} exceeds the balance of KSh {balance:,.2f}")
+        
+        session.add(Repayment(loan_id=loan_id, amount=amount, date=repayment_date))
+        if amount >= balance:
+            loan.status = 'completed'
+        loan.version = loan.version + 1 # UPDATE ... WHERE version = <read version>
+        try:
+            session.commit()
+        except StaleDataError:
+            raise LoanConflictError("This loan was updated by someone else - reload it and try again")
+        return balance - amount
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def stress_test_repayments(workers=8, attempts_per_worker=25, amount=500.0, stale_reads=True):
+    """Fires concurrent repayments at one loan in a scratch database and checks none overpay it.
+    
+    Each worker reads the loan's version as a form would, then calls record_repayment with it
+    (or without it when stale_reads is False, leaving only the lock and the balance check).
+    Returns the outcome counts, the balance left and the throughput.
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        scratch_engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'stress.db')}",
+                                       connect_args={"check_same_thread": False, "timeout": 30})
+        Base.metadata.create_all(scratch_engine)
+        scratch_session = sessionmaker(bind=scratch_engine)
+        loan_amount = workers * attempts_per_worker * amount / 2 # half the attempts can succeed
+        with scratch_session() as session:
+            member = Member(name="Stress Test")
+            session.add(member)
+            session.flush()
+            loan = Loan(member_id=member.id, type='development', amount=loan_amount, interest_rate=0,
+                        start_date=date.today(), due_date=date.today())
+            session.add(loan)
+            session.commit()
+            loan_id = loan.id
+        
+        outcomes = {'recorded': 0, 'conflict': 0, 'rejected': 0}
+        outcomes_lock = threading.Lock()
+        def worker():
+            for _ in range(attempts_per_worker):
+                expected_version = None
+                if stale_reads:
+                    with scratch_session() as session:
+                        expected_version = session.get(Loan, loan_id).version
+                try:
+                    record_repayment(loan_id, amount, date.today(), expected_version, scratch_session)
+                    outcome = 'recorded'
+                except LoanConflictError:
+                    outcome = 'conflict'
+                except ValueError:
+                    outcome = 'rejected'
+                with outcomes_lock:
+                    outcomes[outcome] += 1
+        
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        timer = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - timer
+        
+        with scratch_engine.connect() as conn:
+            total_repaid = conn.execute(text("SELECT COALESCE(SUM(amount), 0) FROM repayments")).scalar()
+            status, version = conn.execute(text("SELECT status, version FROM loans WHERE id = :lid"), {'lid': loan_id}).one()
+        scratch_engine.dispose()
+    
+    return {
+        **outcomes,
+        'loan_amount': loan_amount,
+        'total_repaid': total_repaid,
+        'overpaid': total_repaid > loan_amount,
+        'loan_status': status,
+        'loan_version': version,
+        'seconds': elapsed,
+        'attempts_per_second': workers * attempts_per_worker / elapsed if elapsed > 0 else float('inf'),
+    }
+
+def add_months(date_obj, months):
+    """Adds calendar months to a date, keeping the day within the target month."""
+    month_index = date_obj.month - 1 + months
+    year = date_obj.year + month_index // 12
+    month = month_index % 12 + 1
+    return date(year, month, min(date_obj.day, calendar.monthrange(year, month)[1]))
+
+def calculate_loan_balances(loans_df, as_of=None):
+    """Vectorized counterpart of calculate_loan_balance for many loans at once.
+    
+    Expects 'type', 'amount', 'interest_rate', 'start_date' and 'total_repaid' columns.
+    `as_of` may be a single date or a per-row Series of dates (defaults to today).
+    """
+    start = pd.to_datetime(loans_df['start_date'])
+    if isinstance(as_of, pd.Series):
+        as_of = pd.to_datetime(as_of)
+    else:
+        as_of = pd.Series(pd.Timestamp(as_of or date.today()), index=loans_df.index)
+    
+    # Emergency loans: 2% of the original amount per full calendar month elapsed
+    months_elapsed = (as_of.dt.year - start.dt.year) * 12 + (as_of.dt.month - start.dt.month)
+    months_elapsed = months_elapsed.where(as_of >= start, 0).clip(lower=0)
+    emergency_interest = loans_df['amount'] * EMERGENCY_MONTHLY_INTEREST_RATE * months_elapsed
+    
+    # Development (and any other) loans: annual simple interest by days elapsed
+    days_elapsed = (as_of - start).dt.days
+    annual_interest = loans_df['amount'] * (loans_df['interest_rate'].fillna(0) / 100) * (days_elapsed / 365)
+    
+    interest = emergency_interest.where(loans_df['type'] == 'emergency', annual_interest)
+    return (loans_df['amount'] + interest - loans_df['total_repaid']).clip(lower=0)
@@ -0,0 +1,208 @@
+"""Columnar (Parquet) export of the group's records for auditors and offline analysis.
+
+    python export.py [output_dir]
+
+Writes one Parquet dataset per table under the output directory, partitioned by financial
+year (`financial_year=2024-2025/` sub-directories), plus a manifest.json with row counts and
+the table write versions the export was taken at. Tables are read in chunks and written with
+column types taken from the SQLAlchemy models, so a reader never has to guess them.
+
+The same files can be read back with `read_exported_table` for heavy analyses that should
+not run against the live database. pyarrow is optional: only this module needs it.
+"""
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import text, Integer, Float, String, Boolean, Date, DateTime
+
+from database import engine, Base, get_table_versions
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError: # only the Parquet export and the offline read path need it
+    pa = ds = pq = None
+
+PYARROW_AVAILABLE = pa is not None
+
+DEFAULT_EXPORT_DIR = os.environ.get("SHALOM_EXPORT_DIR", "analytics_export")
+EXPORT_CHUNK_ROWS = 50_000
+MANIFEST_FILE = "manifest.json"
+
+# Exported tables with the SQL date that places a row in a financial year (None: not partitioned)
+EXPORT_TABLES = {
+    'members': None,
+    'meetings': "date",
+    'attendance': "(SELECT date FROM meetings WHERE meetings.id = attendance.meeting_id)",
+    'contributions': "date",
+    'loans': "start_date",
+    'repayments': "date",
+    'penalties': "date",
+    'expenses': "date",
+    'dividends': None,
+}
+
+def require_pyarrow():
+    """Raises a clear error when the optional pyarrow dependency is missing."""
+    if not PYARROW_AVAILABLE:
+        raise RuntimeError("The Parquet export needs pyarrow - install it with `pip install pyarrow`")
+
+def arrow_schema(table):
+    """Arrow schema of a table, derived from its SQLAlchemy model columns."""
+    require_pyarrow()
+    arrow_types = [
+        (Boolean, pa.bool_()), (Integer, pa.int64()), (Float, pa.float64()),
+        (DateTime, pa.timestamp('us')), (Date, pa.date32()), (String, pa.string()),
+    ]
+    fields = []
+    for column in Base.metadata.tables[table].columns:
+        arrow_type = next((t for sql_type, t in arrow_types if isinstance(column.type, sql_type)), pa.string())
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+def financial_years(dates):
+    """Vectorized get_financial_year: 'YYYY-YYYY' (March to February) for a Series of dates."""
+    dates = pd.to_datetime(dates, errors='coerce')
+    start_years = dates.dt.year - (dates.dt.month < 3)
+    labels = start_years.astype('Int64').astype(str) + '-' + (start_years + 1).astype('Int64').astype(str)
+    return labels.where(dates.notna(), 'unknown')
+
+def to_arrow_types(chunk, schema):
+    """Coerces a chunk read from SQLite (dates as text, booleans as 0/1) to the schema's types."""
+    for field in schema:
+        if pa.types.is_date32(field.type):
+            chunk[field.name] = pd.to_datetime(chunk[field.name], errors='coerce').dt.date
+        elif pa.types.is_timestamp(field.type):
+            chunk[field.name] = pd.to_datetime(chunk[field.name], errors='coerce')
+        elif pa.types.is_boolean(field.type):
+            chunk[field.name] = chunk[field.name].astype('boolean')
+    return pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+def export_table(table, output_dir=None, chunk_rows=EXPORT_CHUNK_ROWS, conn=None):
+    """Streams one table into a Parquet dataset; returns the row count per partition.
+
+    Reads through `conn` when given, so several tables can be exported from one snapshot.
+    """
+    schema = arrow_schema(table)
+    table_dir = os.path.join(output_dir or DEFAULT_EXPORT_DIR, table)
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.makedirs(table_dir)
+
+    partition_date = EXPORT_TABLES[table]
+    columns = ", ".join(f"{table}.{field.name}" for field in schema)
+    query = f"SELECT {columns}, {partition_date or 'NULL'} as _partition_date FROM {table} ORDER BY {table}.rowid"
+    writers = {}
+    row_counts = {}
+    try:
+        for chunk in pd.read_sql(text(query), conn if conn is not None else engine, chunksize=chunk_rows):
+            partition_dates = chunk.pop('_partition_date')
+            groups = chunk.groupby(financial_years(partition_dates), sort=False) if partition_date else [(None, chunk)]
+            for financial_year, rows in groups:
+                if financial_year not in writers:
+                    partition_dir = os.path.join(table_dir, f"financial_year={financial_year}") if financial_year else table_dir
+                    os.makedirs(partition_dir, exist_ok=True)
+                    writers[financial_year] = pq.ParquetWriter(os.path.join(partition_dir, "part-0.parquet"), schema)
+                writers[financial_year].write_table(to_arrow_types(rows.copy(), schema))
+                row_counts[financial_year or 'all'] = row_counts.get(financial_year or 'all', 0) + len(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    if not writers:
+        pq.write_table(schema.empty_table(), os.path.join(table_dir, "part-0.parquet"))
+    return row_counts
+
+def export_all(output_dir=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Exports every table in EXPORT_TABLES and writes the manifest; returns the manifest.
+
+    The versions and every table are read in one read transaction, so the export is a single
+    consistent snapshot that matches the versions in the manifest. Writers wait for the export
+    (SQLite's shared lock) rather than landing half-way through it.
+    """
+    require_pyarrow()
+    output_dir = output_dir or DEFAULT_EXPORT_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    with engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN")
+        versions = get_table_versions(list(EXPORT_TABLES), conn)
+        manifest = {
+            'exported_at': datetime.now().isoformat(timespec='seconds'),
+            'table_versions': versions,
+            'tables': {table: export_table(table, output_dir, chunk_rows, conn) for table in EXPORT_TABLES},
+        }
+        conn.rollback() # read-only
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def get_export_manifest(export_dir=None):
+    """The manifest of the last export in export_dir, or None if there is none."""
+    path = os.path.join(export_dir or DEFAULT_EXPORT_DIR, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def read_exported_table(table, export_dir=None, columns=None, financial_years=None):
+    """Reads an exported table back as a DataFrame, scanning only the columns and years asked for."""
+    require_pyarrow()
+    dataset = ds.dataset(os.path.join(export_dir or DEFAULT_EXPORT_DIR, table), format='parquet', partitioning='hive')
+    row_filter = None
+    if financial_years is not None and EXPORT_TABLES[table]:
+        row_filter = ds.field('financial_year').isin(list(financial_years))
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas(date_as_object=False)
+
+def get_exported_loan_book(export_dir=None):
+    """Columnar counterpart of repository.get_loan_book, built from an export."""
+    loans = read_exported_table('loans', export_dir, columns=[
+        'id', 'member_id', 'type', 'amount', 'interest_rate', 'start_date', 'due_date', 'status'])
+    members = read_exported_table('members', export_dir, columns=['id', 'name'])
+    repayments = read_exported_table('repayments', export_dir, columns=['loan_id', 'amount', 'date'])
+
+    loans = loans.merge(members.rename(columns={'id': 'member_id', 'name': 'member_name'}), on='member_id')
+    monthly = (repayments.assign(month=repayments['date'].dt.to_period('M').dt.to_timestamp())
+               .groupby(['loan_id', 'month'], as_index=False)['amount'].sum()
+               .sort_values(['loan_id', 'month']))
+    monthly['repaid_to_month'] = monthly.groupby('loan_id')['amount'].cumsum()
+    monthly['total_repaid'] = monthly.groupby('loan_id')['amount'].transform('sum')
+
+    loan_book = loans.merge(monthly.drop(columns='amount').rename(columns={'loan_id': 'id'}), on='id', how='left')
+    loan_book = loan_book.sort_values(['id', 'month'], ignore_index=True)
+    loan_book['total_repaid'] = loan_book['total_repaid'].fillna(0)
+    return loan_book[['id', 'member_id', 'member_name', 'type', 'amount', 'interest_rate', 'start_date',
+                      'due_date', 'status', 'month', 'repaid_to_month', 'total_repaid']]
+
+def get_exported_member_performance(export_dir=None):
+    """Columnar counterpart of the Member Performance report query, built from an export."""
+    members = read_exported_table('members', export_dir, columns=['id', 'name', 'join_date', 'status'])
+    contributions = read_exported_table('contributions', export_dir, columns=['member_id', 'votehead', 'amount'])
+    loans = read_exported_table('loans', export_dir, columns=['member_id', 'amount'])
+    attendance = read_exported_table('attendance', export_dir, columns=['member_id', 'present'])
+
+    members = members[members['status'] == 'active'].set_index('id')
+    by_votehead = contributions.pivot_table(index='member_id', columns='votehead', values='amount', aggfunc='sum')
+    performance = pd.DataFrame({
+        'name': members['name'],
+        'join_date': members['join_date'],
+        'total_shares': by_votehead.get('shares'),
+        'total_welfare': by_votehead.get('welfare'),
+        'contribution_count': contributions.groupby('member_id').size(),
+        'loan_count': loans.groupby('member_id').size(),
+        'total_loans': loans.groupby('member_id')['amount'].sum(),
+        'meetings_attended': attendance.groupby('member_id')['present'].sum(),
+        'total_meetings': attendance.groupby('member_id').size(),
+    }, index=members.index)
+    performance = performance.fillna({column: 0 for column in performance.columns if column not in ('name', 'join_date')})
+    performance = performance.astype({'contribution_count': int, 'loan_count': int,
+                                      'meetings_attended': int, 'total_meetings': int})
+    total_contributions = performance['total_shares'] + performance['total_welfare']
+    return performance.loc[total_contributions.sort_values(ascending=False, kind='stable').index].reset_index(drop=True)
+
+if __name__ == "__main__":
+    result = export_all(sys.argv[1] if len(sys.argv) > 1 else None)
+    for table, partitions in result['tables'].items():
+        print(f"{table}: {sum(partitions.values())} rows in {len(partitions)} partition(s)")
@@ -0,0 +1,230 @@
+"""ReportLab rendering: the shared PDF builder and the annual member statement pack.
+
+Nothing here touches the database, so process-pool workers that render statements only pay
+for importing pandas and ReportLab. Callers fetch the records (see
+repository.get_statement_data) and hand them over as DataFrames.
+"""
+import io
+import multiprocessing
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageBreak
+
+GROUP_NAME = "Shalom Blessing SHG"
+STATEMENT_BATCH_SIZE = 50 # members rendered per worker task
+STATEMENT_TABLES = ['contributions', 'loans', 'penalties', 'dividends', 'attendance']
+
+STYLES = getSampleStyleSheet()
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f5f6fa')]),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#c8c8d0')),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+])
+
+def generate_pdf(story_elements, title="Report"):
+    """Generates a PDF report from ReportLab elements."""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18,
+                            title=title, author=GROUP_NAME)
+    doc.build(story_elements)
+    buffer.seek(0)
+    return buffer
+
+def format_cell(value):
+    """Text for a table cell: money with thousands separators, dates as YYYY-MM-DD."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, (bool, np.bool_)):
+        return "Yes" if value else "No"
+    if isinstance(value, (float, np.floating)):
+        return f"{value:,.2f}"
+    if isinstance(value, pd.Timestamp):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+def dataframe_table(df, columns=None, empty_text="None recorded."):
+    """A styled ReportLab table of a DataFrame; `columns` maps column -> heading (all columns if None)."""
+    columns = columns or {column: column for column in df.columns}
+    if df.empty:
+        return Paragraph(empty_text, STYLES['Italic'])
+    rows = [list(columns.values())] + [[format_cell(value) for value in row] for row in df[list(columns)].itertuples(index=False)]
+    table = Table(rows, repeatRows=1, hAlign='LEFT')
+    table.setStyle(TABLE_STYLE)
+    return table
+
+def report_story(title, subtitle, sections):
+    """Flowables for a report: a title block, then one table per (heading, DataFrame, columns) section."""
+    story = [
+        Paragraph(GROUP_NAME, STYLES['Title']),
+        Paragraph(title, STYLES['Heading2']),
+        Paragraph(f"{escape(subtitle)} &nbsp; (generated {date.today():%d %b %Y})", STYLES['Normal']),
+        Spacer(1, 0.15 * inch),
+    ]
+    for heading, df, columns in sections:
+        story += [Paragraph(escape(heading), STYLES['Heading3']), dataframe_table(df, columns, "No data for this period.")]
+    return story
+
+def statement_story(statement, period_label):
+    """ReportLab flowables for one member's statement."""
+    member = statement['member']
+    contributions = statement['contributions']
+    loans = statement['loans']
+    penalties = statement['penalties']
+    attendance = statement['attendance']
+    shares_in_period = float(contributions.loc[contributions['votehead'] == 'shares', 'amount'].sum())
+    welfare_in_period = float(contributions.loc[contributions['votehead'] == 'welfare', 'amount'].sum())
+    attended = int(attendance['present'].sum())
+
+    summary = pd.DataFrame([
+        ("Shares brought forward", statement['opening']['shares']),
+        ("Shares contributed this period", shares_in_period),
+        ("Shares closing balance", statement['opening']['shares'] + shares_in_period),
+        ("Welfare contributed this period", welfare_in_period),
+        ("Loan balance outstanding", float(loans.loc[loans['status'] == 'active', 'balance'].sum())),
+        ("Penalties this period", float(penalties['amount'].sum())),
+        ("Meetings attended", f"{attended} of {len(attendance)}"),
+    ], columns=['item', 'value'])
+
+    return [
+        Paragraph(GROUP_NAME, STYLES['Title']),
+        Paragraph(f"Member Statement - {period_label}", STYLES['Heading2']),
+        Paragraph(f"<b>{escape(member['name'])}</b> &nbsp; Phone: {escape(format_cell(member['phone']) or '-')} &nbsp; "
+                  f"Member since: {format_cell(member['join_date'])}", STYLES['Normal']),
+        Spacer(1, 0.15 * inch),
+        dataframe_table(summary, {'item': "Summary", 'value': "KSh"}),
+        Paragraph("Contributions", STYLES['Heading3']),
+        dataframe_table(contributions, {'date': "Date", 'votehead': "Votehead", 'amount': "Amount (KSh)"}),
+        Paragraph("Loans", STYLES['Heading3']),
+        dataframe_table(loans, {'type': "Type", 'amount': "Amount", 'start_date': "Start", 'due_date': "Due",
+                                'status': "Status", 'repaid_in_period': "Repaid in Period", 'balance': "Balance"}),
+        Paragraph("Penalties", STYLES['Heading3']),
+        dataframe_table(penalties, {'date': "Date", 'reason': "Reason", 'amount': "Amount (KSh)"}),
+        Paragraph("Dividends", STYLES['Heading3']),
+        dataframe_table(statement['dividends'], {'cycle_year': "Cycle", 'shares': "Shares",
+                                                 'rate_per_share': "Rate/Share", 'amount': "Amount (KSh)"}),
+        Paragraph("Attendance", STYLES['Heading3']),
+        dataframe_table(attendance.assign(present=attendance['present'].astype(bool)), {'date': "Meeting", 'present': "Present"}),
+    ]
+
+def split_statement_data(data):
+    """Turns the batched frames of repository.get_statement_data into one statement dict per member."""
+    grouped = {table: dict(tuple(data[table].groupby('member_id'))) for table in STATEMENT_TABLES}
+    opening = data['opening'].set_index('member_id')
+    statements = []
+    for member in data['members'].to_dict('records'):
+        member_id = member['member_id']
+        statement = {'member': member, 'opening': {
+            'shares': float(opening['shares'].get(member_id, 0.0)),
+            'welfare': float(opening['welfare'].get(member_id, 0.0)),
+        }}
+        for table in STATEMENT_TABLES:
+            statement[table] = grouped[table].get(member_id, data[table].iloc[0:0])
+        statements.append(statement)
+    return statements
+
+def statement_file_name(member):
+    """Zip entry name for a member's statement, e.g. '0042_Jane_Wanjiru.pdf'."""
+    return f"{member['member_id']:04d}_{re.sub(r'[^A-Za-z0-9]+', '_', member['name']).strip('_')}.pdf"
+
+def render_statement_batch(statements, period_label):
+    """Process-pool task: renders each statement to PDF bytes; returns [(file name, bytes)]."""
+    return [
+        (statement_file_name(statement['member']),
+         generate_pdf(statement_story(statement, period_label), f"{statement['member']['name']} - {period_label}").getvalue())
+        for statement in statements
+    ]
+
+def render_statement_pack(statements, period_label, output='zip', workers=None, progress=None):
+    """Renders many member statements; returns the bytes of a zip of PDFs or of one merged PDF.
+
+    'zip' renders batches of STATEMENT_BATCH_SIZE statements in a process pool (one worker per
+    CPU core by default; workers=1 renders in this process). 'pdf' lays every statement out in a
+    single document, one member per page run, which ReportLab can only do in one process.
+    `progress(done, total)` is called as statements finish.
+    """
+    total = len(statements)
+    if output == 'pdf':
+        story = []
+        for done, statement in enumerate(statements, start=1):
+            story += statement_story(statement, period_label) + [PageBreak()]
+            if progress:
+                progress(done, total)
+        return generate_pdf(story[:-1] or [Paragraph("No statements.", STYLES['Normal'])],
+                            f"Member Statements - {period_label}").getvalue()
+
+    batches = [statements[n:n + STATEMENT_BATCH_SIZE] for n in range(0, total, STATEMENT_BATCH_SIZE)]
+    workers = workers or os.cpu_count() or 1
+    buffer = io.BytesIO()
+    done = 0
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        if workers == 1:
+            results = (render_statement_batch(batch, period_label) for batch in batches)
+        else:
+            # spawn, not fork: the app process runs scheduler threads that must not be copied
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            futures = [pool.submit(render_statement_batch, batch, period_label) for batch in batches]
+            results = (future.result() for future in as_completed(futures))
+        try:
+            for files in results:
+                for file_name, pdf in files:
+                    archive.writestr(file_name, pdf)
+                done += len(files)
+                if progress:
+                    progress(done, total)
+        finally:
+            if workers != 1:
+                pool.shutdown(cancel_futures=True)
+    return buffer.getvalue()
+
+def sample_statements(member_count, seed=0):
+    """Synthetic statements shaped like split_statement_data output, for benchmarks; every tenth member has no phone."""
+    rng = np.random.default_rng(seed)
+    start = date(2025, 3, 1)
+    meeting_dates = [start + timedelta(days=28 * n) for n in range(12)]
+    statements = []
+    for member_id in range(1, member_count + 1):
+        loan_count = int(rng.integers(0, 3))
+        statements.append({
+            'member': {'member_id': member_id, 'name': f"Member {member_id}", 'phone': f"07{member_id:08d}" if member_id % 10 else None,
+                       'join_date': date(2020, 1, 1)},
+            'opening': {'shares': float(rng.integers(0, 50)) * 1000, 'welfare': float(rng.integers(0, 20)) * 100},
+            'contributions': pd.DataFrame({'date': meeting_dates * 2, 'votehead': ['shares'] * 12 + ['welfare'] * 12,
+                                           'amount': rng.choice([500.0, 1000.0, 2000.0], 24)}),
+            'loans': pd.DataFrame({'type': rng.choice(['emergency', 'development'], loan_count),
+                                   'amount': rng.integers(5, 100, loan_count) * 1000.0,
+                                   'start_date': [start] * loan_count, 'due_date': [start + timedelta(days=365)] * loan_count,
+                                   'status': ['active'] * loan_count, 'repaid_in_period': rng.integers(0, 5, loan_count) * 1000.0,
+                                   'balance': rng.integers(0, 50, loan_count) * 1000.0}),
+            'penalties': pd.DataFrame({'date': meeting_dates[:2], 'reason': ["Absent from meeting"] * 2, 'amount': [200.0, 200.0]}),
+            'dividends': pd.DataFrame({'cycle_year': ["2024-2025"], 'shares': [20], 'rate_per_share': [150.0], 'amount': [3000.0]}),
+            'attendance': pd.DataFrame({'date': meeting_dates, 'present': rng.random(12) > 0.2}),
+        })
+    return statements
+
+def benchmark_statement_pack(member_count=1000, workers=None):
+    """Times rendering a zip of member_count synthetic statements serially and with the process pool."""
+    statements = sample_statements(member_count)
+    results = {}
+    for label, worker_count in [('serial', 1), ('pool', workers or os.cpu_count() or 1)]:
+        timer = time.perf_counter()
+        pack = render_statement_pack(statements, "2025-2026", 'zip', worker_count)
+        elapsed = time.perf_counter() - timer
+        results[label] = {'workers': worker_count, 'seconds': elapsed, 'members_per_second': member_count / elapsed,
+                          'zip_mb': len(pack) / 1e6}
+    return results
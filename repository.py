@@ -0,0 +1,318 @@
+"""Data-access functions shared by the Streamlit pages, the JSON API and batch jobs.
+
+Queries are batch-oriented: each function answers for many members or loans in a fixed
+number of statements, so callers never issue one query per row. Nothing here imports
+Streamlit, so these can be unit-tested and benchmarked on their own.
+"""
+import json
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from database import engine, calculate_loan_balances
+
+MEMBER_SORT_ORDERS = {
+    'name': "name",
+    'join_date': "join_date DESC",
+}
+
+def get_members(member_ids: list[int] | None = None, status: str | None = None, sort_by: str = 'name') -> pd.DataFrame:
+    """Lists members, optionally limited to some ids (e.g. search.search_member_ids matches) and a status."""
+    query = "SELECT * FROM members WHERE 1=1"
+    params = {}
+    bind_params = []
+    if member_ids is not None:
+        query += " AND id IN :member_ids"
+        params['member_ids'] = [int(member_id) for member_id in member_ids]
+        bind_params.append(bindparam('member_ids', expanding=True))
+    if status:
+        query += " AND status = :status"
+        params['status'] = status
+    query += f" ORDER BY {MEMBER_SORT_ORDERS.get(sort_by, 'name')}"
+    return pd.read_sql(text(query).bindparams(*bind_params), engine, params=params)
+
+def get_recent_meetings(limit: int = 10) -> pd.DataFrame:
+    """Returns the most recent meetings (id, date), newest first."""
+    return pd.read_sql(text("SELECT id, date FROM meetings ORDER BY date DESC LIMIT :limit"), engine,
+                       params={'limit': limit})
+
+def get_loans_with_balances(member_ids: list[int] | None = None, loan_ids: list[int] | None = None,
+                            status: str | None = 'active', as_of: date | None = None) -> pd.DataFrame:
+    """Loads loans with their repaid totals and balances in one query plus a vectorized balance pass.
+
+    Filters are optional and combine; `status=None` returns loans of every status. Loans that are
+    no longer active have a balance of 0.
+    """
+    query = """
+        SELECT l.id, l.member_id, m.name as member_name, l.type, l.amount, l.interest_rate,
+               l.start_date, l.due_date, l.status, l.version, COALESCE(r.repaid, 0) as total_repaid
+        FROM loans l
+        JOIN members m ON l.member_id = m.id
+        LEFT JOIN (SELECT loan_id, SUM(amount) as repaid FROM repayments GROUP BY loan_id) r ON r.loan_id = l.id
+        WHERE 1=1
+    """
+    params = {}
+    bind_params = []
+    if status:
+        query += " AND l.status = :status"
+        params['status'] = status
+    if member_ids is not None:
+        query += " AND l.member_id IN :member_ids"
+        params['member_ids'] = [int(member_id) for member_id in member_ids]
+        bind_params.append(bindparam('member_ids', expanding=True))
+    if loan_ids is not None:
+        query += " AND l.id IN :loan_ids"
+        params['loan_ids'] = [int(loan_id) for loan_id in loan_ids]
+        bind_params.append(bindparam('loan_ids', expanding=True))
+    query += " ORDER BY l.start_date DESC, l.id DESC"
+
+    loans = pd.read_sql(text(query).bindparams(*bind_params), engine, params=params)
+    loans['balance'] = calculate_loan_balances(loans, as_of).round(2) if not loans.empty else pd.Series(dtype=float)
+    loans.loc[loans['status'] != 'active', 'balance'] = 0.0
+    return loans
+
+def get_member_stats(member_ids: list[int] | None = None) -> pd.DataFrame:
+    """Summary statistics for many members at once, indexed by member id.
+
+    Columns: shares, welfare, loan_balance, meetings_marked, meetings_attended, attendance_rate.
+    Members with no records get zeros. Runs three grouped queries regardless of member count.
+    """
+    if member_ids is None:
+        with engine.connect() as conn:
+            member_ids = [row[0] for row in conn.execute(text("SELECT id FROM members"))]
+    member_ids = [int(member_id) for member_id in member_ids]
+    stats = pd.DataFrame(index=pd.Index(member_ids, name='member_id'))
+    if not member_ids:
+        return stats.assign(shares=[], welfare=[], loan_balance=[], meetings_marked=[],
+                            meetings_attended=[], attendance_rate=[])
+
+    ids_param = bindparam('member_ids', expanding=True)
+    contributions = pd.read_sql(text("""
+        SELECT member_id,
+               COALESCE(SUM(CASE WHEN votehead = 'shares' THEN amount END), 0) as shares,
+               COALESCE(SUM(CASE WHEN votehead = 'welfare' THEN amount END), 0) as welfare
+        FROM contributions
+        WHERE member_id IN :member_ids
+        GROUP BY member_id
+    """).bindparams(ids_param), engine, params={'member_ids': member_ids}).set_index('member_id')
+    attendance = pd.read_sql(text("""
+        SELECT member_id, COUNT(*) as meetings_marked,
+               SUM(CASE WHEN present THEN 1 ELSE 0 END) as meetings_attended
+        FROM attendance
+        WHERE member_id IN :member_ids
+        GROUP BY member_id
+    """).bindparams(ids_param), engine, params={'member_ids': member_ids}).set_index('member_id')
+    loans = get_loans_with_balances(member_ids=member_ids)
+
+    stats = stats.join(contributions).join(attendance)
+    stats['loan_balance'] = loans.groupby('member_id')['balance'].sum() if not loans.empty else 0.0
+    stats = stats.fillna(0)
+    stats['attendance_rate'] = (
+        stats['meetings_attended'] / stats['meetings_marked'].where(stats['meetings_marked'] > 0) * 100
+    ).fillna(0)
+    return stats
+
+def get_member_statement(member_id: int) -> dict[str, pd.DataFrame]:
+    """All financial and attendance records of one member, each as a DataFrame (newest first)."""
+    params = {'mid': member_id}
+    loans = get_loans_with_balances(member_ids=[member_id], status=None)
+    return {
+        'contributions': pd.read_sql(text("""
+            SELECT c.date, c.votehead, c.amount, m.date as meeting_date
+            FROM contributions c
+            LEFT JOIN meetings m ON c.meeting_id = m.id
+            WHERE c.member_id = :mid
+            ORDER BY c.date DESC
+        """), engine, params=params),
+        'loans': loans.drop(columns=['member_id', 'member_name']),
+        'penalties': pd.read_sql(text("""
+            SELECT date, amount, reason FROM penalties
+            WHERE member_id = :mid ORDER BY date DESC
+        """), engine, params=params),
+        'dividends': pd.read_sql(text("""
+            SELECT cycle_year, shares, rate_per_share, amount FROM dividends
+            WHERE member_id = :mid ORDER BY cycle_year DESC
+        """), engine, params=params),
+        'attendance': pd.read_sql(text("""
+            SELECT m.date, a.present FROM attendance a
+            JOIN meetings m ON a.meeting_id = m.id
+            WHERE a.member_id = :mid
+            ORDER BY m.date DESC
+        """), engine, params=params),
+    }
+
+def get_member_performance() -> pd.DataFrame:
+    """Lifetime contribution, loan and attendance totals per active member, top contributors first."""
+    return pd.read_sql("""
+        SELECT
+            m.name,
+            m.join_date,
+            COALESCE(c.total_shares, 0) as total_shares,
+            COALESCE(c.total_welfare, 0) as total_welfare,
+            COALESCE(c.contribution_count, 0) as contribution_count,
+            COALESCE(l.loan_count, 0) as loan_count,
+            COALESCE(l.total_loans, 0) as total_loans,
+            COALESCE(a.meetings_attended, 0) as meetings_attended,
+            COALESCE(a.total_meetings, 0) as total_meetings
+        FROM members m
+        LEFT JOIN (
+            SELECT member_id,
+                   SUM(CASE WHEN votehead = 'shares' THEN amount ELSE 0 END) as total_shares,
+                   SUM(CASE WHEN votehead = 'welfare' THEN amount ELSE 0 END) as total_welfare,
+                   COUNT(*) as contribution_count
+            FROM contributions GROUP BY member_id
+        ) c ON c.member_id = m.id
+        LEFT JOIN (
+            SELECT member_id, COUNT(*) as loan_count, SUM(amount) as total_loans
+            FROM loans GROUP BY member_id
+        ) l ON l.member_id = m.id
+        LEFT JOIN (
+            SELECT member_id, SUM(CASE WHEN present THEN 1 ELSE 0 END) as meetings_attended,
+                   COUNT(*) as total_meetings
+            FROM attendance GROUP BY member_id
+        ) a ON a.member_id = m.id
+        WHERE m.status = 'active'
+        ORDER BY total_shares + total_welfare DESC
+    """, engine)
+
+def get_loan_book() -> pd.DataFrame:
+    """Loads every loan with its running repayment total per month in one pre-aggregated query.
+
+    Returns one row per loan per month in which it received repayments (one row with a null
+    month for loans never repaid), plus the loan's overall total_repaid.
+    """
+    loan_book = pd.read_sql("""
+        WITH monthly_repayments AS (
+            SELECT loan_id, date(date, 'start of month') as month, SUM(amount) as repaid
+            FROM repayments
+            GROUP BY loan_id, month
+        )
+        SELECT l.id, l.member_id, m.name as member_name, l.type, l.amount, l.interest_rate,
+               l.start_date, l.due_date, l.status, mr.month,
+               SUM(mr.repaid) OVER (PARTITION BY l.id ORDER BY mr.month) as repaid_to_month,
+               SUM(mr.repaid) OVER (PARTITION BY l.id) as total_repaid
+        FROM loans l
+        JOIN members m ON l.member_id = m.id
+        LEFT JOIN monthly_repayments mr ON mr.loan_id = l.id
+        ORDER BY l.id, mr.month
+    """, engine, parse_dates=['start_date', 'due_date', 'month'])
+    loan_book['total_repaid'] = loan_book['total_repaid'].fillna(0)
+    return loan_book
+
+def get_monthly_rollup(flows: list[str] | None = None, start_month: str | None = None,
+                       end_month: str | None = None) -> pd.DataFrame:
+    """Monthly totals per flow and votehead from the maintained rollup, oldest month first.
+
+    Months are 'YYYY-MM' strings and both bounds are inclusive. Reads only the rollup table, so the
+    cost depends on the number of months requested rather than on the length of the history.
+    """
+    query = "SELECT month, flow, votehead, amount, entries FROM monthly_rollup WHERE 1=1"
+    params = {}
+    bind_params = []
+    if flows is not None:
+        query += " AND flow IN :flows"
+        params['flows'] = list(flows)
+        bind_params.append(bindparam('flows', expanding=True))
+    if start_month:
+        query += " AND month >= :start_month"
+        params['start_month'] = start_month
+    if end_month:
+        query += " AND month <= :end_month"
+        params['end_month'] = end_month
+    query += " ORDER BY month, flow, votehead"
+    return pd.read_sql(text(query).bindparams(*bind_params), engine, params=params)
+
+def get_changes(after_seq: int = 0, tables: list[str] | None = None, limit: int = 500,
+                newest_first: bool = False) -> pd.DataFrame:
+    """Change-log rows with seq > after_seq, oldest first: the feed an incremental consumer polls.
+
+    seq increases in commit order (SQLite serializes writers), so a consumer that stores the last
+    seq it processed never misses or repeats a change. `changes` is decoded to {column: [old, new]}.
+    With newest_first the latest `limit` entries are returned instead, for audit views.
+    """
+    query = "SELECT seq, table_name, row_id, operation, changes, changed_at, changed_by FROM change_log WHERE seq > :after_seq"
+    params = {'after_seq': int(after_seq), 'limit': int(limit)}
+    bind_params = []
+    if tables:
+        query += " AND table_name IN :tables"
+        params['tables'] = list(tables)
+        bind_params.append(bindparam('tables', expanding=True))
+    query += f" ORDER BY seq {'DESC' if newest_first else ''} LIMIT :limit"
+    changes = pd.read_sql(text(query).bindparams(*bind_params), engine, params=params)
+    changes['changes'] = changes['changes'].map(json.loads)
+    return changes
+
+def get_statement_data(member_ids: list[int], start: date, end: date) -> dict[str, pd.DataFrame]:
+    """Statement records of many members for one period, in one query per record type.
+
+    Every frame carries member_id so callers can split it per member. Contributions, penalties,
+    attendance and loan repayments are limited to start..end (inclusive); 'opening' holds each
+    member's shares and welfare before the period; loans are those started by the period end that
+    were active or repaid during it. Their status, total_repaid and balance are as of the period end
+    (or today, if earlier), counting only repayments made by then.
+    """
+    member_ids = [int(member_id) for member_id in member_ids]
+    ids_param = bindparam('member_ids', expanding=True)
+    params = {'member_ids': member_ids, 'start': start, 'end': end}
+
+    def read(sql, parse_dates=None):
+        return pd.read_sql(text(sql).bindparams(ids_param), engine, params=params, parse_dates=parse_dates)
+
+    as_of = min(end, date.today())
+    loans = get_loans_with_balances(member_ids=member_ids, status=None, as_of=as_of)
+    repaid = read("""
+        SELECT r.loan_id, SUM(r.amount) as repaid_by_end,
+               COALESCE(SUM(CASE WHEN r.date >= :start THEN r.amount END), 0) as repaid_in_period
+        FROM repayments r JOIN loans l ON r.loan_id = l.id
+        WHERE l.member_id IN :member_ids AND r.date <= :end
+        GROUP BY r.loan_id
+    """).set_index('loan_id')
+    loans['repaid_in_period'] = loans['id'].map(repaid['repaid_in_period']).fillna(0)
+    repaid_by_end = loans['id'].map(repaid['repaid_by_end']).fillna(0)
+    # A loan is completed by the repayment that clears it, so it was completed at the period end
+    # only if every repayment on it had been made by then; otherwise it was still active.
+    tracked = loans['status'].isin(['active', 'completed'])
+    completed = (loans['status'] == 'completed') & (repaid_by_end >= loans['total_repaid'] - 0.005)
+    loans.loc[tracked, 'status'] = np.where(completed[tracked], 'completed', 'active')
+    loans['total_repaid'] = repaid_by_end
+    if not loans.empty:
+        loans['balance'] = calculate_loan_balances(loans, as_of).round(2).where(loans['status'] == 'active', 0.0)
+    loans = loans[(pd.to_datetime(loans['start_date']) <= pd.Timestamp(end))
+                  & ((loans['status'] == 'active') | (loans['repaid_in_period'] > 0)
+                     | (pd.to_datetime(loans['start_date']) >= pd.Timestamp(start)))]
+
+    return {
+        'members': read("SELECT id as member_id, name, phone, join_date FROM members WHERE id IN :member_ids ORDER BY name"),
+        'opening': read("""
+            SELECT member_id,
+                   COALESCE(SUM(CASE WHEN votehead = 'shares' THEN amount END), 0) as shares,
+                   COALESCE(SUM(CASE WHEN votehead = 'welfare' THEN amount END), 0) as welfare
+            FROM contributions
+            WHERE member_id IN :member_ids AND date < :start
+            GROUP BY member_id
+        """),
+        'contributions': read("""
+            SELECT member_id, date, votehead, amount FROM contributions
+            WHERE member_id IN :member_ids AND date BETWEEN :start AND :end
+            ORDER BY member_id, date
+        """),
+        'loans': loans.sort_values(['member_id', 'start_date'], ignore_index=True),
+        'penalties': read("""
+            SELECT member_id, date, amount, reason FROM penalties
+            WHERE member_id IN :member_ids AND date BETWEEN :start AND :end
+            ORDER BY member_id, date
+        """),
+        'dividends': read("""
+            SELECT member_id, cycle_year, shares, rate_per_share, amount FROM dividends
+            WHERE member_id IN :member_ids
+            ORDER BY member_id, cycle_year
+        """),
+        'attendance': read("""
+            SELECT a.member_id, m.date, a.present FROM attendance a
+            JOIN meetings m ON a.meeting_id = m.id
+            WHERE a.member_id IN :member_ids AND m.date BETWEEN :start AND :end
+            ORDER BY a.member_id, m.date
+        """),
+    }
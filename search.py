@@ -0,0 +1,195 @@
+"""Fuzzy member search over names and phone numbers.
+
+Names are indexed by their character trigrams, so a query still finds a member when it is
+misspelt ("Wanjiro" for "Wanjiru", "Achieng" for "Akinyi Achieng'") or only partly typed.
+A query containing digits also matches members by the normalized form of their phone number,
+so 0712 345 678, 254712345678 and +254 712 345678 all find the same member.
+
+The index lives in memory and is rebuilt the first time it is used after any write to the
+members table, so the Streamlit pages and the JSON API share one up-to-date copy per process.
+"""
+import re
+import sqlite3
+import statistics
+import threading
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from database import get_table_versions
+from repository import get_members
+
+MEMBER_SEARCH_LIMIT = 20
+MEMBER_SEARCH_MIN_SCORE = 0.4 # share of the query's trigrams a name must contain
+MEMBER_SEARCH_RELATIVE_SCORE = 0.75 # ... and of the best match's score
+MEMBER_SEARCH_MIN_PHONE_DIGITS = 4
+
+def normalize_phone(phone):
+    """Reduces a Kenyan phone number to its last 9 digits so 07.., 254.. and +254.. forms match."""
+    digits = re.sub(r'\D', '', str(phone or ''))
+    return digits[-9:] if len(digits) >= 9 else ''
+
+def normalize_phone_series(phones):
+    """Vectorized normalize_phone for a Series of phone numbers."""
+    digits = phones.fillna('').astype(str).str.replace(r'\D', '', regex=True)
+    return digits.str[-9:].where(digits.str.len() >= 9, '')
+
+def phone_search_key(query):
+    """The digits of a query as they would appear in a normalized phone number ('' if too few)."""
+    digits = re.sub(r'\D', '', query)
+    if len(digits) >= 9:
+        return digits[-9:]
+    digits = digits[3:] if digits.startswith('254') else digits.lstrip('0')
+    return digits if len(digits) >= MEMBER_SEARCH_MIN_PHONE_DIGITS - 1 else ''
+
+def normalize_name(name):
+    """Lower-case letters and digits of a name, accents dropped and words single-spaced."""
+    name = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(re.sub(r"[^a-z0-9]+", ' ', name.lower().replace("'", '')).split())
+
+def name_trigrams(name, prefix=False):
+    """Trigrams of each word of a name, padded like PostgreSQL's pg_trgm.
+
+    With prefix=True the last word is not padded at the end, so a partly typed word
+    ("wanj") matches the whole name as well as the finished word would.
+    """
+    words = normalize_name(name).split()
+    grams = set()
+    for position, word in enumerate(words):
+        padded = "  " + word + ("" if prefix and position == len(words) - 1 else " ")
+        grams.update(padded[n:n + 3] for n in range(len(padded) - 2))
+    return grams
+
+def build_member_search_index(members):
+    """Builds the trigram index for a DataFrame of members (id, name, phone, status)."""
+    members = members[['id', 'name', 'phone', 'status']].reset_index(drop=True)
+    grams = pd.Series([sorted(name_trigrams(name)) for name in members['name']], dtype=object).explode().dropna()
+    codes, vocabulary = pd.factorize(grams)
+    positions = grams.index.to_numpy(dtype=np.int32)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(vocabulary) + 1))
+    return {
+        'members': members.assign(phone_key=normalize_phone_series(members['phone'])),
+        'postings': {gram: positions[order[bounds[n]:bounds[n + 1]]] for n, gram in enumerate(vocabulary)},
+        'trigram_counts': np.bincount(positions, minlength=len(members)).astype(np.int32),
+    }
+
+def search_member_index(index, query, limit=MEMBER_SEARCH_LIMIT, status=None, min_score=MEMBER_SEARCH_MIN_SCORE):
+    """Ranked matches for a query: a DataFrame of id, name, phone, status and score, best first.
+
+    The score is the share of the query's trigrams found in the name (so partial and slightly
+    misspelt names still score high), plus a small bonus for names of similar length so an
+    exact name outranks a longer one containing it. A phone number match scores 1. Matches
+    scoring well below the best one are dropped, so "jane kamau" does not also return every
+    other Jane. An empty query returns every member in name order. `limit=None` returns all.
+    """
+    members = index['members']
+    if status:
+        eligible = (members['status'] == status).to_numpy()
+    else:
+        eligible = np.ones(len(members), dtype=bool)
+
+    query = str(query or '').strip()
+    if not query:
+        matches = members[eligible].assign(score=1.0)
+        return matches.head(limit) if limit else matches
+
+    scores = np.zeros(len(members))
+    grams = name_trigrams(query, prefix=True)
+    postings = [index['postings'][gram] for gram in grams if gram in index['postings']]
+    if postings:
+        shared = np.bincount(np.concatenate(postings), minlength=len(members))
+        similarity = 2 * shared / (len(grams) + index['trigram_counts'])
+        scores = shared / len(grams) + similarity / 100
+    phone_key = phone_search_key(query)
+    if phone_key:
+        phone_match = members['phone_key'].str.contains(phone_key, regex=False).to_numpy()
+        scores = np.where(phone_match, np.maximum(scores, 1.0), scores)
+
+    scores = np.where(eligible, scores, 0)
+    positions = np.flatnonzero(scores >= max(min_score, scores.max(initial=0) * MEMBER_SEARCH_RELATIVE_SCORE))
+    positions = positions[np.argsort(-scores[positions], kind='stable')][:limit]
+    return members.iloc[positions].assign(score=scores[positions].round(3))
+
+_index_lock = threading.Lock()
+_cached_index = {'version': None, 'index': None}
+
+def get_member_search_index():
+    """The process-wide search index, rebuilt if the members table was written since it was built."""
+    version = get_table_versions(['members'])['members']
+    with _index_lock:
+        if _cached_index['index'] is None or _cached_index['version'] != version:
+            _cached_index.update(version=version, index=build_member_search_index(get_members()))
+        return _cached_index['index']
+
+def search_members(query, limit=MEMBER_SEARCH_LIMIT, status=None):
+    """Ranked fuzzy matches for a name or phone query; see search_member_index."""
+    return search_member_index(get_member_search_index(), query, limit, status)
+
+def search_member_ids(query, status=None):
+    """Ids of every member matching a query, best match first."""
+    return search_members(query, limit=None, status=status)['id'].tolist()
+
+def get_member_name(member_id):
+    """A member's name from the search index ('' for an unknown id)."""
+    members = get_member_search_index()['members']
+    names = members.loc[members['id'] == member_id, 'name']
+    return names.iloc[0] if len(names) else ''
+
+def sample_members(member_count, seed=0):
+    """Synthetic members with common Kenyan names and Safaricom-style numbers, for benchmarks."""
+    rng = np.random.default_rng(seed)
+    first = ['Jane', 'John', 'Mary', 'Peter', 'Grace', 'Joseph', 'Faith', 'David', 'Esther', 'James',
+             'Akinyi', 'Wanjiku', 'Njeri', 'Otieno', 'Kiprono', 'Chebet', 'Mwangi', 'Atieno', 'Wafula', 'Nyambura']
+    last = ['Wanjiru', 'Kamau', 'Otieno', 'Odhiambo', 'Mutua', 'Kiptoo', 'Njoroge', 'Ochieng', 'Wambui', 'Kariuki',
+            'Achieng', 'Cheruiyot', 'Mohamed', 'Mwende', 'Nyongesa', 'Omondi', 'Karanja', 'Wekesa', 'Kilonzo', 'Gitau']
+    return pd.DataFrame({
+        'id': np.arange(1, member_count + 1),
+        'name': [f"{a} {b} {c}" for a, b, c in zip(rng.choice(first, member_count), rng.choice(last, member_count),
+                                                    rng.choice(last, member_count))],
+        'phone': [f"07{n:08d}" for n in rng.choice(10**8, member_count, replace=False)],
+        'status': np.where(rng.random(member_count) < 0.9, 'active', 'inactive'),
+    })
+
+def benchmark_member_search(member_count=10000, query_count=200):
+    """Times building the index and fuzzy queries on synthetic members, against a LIKE scan.
+
+    The LIKE baseline runs the old `name LIKE '%query%'` filter in an in-memory SQLite table of
+    the same members; it only finds exact substrings, so comparing the two hit rates shows how
+    many of the (partly misspelt) queries it would have missed.
+    """
+    members = sample_members(member_count)
+    rng = np.random.default_rng(1)
+    queries = []
+    for name in rng.choice(members['name'], query_count):
+        word = name.split()[int(rng.integers(0, 3))]
+        if rng.random() < 0.5: # swap two letters, as a misspelling
+            cut = int(rng.integers(1, len(word) - 1))
+            word = word[:cut - 1] + word[cut] + word[cut - 1] + word[cut + 1:]
+        queries.append(word)
+
+    timer = time.perf_counter()
+    index = build_member_search_index(members)
+    build_ms = (time.perf_counter() - timer) * 1000
+
+    def time_queries(func):
+        timings, hits = [], 0
+        for query in queries:
+            timer = time.perf_counter()
+            hits += func(query) > 0
+            timings.append((time.perf_counter() - timer) * 1000)
+        return {'median_ms': statistics.median(timings), 'p95_ms': sorted(timings)[int(len(timings) * 0.95)],
+                'hit_rate': hits / len(queries)}
+
+    conn = sqlite3.connect(':memory:')
+    try:
+        members[['id', 'name']].to_sql('members', conn, index=False)
+        like = time_queries(lambda q: len(conn.execute(
+            "SELECT id FROM members WHERE name LIKE ? ORDER BY name", (f"%{q}%",)).fetchall()))
+    finally:
+        conn.close()
+    fuzzy = time_queries(lambda q: len(search_member_index(index, q)))
+    return {'members': member_count, 'build_ms': build_ms, 'index_trigrams': len(index['postings']),
+            'fuzzy': fuzzy, 'like': like}
@@ -0,0 +1,189 @@
+"""What-if projections of the loan book under alternative interest rates and terms.
+
+Every scenario (a combination of emergency rate, development rate and the two loan terms) is
+projected month by month over the same horizon in one set of NumPy arrays shaped
+scenarios x loans, so a grid of thousands of scenarios costs a few array operations per month
+rather than a Python loop per scenario and loan.
+
+Interest follows the group's flat method (see database.loan_balance): each month a loan with
+a balance accrues its monthly rate on the original amount. Each month the borrower repays
+their balance spread evenly over the months left in their term, scaled by a collection rate.
+Repayments collected can be lent out again at the scenario's rates and terms, in the current
+book's mix of development and emergency lending. Existing loans keep their contracted rate
+and due date unless `reprice_existing` is set.
+
+Nothing here touches the database; callers pass the loan book in (see
+repository.get_loans_with_balances).
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from database import (
+    SHARE_VALUE, EMERGENCY_MONTHLY_INTEREST_RATE, DEVELOPMENT_INTEREST_RATE, DEVELOPMENT_LOAN_TERM_MONTHS
+)
+
+EMERGENCY_LOAN_TERM_MONTHS = 1
+CURRENT_TERMS = {
+    'emergency_rate': EMERGENCY_MONTHLY_INTEREST_RATE * 100, # % per month
+    'development_rate': DEVELOPMENT_INTEREST_RATE, # % per year
+    'development_term': DEVELOPMENT_LOAN_TERM_MONTHS,
+    'emergency_term': EMERGENCY_LOAN_TERM_MONTHS,
+}
+
+def scenario_grid(emergency_rates, development_rates, development_terms, emergency_terms=(EMERGENCY_LOAN_TERM_MONTHS,)):
+    """Every combination of the given rates (%) and terms (months), plus the current terms.
+
+    The 'current' column marks the row with today's rates and terms; if the grid does not
+    contain them that row is added with 'in_grid' False, so it can be left out of grid plots.
+    """
+    grid = np.meshgrid(emergency_rates, development_rates, development_terms, emergency_terms, indexing='ij')
+    scenarios = pd.DataFrame({column: values.ravel() for column, values in zip(CURRENT_TERMS, grid)})
+    scenarios['in_grid'] = True
+    current = np.logical_and.reduce([np.isclose(scenarios[column], value) for column, value in CURRENT_TERMS.items()])
+    if not current.any():
+        scenarios = pd.concat([scenarios, pd.DataFrame([{**CURRENT_TERMS, 'in_grid': False}])], ignore_index=True)
+        current = np.append(current, True)
+    scenarios = scenarios.astype({'emergency_rate': float, 'development_rate': float, 'development_term': int, 'emergency_term': int})
+    scenarios['current'] = current
+    return scenarios.drop_duplicates(list(CURRENT_TERMS), ignore_index=True)
+
+def full_months_between(start, end):
+    """Calendar months from start to end as a float array; either may be a date column or one Timestamp."""
+    start, end = (pd.DatetimeIndex(pd.to_datetime(value)) if isinstance(value, pd.Series) else value
+                  for value in (start, end))
+    return np.asarray((end.year - start.year) * 12 + (end.month - start.month), dtype=float)
+
+def simulate_loan_book(loans, scenarios, months, as_of, relend_rate=1.0, collection_rate=1.0, reprice_existing=False):
+    """Projects the loan book over the next `months` months under every scenario at once.
+
+    `loans` needs type, amount, interest_rate, start_date, due_date and balance (the balance
+    as at `as_of`); `scenarios` is a scenario_grid. Returns a dict of:
+      monthly_income      scenarios x months interest accrued
+      monthly_repayments  scenarios x months repayments collected
+      monthly_balance     scenarios x months portfolio balance at each month end (incl. new lending)
+      loan_balances       scenarios x loans balance of each existing loan at the end of the horizon
+    """
+    as_of = pd.Timestamp(as_of)
+    scenario_count, loan_count = len(scenarios), len(loans)
+    is_development = (loans['type'] != 'emergency').to_numpy()
+    elapsed = np.maximum(full_months_between(loans['start_date'], as_of), 0)
+    months_to_due = np.maximum(np.nan_to_num(full_months_between(as_of, loans['due_date']), nan=1), 1)
+
+    # Monthly rates and terms of each scenario, as (scenarios, 1) columns
+    development_rate = scenarios['development_rate'].to_numpy()[:, None] / 100 / 12
+    emergency_rate = scenarios['emergency_rate'].to_numpy()[:, None] / 100
+    development_term = scenarios['development_term'].to_numpy()[:, None]
+    emergency_term = scenarios['emergency_term'].to_numpy()[:, None]
+
+    # Columns: the existing loans, then a development and an emergency slot for each month's new lending
+    width = loan_count + 2 * months
+    amount = np.zeros((scenario_count, width))
+    balance = np.zeros((scenario_count, width))
+    rate = np.zeros((scenario_count, width))
+    remaining = np.ones((scenario_count, width))
+    amount[:, :loan_count] = loans['amount'].to_numpy()
+    balance[:, :loan_count] = loans['balance'].to_numpy()
+    if reprice_existing:
+        rate[:, :loan_count] = np.where(is_development, development_rate, emergency_rate)
+        remaining[:, :loan_count] = np.maximum(np.where(is_development, development_term, emergency_term) - elapsed, 1)
+    else:
+        rate[:, :loan_count] = np.where(is_development, loans['interest_rate'].fillna(0).to_numpy() / 100 / 12,
+                                        EMERGENCY_MONTHLY_INTEREST_RATE)
+        remaining[:, :loan_count] = months_to_due
+    new_rates = np.hstack([development_rate, emergency_rate])
+    new_terms = np.hstack([development_term, emergency_term])
+    book = loans['amount'].sum()
+    development_share = loans.loc[is_development, 'amount'].sum() / book if book else 1.0
+    lending_mix = np.array([development_share, 1 - development_share])
+
+    monthly_income = np.zeros((scenario_count, months))
+    monthly_repayments = np.zeros((scenario_count, months))
+    monthly_balance = np.zeros((scenario_count, months))
+    for month in range(months):
+        interest = np.where(balance > 0.005, amount * rate, 0.0)
+        balance += interest
+        repaid = balance / remaining * collection_rate
+        balance -= repaid
+        remaining = np.maximum(remaining - 1, 1)
+        monthly_income[:, month] = interest.sum(axis=1)
+        monthly_repayments[:, month] = repaid.sum(axis=1)
+
+        slots = slice(loan_count + 2 * month, loan_count + 2 * month + 2)
+        lent = monthly_repayments[:, month, None] * relend_rate * lending_mix
+        amount[:, slots] = lent
+        balance[:, slots] = lent
+        rate[:, slots] = new_rates
+        remaining[:, slots] = new_terms
+        monthly_balance[:, month] = balance.sum(axis=1)
+
+    return {
+        'monthly_income': monthly_income,
+        'monthly_repayments': monthly_repayments,
+        'monthly_balance': monthly_balance,
+        'loan_balances': balance[:, :loan_count],
+    }
+
+def summarize_scenarios(scenarios, projection, expenses=0.0, shares_held=0.0, collection_rate=1.0):
+    """One row per scenario: interest income, repayments, closing balance and the dividend pool.
+
+    The dividend pool is the interest income collected over the horizon less `expenses` (the
+    projected running costs for the same months); it is shared per share of SHARE_VALUE over
+    `shares_held` (KSh). Changes are against the current-terms scenario.
+    """
+    summary = scenarios.copy()
+    summary['interest_income'] = projection['monthly_income'].sum(axis=1)
+    summary['repayments'] = projection['monthly_repayments'].sum(axis=1)
+    summary['closing_balance'] = projection['monthly_balance'][:, -1] if projection['monthly_balance'].shape[1] else 0.0
+    summary['dividend_pool'] = (summary['interest_income'] * collection_rate - expenses).clip(lower=0)
+    share_count = shares_held / SHARE_VALUE
+    summary['dividend_per_share'] = summary['dividend_pool'] / share_count if share_count else np.nan
+    baseline = summary.loc[summary['current'], 'dividend_pool']
+    summary['pool_change'] = summary['dividend_pool'] - (baseline.iloc[0] if len(baseline) else np.nan)
+    return summary
+
+def sample_loan_book(loan_count=1000, as_of=None, seed=0):
+    """Synthetic active loans (about 70% development) with their balances, for benchmarks."""
+    rng = np.random.default_rng(seed)
+    as_of = pd.Timestamp(as_of or '2026-01-01')
+    is_development = rng.random(loan_count) < 0.7
+    start = as_of - pd.to_timedelta(np.where(is_development, rng.integers(0, 360, loan_count), rng.integers(0, 30, loan_count)), unit='D')
+    amount = rng.integers(5, 200, loan_count) * 1000.0
+    return pd.DataFrame({
+        'member_id': rng.integers(1, loan_count // 2 + 2, loan_count),
+        'type': np.where(is_development, 'development', 'emergency'),
+        'amount': amount,
+        'interest_rate': np.where(is_development, DEVELOPMENT_INTEREST_RATE, EMERGENCY_MONTHLY_INTEREST_RATE * 100),
+        'start_date': start,
+        'due_date': start + pd.to_timedelta(np.where(is_development, 365, 30), unit='D'),
+        'balance': amount * rng.uniform(0.2, 1.1, loan_count),
+    })
+
+def benchmark_rate_simulation(loan_count=1000, scenario_count=1000, months=24):
+    """Times projecting a grid of about `scenario_count` scenarios at once against one scenario at a time.
+
+    The per-scenario baseline runs the same projection once per scenario, the way a loop over
+    rate choices would; both must give the same interest income.
+    """
+    as_of = pd.Timestamp('2026-01-01')
+    loans = sample_loan_book(loan_count, as_of)
+    side = max(1, round(scenario_count ** (1 / 3)))
+    scenarios = scenario_grid(np.linspace(1, 4, side), np.linspace(6, 18, side), np.linspace(6, 24, side).round())
+
+    timer = time.perf_counter()
+    projection = simulate_loan_book(loans, scenarios, months, as_of)
+    vectorized_seconds = time.perf_counter() - timer
+
+    looped = min(len(scenarios), 50) # enough scenarios to time the loop, extrapolated to the grid
+    timer = time.perf_counter()
+    incomes = [simulate_loan_book(loans, scenarios.iloc[[n]], months, as_of)['monthly_income'].sum()
+               for n in range(looped)]
+    loop_seconds = (time.perf_counter() - timer) / looped * len(scenarios)
+    if not np.allclose(incomes, projection['monthly_income'][:looped].sum(axis=1)):
+        raise AssertionError("The vectorized projection disagrees with the per-scenario one")
+    return {
+        'loans': loan_count, 'scenarios': len(scenarios), 'months': months,
+        'vectorized_ms': vectorized_seconds * 1000, 'per_scenario_ms': loop_seconds * 1000,
+        'speedup': loop_seconds / vectorized_seconds,
+    }